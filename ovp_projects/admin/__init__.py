@@ -1,5 +1,6 @@
 from .apply import *
 from .job import *
 from .jobdate import *
+from .outbox import *
 from .project import *
 from .work import *
\ No newline at end of file
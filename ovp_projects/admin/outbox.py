@@ -0,0 +1,13 @@
+from django.contrib import admin
+
+from ovp_projects.models import OutboxEmail
+
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+  list_display = ['id', 'template_name', 'recipient', 'status', 'attempts', 'created_date', 'sent_date']
+  list_filter = ['status', 'template_name']
+  search_fields = ['recipient']
+  readonly_fields = ['created_date', 'sent_date', 'last_error', 'claimed_by']
+
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -26,6 +26,7 @@ class ProjectAdmin(admin.ModelAdmin, CountryFilterMixin):
 
     ('published', 'closed', 'deleted'),
     ('published_date', 'closed_date', 'deleted_date'),
+    ('publish_at', 'close_at'),
 
     'address',
     'image',
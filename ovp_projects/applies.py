@@ -0,0 +1,224 @@
+"""
+Bulk apply operations
+
+Bulk operations write applies with set based queries instead of saving
+them one by one, so Apply.save side effects are applied here for the
+whole set: counters are updated with summed deltas, emails are enqueued
+on the outbox with a single insert and the cached project representation
+is invalidated, as queryset writes fire no signals. Emails go to the
+outbox even if OVP_PROJECTS['EMAIL_OUTBOX'] is off, as sending thousands
+of them inline would hold the request, so send_outbox_emails must run
+for them to be delivered.
+
+Single apply and unapply go through transition_apply, a compare and set
+UPDATE which only succeeds if the apply is still in the state read, so
+concurrent requests can't apply the same counter delta twice. It works
+the same on backends without row locks, such as SQLite.
+"""
+
+from django.db import IntegrityError
+from django.db import transaction
+from django.utils import timezone
+
+from ovp_projects import capacity
+from ovp_projects import counters
+from ovp_projects.cache import touch_projects
+from ovp_projects.emails import batch_outbox
+from ovp_projects.models import Apply
+
+from collections import defaultdict
+
+TRANSITION_ATTEMPTS = 3
+IMPORT_ATTEMPTS = 3
+
+
+def get_status_values(status, now=None):
+  """ Returns the apply fields written when moving an apply to status """
+  canceled = status == 'unapplied'
+  return {'status': status, 'canceled': canceled, 'canceled_date': (now or timezone.now()) if canceled else None}
+
+
+def transition_apply(queryset, status):
+  """ Moves the apply matching queryset to status.
+
+  The apply is read and then written with an UPDATE conditioned on the
+  state read, which is the first statement of its transaction, so SQLite
+  takes its write lock before reading anything else. If another request
+  moved the apply in between, no row matches and it's read again.
+  Counters, unapply emails and the cache are handled as by Apply.save.
+  Returns the apply, which is left as is if it's already in status, or
+  None if no apply matches queryset.
+  """
+  values = get_status_values(status)
+
+  for attempt in range(TRANSITION_ATTEMPTS):
+    apply = queryset.select_related('user').order_by('pk').first()
+    if apply is None:
+      return None
+    if apply.status == status and apply.canceled == values['canceled']:
+      return apply
+
+    with transaction.atomic():
+      if not Apply.objects.filter(pk=apply.pk, status=apply.status, canceled=apply.canceled).update(**values):
+        continue
+
+      previous_state = counters.get_counting_state(apply.status, apply.canceled, apply.role_id)
+      for field, value in values.items():
+        setattr(apply, field, value)
+
+      reserved = capacity.admit([apply], [previous_state])
+      if apply.status != status:
+        Apply.objects.filter(pk=apply.pk).update(status=apply.status)
+      apply.snapshot_fields(list(values))
+
+      counters.update_apply_counters(apply, previous_state, reserved=bool(reserved))
+      new_state = counters.get_counting_state(apply.status, apply.canceled, apply.role_id)
+      capacity.promote_freed_seats(counters.get_counter_deltas([(apply.project_id, previous_state, new_state)])[0])
+
+      if values['canceled']:
+        apply.mailing().sendUnappliedToVolunteer({'apply': apply})
+        apply.mailing().sendUnappliedToOwner({'apply': apply})
+
+      touch_projects([apply.project_id])
+      return apply
+
+  return None
+
+
+def get_applied_emails(project):
+  """ Returns the lowercased emails which applied to project """
+  return {email.lower() for email in Apply.objects.filter(project=project).values_list('email', flat=True) if email}
+
+
+def import_applies(project, rows):
+  """ Creates an apply on project for each validated row.
+
+  Rows whose email already applied to the project, or repeats an earlier
+  row, are skipped, emails being compared case insensitively. With hard
+  role capacity, rows are given the seats left in order and the others
+  are waitlisted. If a concurrent apply takes one of the emails before
+  the insert, the import is rolled back and attempted again, skipping it.
+  Emails always go to the outbox, delivered by send_outbox_emails.
+  Returns a (created applies, skipped rows) tuple.
+  """
+  for attempt in range(IMPORT_ATTEMPTS):
+    try:
+      with transaction.atomic():
+        return insert_applies(project, rows)
+    except IntegrityError:
+      if attempt == IMPORT_ATTEMPTS - 1:
+        raise
+
+
+def insert_applies(project, rows):
+  """ Creates applies of import_applies, inside its transaction """
+  existing = get_applied_emails(project)
+
+  applies = []
+  skipped = 0
+  for row in rows:
+    email = row['email'].lower()
+    if email in existing:
+      skipped += 1
+      continue
+    existing.add(email)
+
+    applies.append(Apply(project=project, email=row['email'], username=row.get('username', None), phone=row.get('phone', None), role_id=row.get('role', None)))
+
+  if not applies:
+    return (applies, skipped)
+
+  reserved = capacity.admit(applies, [None] * len(applies))
+  Apply.objects.bulk_create(applies)
+
+  transitions = [(project.pk, None, counters.get_counting_state(apply.status, apply.canceled, apply.role_id)) for apply in applies]
+  apply_counter_deltas(transitions, reserved)
+
+  with batch_outbox(enqueue=True):
+    for apply in applies:
+      if apply.status == counters.WAITLISTED_STATUS:
+        apply.mailing().sendWaitlistedToVolunteer({'apply': apply})
+      else:
+        apply.mailing().sendAppliedToVolunteer({'apply': apply})
+      apply.mailing().sendAppliedToOwner({'apply': apply})
+
+  touch_projects([project.pk])
+
+  return (applies, skipped)
+
+
+def update_applies_status(project, ids, status):
+  """ Moves applies ids of project to status.
+
+  Applies are locked and grouped by their current and new status, and
+  each group is moved with a single UPDATE writing the same canceled
+  fields as Apply.save. With hard role capacity, applies are given the
+  seats left oldest first and the others are waitlisted. Volunteers moved
+  to 'unapplied' or promoted from waitlists and the project owner are
+  notified through the outbox, delivered by send_outbox_emails. Returns
+  a {id: result} dict, result being 'updated', 'waitlisted', 'unchanged'
+  or 'not_found'. Raises ValueError for 'waitlisted', which only capacity
+  admission sets.
+  """
+  if status == counters.WAITLISTED_STATUS:
+    raise ValueError('Applies are only waitlisted by capacity.admit')
+
+  results = {pk: 'not_found' for pk in ids}
+  values = get_status_values(status)
+
+  with transaction.atomic():
+    applies = Apply.objects.select_for_update().filter(project=project, pk__in=ids).prefetch_related('user')
+    moving = []
+    previous = {}
+    for apply in applies.order_by('date', 'pk'):
+      results[apply.pk] = 'unchanged'
+      if apply.status != status:
+        previous[apply.pk] = (apply.status, counters.get_counting_state(apply.status, apply.canceled, apply.role_id))
+        apply.status = status
+        moving.append(apply)
+
+    reserved = capacity.admit(moving, [previous[apply.pk][1] for apply in moving])
+
+    groups = defaultdict(list)
+    for apply in moving:
+      results[apply.pk] = 'waitlisted' if apply.status == counters.WAITLISTED_STATUS else 'updated'
+      if apply.status != previous[apply.pk][0]:
+        groups[(previous[apply.pk][0], apply.status)].append(apply)
+
+    transitions = []
+    for (previous_status, new_status), group in groups.items():
+      Apply.objects.filter(pk__in=[apply.pk for apply in group], status=previous_status).update(**dict(values, status=new_status))
+
+      for apply in group:
+        transitions.append((project.pk, previous[apply.pk][1], counters.get_counting_state(new_status, values['canceled'], apply.role_id)))
+
+        apply.project = project
+        apply.canceled = values['canceled']
+        apply.canceled_date = values['canceled_date']
+        apply.snapshot_fields(list(values))
+
+    # Promotions are enqueued along with unapply emails
+    with batch_outbox(enqueue=True):
+      apply_counter_deltas(transitions, reserved)
+
+      if values['canceled']:
+        for group in groups.values():
+          for apply in group:
+            apply.mailing().sendUnappliedToVolunteer({'apply': apply})
+            apply.mailing().sendUnappliedToOwner({'apply': apply})
+
+    if groups:
+      touch_projects([project.pk])
+
+  return results
+
+
+def apply_counter_deltas(transitions, reserved):
+  """ Applies counter deltas of transitions, less the role seats already
+      reserved, and promotes waitlists of roles with freed seats """
+  role_deltas, project_deltas = counters.get_counter_deltas(transitions)
+  for role_id, seats in reserved.items():
+    role_deltas[role_id] -= seats
+
+  counters.apply_counter_deltas(role_deltas, project_deltas)
+  capacity.promote_freed_seats(role_deltas)
@@ -0,0 +1,252 @@
+"""
+Project retrieve cache
+
+Each project has a content version, the time in milliseconds of its last
+change, kept on the cache under its pk. Saving or deleting the project or
+any of its roles, applies, job, job dates or work, or saving its
+organization, address or owner, bumps the version, both
+immediately and once the transaction commits, so entries written while
+the transaction was open are not served afterwards.
+
+Retrieve payloads are cached under the project slug and version, so a
+bump invalidates them without deleting anything. A miss is computed by a
+single request at a time per key, other requests wait for its result.
+
+Versions also derive the ETag and Last-Modified validators of retrieve
+responses, and once a change commits, the surrogate keys of the changed
+projects are sent to the purge hook, so CDNs can drop their copies.
+
+Enabled with OVP_PROJECTS.RETRIEVE_CACHE, CONDITIONAL_RETRIEVE and
+PURGE_HOOK(a dotted path to a callable receiving a list of keys).
+Versions must be shared by every process, so a shared cache backend is
+required. The alias is set by OVP_PROJECTS.CACHE_ALIAS.
+"""
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from ovp_core.helpers import get_address_model, import_from_string
+
+from ovp_organizations.models import Organization
+
+from ovp_users.models import User
+
+from ovp_projects.helpers import get_settings
+from ovp_projects.models import Project, VolunteerRole, Apply, Job, JobDate, Work
+
+import hashlib
+import time
+
+RETRIEVE_CACHE_TIMEOUT = 300
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+
+
+def is_retrieve_cache_enabled():
+  return get_settings().get('RETRIEVE_CACHE', False)
+
+
+def is_conditional_retrieve_enabled():
+  return get_settings().get('CONDITIONAL_RETRIEVE', False)
+
+
+def is_versioning_enabled():
+  return is_retrieve_cache_enabled() or is_conditional_retrieve_enabled() or get_purge_hook() is not None
+
+
+def get_purge_hook():
+  path = get_settings().get('PURGE_HOOK', None)
+  return import_from_string(path) if path else None
+
+
+def get_cache():
+  return caches[get_settings().get('CACHE_ALIAS', 'default')]
+
+
+def get_version_key(pk):
+  return 'ovp_projects:project:{}:version'.format(pk)
+
+
+def get_slug_key(slug):
+  return 'ovp_projects:slug:{}'.format(slug)
+
+
+def get_retrieve_key(slug, version):
+  return 'ovp_projects:retrieve:{}:{}'.format(slug, version)
+
+
+def get_surrogate_keys(pks):
+  return ['project-{}'.format(pk) for pk in pks]
+
+
+def get_etag(pk, version, *variants):
+  """ Returns a strong ETag for a representation of project pk at version.
+      variants are whatever else the representation depends on """
+  parts = [str(pk), str(version)] + [str(variant) for variant in variants]
+  return hashlib.sha1(':'.join(parts).encode('utf-8')).hexdigest()
+
+
+def now_ms():
+  return int(time.time() * 1000)
+
+
+def get_project_version(pk):
+  """ Returns the content version of project pk, starting it if missing """
+  cache = get_cache()
+  key = get_version_key(pk)
+  cache.add(key, now_ms(), None)
+  return cache.get(key)
+
+
+def touch_projects(pks):
+  """ Bumps the content version of projects pks now and on commit, when
+      their surrogate keys are also purged """
+  pks = sorted(pk for pk in set(pks) if pk is not None)
+  if not pks or not is_versioning_enabled():
+    return
+
+  def bump():
+    cache = get_cache()
+    keys = [get_version_key(pk) for pk in pks]
+    versions = cache.get_many(keys)
+    now = now_ms()
+    cache.set_many({key: max(now, versions.get(key, 0) + 1) for key in keys}, None)
+
+  def bump_and_purge():
+    bump()
+    purge = get_purge_hook()
+    if purge is not None:
+      purge(get_surrogate_keys(pks))
+
+  bump()
+  transaction.on_commit(bump_and_purge)
+
+
+def get_project_pk(slug, load):
+  """ Returns the pk of the project slug, calling load() on cache misses.
+      The mapping doesn't expire, it's forgotten when the project slug
+      changes or the project is deleted, which frees the slug """
+  cache = get_cache()
+  key = get_slug_key(slug)
+  pk = cache.get(key)
+  if pk is None:
+    pk = load()
+    cache.set(key, pk, None)
+  return pk
+
+
+def forget_slug(slug):
+  """ Drops the cached pk of slug now and on commit, so requests made
+      while the transaction is open can't cache it again """
+  if not slug or not is_versioning_enabled():
+    return
+
+  def forget():
+    get_cache().delete(get_slug_key(slug))
+
+  forget()
+  transaction.on_commit(forget)
+
+
+def get_or_build(key, build, timeout=RETRIEVE_CACHE_TIMEOUT):
+  """ Returns the cached value for key, calling build() on misses.
+
+  Only the request holding the key lock builds the value. Others poll the
+  cache for up to LOCK_WAIT seconds and then build it themselves, so a
+  failing or slow builder doesn't block them forever.
+  """
+  cache = get_cache()
+  value = cache.get(key)
+  if value is not None:
+    return value
+
+  lock_key = '{}:lock'.format(key)
+  if cache.add(lock_key, 1, LOCK_TIMEOUT):
+    try:
+      value = build()
+      cache.set(key, value, timeout)
+      return value
+    finally:
+      cache.delete(lock_key)
+
+  deadline = time.time() + LOCK_WAIT
+  while time.time() < deadline:
+    time.sleep(LOCK_POLL_INTERVAL)
+    value = cache.get(key)
+    if value is not None:
+      return value
+
+  return build()
+
+
+"""
+Invalidation receivers
+"""
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def touch_project(sender, instance, **kwargs):
+  touch_projects([instance.pk])
+
+
+@receiver(post_save, sender=Project)
+def forget_changed_slug(sender, instance, created=False, **kwargs):
+  # Runs before save() snapshots the new values
+  if not created and instance.has_changed('slug'):
+    forget_slug(instance.get_original('slug'))
+
+
+@receiver(post_delete, sender=Project)
+def forget_deleted_slug(sender, instance, **kwargs):
+  forget_slug(instance.slug)
+
+
+@receiver(post_save, sender=VolunteerRole)
+@receiver(post_delete, sender=VolunteerRole)
+@receiver(post_save, sender=Apply)
+@receiver(post_delete, sender=Apply)
+@receiver(post_save, sender=Job)
+@receiver(post_delete, sender=Job)
+@receiver(post_save, sender=Work)
+@receiver(post_delete, sender=Work)
+def touch_child_project(sender, instance, **kwargs):
+  touch_projects([instance.project_id])
+
+
+@receiver(post_save, sender=JobDate)
+@receiver(post_delete, sender=JobDate)
+def touch_job_date_project(sender, instance, **kwargs):
+  if instance.job_id is not None and is_versioning_enabled():
+    touch_projects(Job.objects.filter(pk=instance.job_id).values_list('project_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Project.causes.through)
+@receiver(m2m_changed, sender=Project.skills.through)
+def touch_m2m_projects(sender, instance, action, reverse, pk_set, **kwargs):
+  if action in ['post_add', 'post_remove', 'post_clear']:
+    touch_projects((pk_set or []) if reverse else [instance.pk])
+
+
+@receiver(m2m_changed, sender=Organization.members.through)
+def touch_organization_projects(sender, instance, action, reverse, pk_set, **kwargs):
+  # Membership changes whether hidden addresses are visible to a user
+  if action in ['post_add', 'post_remove', 'post_clear'] and is_versioning_enabled():
+    if reverse:
+      projects = Project.objects.filter(organization__in=pk_set or [])
+    else:
+      projects = Project.objects.filter(organization=instance)
+    touch_projects(projects.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_save, sender=get_address_model())
+@receiver(post_save, sender=User)
+def touch_related_projects(sender, instance, raw=False, **kwargs):
+  # Retrieve payloads embed organization, address and owner data
+  if raw or kwargs.get('created', False) or not is_versioning_enabled():
+    return
+
+  field = {Organization: 'organization', User: 'owner'}.get(sender, 'address')
+  touch_projects(Project.objects.filter(**{field: instance}).values_list('pk', flat=True))
@@ -0,0 +1,179 @@
+"""
+Hard role capacity
+
+Enabled with OVP_PROJECTS.HARD_ROLE_CAPACITY. Roles with vacancies are
+never filled beyond them: before an apply enters a role count, a seat is
+reserved with UPDATE ... WHERE applied_count < vacancies, which adds the
+apply to the role counter only if a seat is left. Applies which don't get
+one are waitlisted.
+
+Waitlisted applies are promoted in FIFO order whenever seats are freed,
+a whole batch at once. The waitlist head is read through the (role,
+status, date) index, so promotions don't scan waitlisted applies.
+
+Reservations and promotions of more than one seat lock the role row
+first with a no-op UPDATE, which also takes the write lock on SQLite.
+
+Waitlisted applies of removed roles are applied, as applies without a
+role have no capacity limit.
+"""
+
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Q
+
+from ovp_projects import counters
+from ovp_projects.emails import batch_outbox
+from ovp_projects.helpers import get_settings
+
+
+
+def is_hard_capacity_enabled():
+  return get_settings().get('HARD_ROLE_CAPACITY', False)
+
+
+def lock_role(role_id):
+  """ Locks the role row until the end of the current transaction """
+  VolunteerRole = apps.get_model('ovp_projects', 'VolunteerRole')
+  VolunteerRole.objects.filter(pk=role_id).update(applied_count=F('applied_count'))
+
+
+def reserve_seats(role_id, count=1):
+  """ Adds up to count applies to the role counter, without exceeding its
+      vacancies. Roles without vacancies have unlimited seats. Returns
+      the number of reserved seats """
+  VolunteerRole = apps.get_model('ovp_projects', 'VolunteerRole')
+  roles = VolunteerRole.objects.filter(pk=role_id)
+
+  if count == 1:
+    return roles.filter(Q(vacancies__isnull=True) | Q(applied_count__lt=F('vacancies'))).update(applied_count=F('applied_count') + 1)
+
+  with transaction.atomic():
+    lock_role(role_id)
+    row = roles.values_list('applied_count', 'vacancies').first()
+    if row is None:
+      return 0
+
+    applied_count, vacancies = row
+    reserved = count if vacancies is None else max(0, min(count, vacancies - applied_count))
+    if reserved:
+      roles.update(applied_count=F('applied_count') + reserved)
+    return reserved
+
+
+def is_entering_role(status, role_id, previous_state=None):
+  """ Whether an apply moving to status on role_id enters the role count """
+  counted_role_id = counters.get_counting_state(status, False, role_id)[0]
+  return counted_role_id is not None and counted_role_id != (previous_state or (None, False))[0]
+
+
+def admit(applies, previous_states):
+  """ Admits applies, in order, to the seats left on their roles.
+
+  applies hold the status they move to and previous_states the counting
+  states they move from, None for new applies. Applies entering a role
+  count once its seats are taken are set as waitlisted. Returns the
+  {role id: reserved seats} dict, those seats being already added to the
+  role counters.
+  """
+  if not is_hard_capacity_enabled():
+    return {}
+
+  entering = defaultdict(list)
+  for apply, previous_state in zip(applies, previous_states):
+    if is_entering_role(apply.status, apply.role_id, previous_state):
+      entering[apply.role_id].append(apply)
+
+  reserved = {}
+  for role_id, role_applies in entering.items():
+    reserved[role_id] = reserve_seats(role_id, len(role_applies))
+    for apply in role_applies[reserved[role_id]:]:
+      apply.status = counters.WAITLISTED_STATUS
+
+  return reserved
+
+
+def promote_waitlist(role_ids):
+  """ Promotes waitlisted applies of roles role_ids to 'applied' while
+      seats are left, oldest first, and notifies promoted volunteers.
+      Returns promoted applies. Callers invalidate the project cache """
+  if not is_hard_capacity_enabled() or not role_ids:
+    return []
+
+  Apply = apps.get_model('ovp_projects', 'Apply')
+  VolunteerRole = apps.get_model('ovp_projects', 'VolunteerRole')
+  Project = apps.get_model('ovp_projects', 'Project')
+  promoted = []
+
+  roles = VolunteerRole.objects.filter(pk__in=set(role_ids), project__isnull=False, vacancies__isnull=False, applied_count__lt=F('vacancies'))
+  for role_id in roles.values_list('pk', flat=True):
+    with transaction.atomic():
+      lock_role(role_id)
+      role = VolunteerRole.objects.select_related('project__owner').get(pk=role_id)
+
+      # Rows are locked, so every apply read is moved. Users are prefetched,
+      # as rows on the nullable side of a join can't be locked
+      waitlist = Apply.objects.select_for_update().filter(role=role, status=counters.WAITLISTED_STATUS).prefetch_related('user')
+      applies = list(waitlist.order_by('date', 'pk')[:max(0, role.vacancies - role.applied_count)])
+      if not applies:
+        continue
+
+      count = Apply.objects.filter(pk__in=[apply.pk for apply in applies]).update(status='applied')
+      VolunteerRole.objects.filter(pk=role.pk).update(applied_count=F('applied_count') + count)
+      Project.objects.filter(pk=role.project_id).update(applied_count=F('applied_count') + count)
+
+      with batch_outbox():
+        for apply in applies:
+          apply.status = 'applied'
+          apply.role = role
+          apply.project = role.project
+          apply.snapshot_fields(['status'])
+          apply.mailing().sendPromotedToVolunteer({'apply': apply})
+          promoted.append(apply)
+
+  return promoted
+
+
+def promote_freed_seats(role_deltas):
+  """ Promotes waitlists of roles which lost applies on role_deltas, as
+      returned by counters.get_counter_deltas """
+  return promote_waitlist([pk for pk, delta in role_deltas.items() if delta < 0])
+
+
+def release_waitlist(role_ids):
+  """ Moves waitlisted applies of roles role_ids, which are being removed,
+      to 'applied' and notifies their volunteers. Applies without a role
+      have no capacity limit, so they'd otherwise be waitlisted forever.
+      Returns released applies. Callers invalidate the project cache """
+  if not role_ids:
+    return []
+
+  Apply = apps.get_model('ovp_projects', 'Apply')
+  released = []
+
+  with transaction.atomic():
+    for role_id in sorted(set(role_ids)):
+      lock_role(role_id)
+
+    waitlist = Apply.objects.select_for_update().filter(role__in=role_ids, status=counters.WAITLISTED_STATUS)
+    applies = list(waitlist.prefetch_related('user', 'project').order_by('pk'))
+    if not applies:
+      return []
+
+    Apply.objects.filter(pk__in=[apply.pk for apply in applies]).update(status='applied')
+
+    project_deltas = defaultdict(int)
+    for apply in applies:
+      project_deltas[apply.project_id] += 1
+    counters.apply_counter_deltas({}, project_deltas)
+
+    with batch_outbox():
+      for apply in applies:
+        apply.status = 'applied'
+        apply.snapshot_fields(['status'])
+        apply.mailing().sendPromotedToVolunteer({'apply': apply})
+        released.append(apply)
+
+  return released
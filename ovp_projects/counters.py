@@ -0,0 +1,124 @@
+"""
+Denormalized applied counters
+
+VolunteerRole.applied_count counts applies with a status in
+ROLE_COUNTED_STATUSES, Project.applied_count counts applies which are not
+canceled nor waitlisted. Both are maintained with atomic F() deltas
+computed from an apply state transition, so concurrent applies never
+overwrite each other.
+"""
+
+from collections import defaultdict
+
+from django.apps import apps
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+ROLE_COUNTED_STATUSES = ('applied', 'confirmed-volunteer')
+WAITLISTED_STATUS = 'waitlisted'
+
+
+def get_counting_state(status, canceled, role_id):
+  """ Returns a (counted role id, counted by project) tuple for an apply state """
+  role_id = role_id if status in ROLE_COUNTED_STATUSES else None
+  return (role_id, not canceled and status != WAITLISTED_STATUS)
+
+
+def update_apply_counters(apply, previous_state=None, reserved=False):
+  """ Applies counter deltas for an apply that moved from previous_state
+      to its current state. previous_state is None for new applies.
+      reserved tells the apply was already added to its role counter,
+      as done by capacity.reserve_seats """
+  old_role_id, old_counted = previous_state or (None, False)
+  new_role_id, new_counted = get_counting_state(apply.status, apply.canceled, apply.role_id)
+
+  if old_role_id != new_role_id:
+    if old_role_id:
+      _add_to_counter(apply, 'role', old_role_id, -1)
+    if new_role_id and not reserved:
+      _add_to_counter(apply, 'role', new_role_id, 1)
+
+  if old_counted != new_counted:
+    _add_to_counter(apply, 'project', apply.project_id, 1 if new_counted else -1)
+
+
+def _add_to_counter(apply, field_name, pk, delta):
+  field = apply._meta.get_field(field_name)
+  field.related_model.objects.filter(pk=pk).update(applied_count=F('applied_count') + delta)
+
+  # Mirror the delta on the cached related instance, if any
+  cached = getattr(apply, field.get_cache_name(), None)
+  if cached is not None and cached.pk == pk:
+    cached.applied_count += delta
+
+
+def get_counter_deltas(transitions):
+  """ Sums counter deltas of many apply transitions.
+
+  transitions is an iterable of (project id, previous state, new state)
+  tuples, states as returned by get_counting_state and previous state
+  being None for new applies. Returns a ({role id: delta}, {project id:
+  delta}) tuple.
+  """
+  role_deltas = defaultdict(int)
+  project_deltas = defaultdict(int)
+
+  for project_id, previous_state, new_state in transitions:
+    old_role_id, old_counted = previous_state or (None, False)
+    new_role_id, new_counted = new_state
+
+    if old_role_id != new_role_id:
+      if old_role_id:
+        role_deltas[old_role_id] -= 1
+      if new_role_id:
+        role_deltas[new_role_id] += 1
+
+    if old_counted != new_counted:
+      project_deltas[project_id] += 1 if new_counted else -1
+
+  return (role_deltas, project_deltas)
+
+
+def apply_counter_deltas(role_deltas, project_deltas):
+  """ Applies summed deltas with one atomic UPDATE per distinct delta """
+  VolunteerRole = apps.get_model('ovp_projects', 'VolunteerRole')
+  Project = apps.get_model('ovp_projects', 'Project')
+
+  for model, deltas in [(VolunteerRole, role_deltas), (Project, project_deltas)]:
+    grouped = defaultdict(list)
+    for pk, delta in deltas.items():
+      if delta:
+        grouped[delta].append(pk)
+
+    for delta, pks in grouped.items():
+      model.objects.filter(pk__in=pks).update(applied_count=F('applied_count') + delta)
+
+
+def recount_applied_counters():
+  """ Reconciles drifted counters with the applies table.
+
+  Each counter is recomputed with a single aggregate query and drifted
+  rows are fixed with one UPDATE per distinct value.
+  Returns a (fixed roles, fixed projects) tuple.
+  """
+  VolunteerRole = apps.get_model('ovp_projects', 'VolunteerRole')
+  Project = apps.get_model('ovp_projects', 'Project')
+
+  fixed_roles = _reconcile(VolunteerRole, When(apply__status__in=ROLE_COUNTED_STATUSES, then=Value(1)))
+  fixed_projects = _reconcile(Project, When(apply__status=WAITLISTED_STATUS, then=Value(0)), When(apply__canceled=False, then=Value(1)))
+  return (fixed_roles, fixed_projects)
+
+
+def _reconcile(model, *whens):
+  counted = Sum(Case(*whens, default=Value(0), output_field=IntegerField()))
+  rows = model.objects.order_by().annotate(counted=counted).values_list('pk', 'applied_count', 'counted')
+
+  drifted = defaultdict(list)
+  for pk, applied_count, real_count in rows:
+    real_count = real_count or 0
+    if applied_count != real_count:
+      drifted[real_count].append(pk)
+
+  for applied_count, pks in drifted.items():
+    model.objects.filter(pk__in=pks).update(applied_count=applied_count)
+
+  return sum(len(pks) for pks in drifted.values())
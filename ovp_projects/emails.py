@@ -1,8 +1,116 @@
-from ovp_core.emails import BaseMail
+from ovp_core.emails import BaseMail, EmailThread, inject_client_url
+from ovp_core.helpers import get_settings, is_email_enabled, get_email_subject
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
-from ovp_core.helpers import get_settings
 
-class ProjectMail(BaseMail):
+from ovp_projects import helpers
+from ovp_projects.models.outbox import OutboxEmail
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+import threading
+import time
+import uuid
+
+
+_outbox_batch = threading.local()
+
+
+@contextmanager
+def batch_outbox(enqueue=False):
+  """ Collects outbox emails enqueued inside the block and inserts them
+      with a single bulk_create once the current transaction commits.
+      Templates are loaded once for the whole block.
+
+      With enqueue, emails sent inside the block go to the outbox even if
+      OVP_PROJECTS['EMAIL_OUTBOX'] is off, so a bulk operation doesn't send
+      thousands of emails inline. The send_outbox_emails command must then
+      run to deliver them """
+  emails = []
+  previous = getattr(_outbox_batch, 'emails', None)
+  previous_templates = getattr(_outbox_batch, 'templates', None)
+  previous_enqueue = getattr(_outbox_batch, 'enqueue', False)
+  _outbox_batch.emails = emails
+  _outbox_batch.templates = previous_templates if previous_templates is not None else {}
+  _outbox_batch.enqueue = enqueue or previous_enqueue
+  try:
+    yield emails
+  finally:
+    _outbox_batch.emails = previous
+    _outbox_batch.templates = previous_templates
+    _outbox_batch.enqueue = previous_enqueue
+
+  if emails:
+    transaction.on_commit(lambda: OutboxEmail.objects.bulk_create(emails))
+
+
+def get_batch_template(name):
+  """ Returns template name, reusing it within a batch_outbox block """
+  templates = getattr(_outbox_batch, 'templates', None)
+  if templates is None:
+    return get_template(name)
+
+  if name not in templates:
+    templates[name] = get_template(name)
+  return templates[name]
+
+
+class OutboxMail(BaseMail):
+  """
+  BaseMail which, if OVP_PROJECTS['EMAIL_OUTBOX'] is set, renders the email
+  and enqueues it on OutboxEmail once the current transaction commits
+  instead of sending it inline. Emails are then dispatched by the
+  send_outbox_emails command.
+
+  Otherwise the email is rendered right away and sent inline once the
+  current transaction commits, so no email is sent for changes which are
+  rolled back, unless it's sent inside a batch_outbox(enqueue=True) block.
+  """
+  def sendEmail(self, template_name, subject, context={}):
+    if not is_email_enabled(template_name) or not self.email_address:
+      return False
+
+    with translation.override(self.locale):
+      subject = get_email_subject(template_name, subject)
+      context = inject_client_url(context)
+      text_content = get_batch_template('email/{}.txt'.format(template_name)).render(context)
+      html_content = get_batch_template('email/{}.html'.format(template_name)).render(context)
+
+    if not helpers.get_settings().get('EMAIL_OUTBOX', False) and not getattr(_outbox_batch, 'enqueue', False):
+      msg = EmailMultiAlternatives(subject, text_content, self.from_email, [self.email_address])
+      msg.attach_alternative(html_content, "text/html")
+      transaction.on_commit(lambda: self.sendInline(msg))
+      return msg
+
+    email = OutboxEmail(template_name=template_name, from_email=self.from_email, recipient=self.email_address, subject=subject, text_content=text_content, html_content=html_content)
+
+    batch = getattr(_outbox_batch, 'emails', None)
+    if batch is not None:
+      batch.append(email)
+    else:
+      transaction.on_commit(email.save)
+
+    return email
+
+  def sendInline(self, msg):
+    """ Sends msg on a thread unless async_mail is False, or None and DEFAULT_SEND_EMAIL isn't 'async' """
+    if self.async_mail or (self.async_mail is None and getattr(settings, "DEFAULT_SEND_EMAIL", "async") == "async"):
+      thread = EmailThread(msg)
+      thread.start()
+      return thread
+
+    return msg.send() > 0
+
+class ProjectMail(OutboxMail):
   """
   This class is responsible for firing emails for Project related actions
 
@@ -33,7 +141,7 @@ class ProjectMail(BaseMail):
 
 
 
-class ApplyMail(BaseMail):
+class ApplyMail(OutboxMail):
   """
   This class is responsible for firing emails for apply related actions
   """
@@ -58,6 +166,20 @@ class ApplyMail(BaseMail):
     return self.sendEmail('volunteerApplied-ToOwner', 'New volunteer', context)
 
 
+  def sendWaitlistedToVolunteer(self, context={}):
+    """
+    Sent to user when he applies to a role with no vacancies left
+    """
+    return self.sendEmail('volunteerWaitlisted-ToVolunteer', 'Waitlisted for project', context)
+
+
+  def sendPromotedToVolunteer(self, context={}):
+    """
+    Sent to user when a vacancy opens up and he leaves the waitlist
+    """
+    return self.sendEmail('volunteerPromoted-ToVolunteer', 'Applied to project', context)
+
+
   def sendUnappliedToVolunteer(self, context={}):
     """
     Sent to user when he unapplies from a project
@@ -74,7 +196,7 @@ class ApplyMail(BaseMail):
 
 
 
-class ProjectAdminMail(BaseMail):
+class ProjectAdminMail(OutboxMail):
   """
   This class is responsible for firing emails for Project related actions
   """
@@ -89,3 +211,103 @@ class ProjectAdminMail(BaseMail):
     Sent when user creates a project
     """
     return self.sendEmail('projectCreatedToAdmin', 'Project created', context)
+
+
+
+"""
+Outbox worker
+"""
+class RateLimiter(object):
+  """
+  Thread safe limiter which spaces calls to .wait() to at most rate per second
+  """
+  def __init__(self, rate=None):
+    self.interval = 1.0 / rate if rate else 0
+    self.next_slot = time.monotonic()
+    self.lock = threading.Lock()
+
+  def wait(self):
+    if not self.interval:
+      return
+
+    with self.lock:
+      now = time.monotonic()
+      slot = max(now, self.next_slot)
+      self.next_slot = slot + self.interval
+
+    if slot > now:
+      time.sleep(slot - now)
+
+
+def deliver_outbox_email(email, limiter=None):
+  """ Sends an OutboxEmail. Returns None on success or the error message. """
+  if limiter:
+    limiter.wait()
+
+  try:
+    msg = EmailMultiAlternatives(email.subject, email.text_content, email.from_email, [email.recipient])
+    msg.attach_alternative(email.html_content, "text/html")
+    msg.send()
+  except Exception as e:
+    return repr(e)
+
+  return None
+
+
+def claim_outbox_batch(batch_size, lease=300):
+  """ Claims up to batch_size due emails for this worker.
+
+  Claimed emails are marked as 'sending' until now + lease seconds. Emails
+  whose lease expired(eg. the worker died) become due again.
+  """
+  now = timezone.now()
+  due = Q(status='pending') | Q(status='sending')
+  ids = list(OutboxEmail.objects.filter(due, next_attempt_date__lte=now).order_by('next_attempt_date', 'pk').values_list('pk', flat=True)[:batch_size])
+  if not ids:
+    return []
+
+  token = uuid.uuid4().hex
+  OutboxEmail.objects.filter(due, pk__in=ids, next_attempt_date__lte=now).update(status='sending', claimed_by=token, next_attempt_date=now + timedelta(seconds=lease))
+  return list(OutboxEmail.objects.filter(claimed_by=token).order_by('pk'))
+
+
+def drain_outbox(batch_size=100, workers=4, rate=None, max_attempts=5, max_batches=None):
+  """ Sends due outbox emails in batches through a thread pool.
+
+  Failed emails are retried with exponential backoff until max_attempts,
+  when they are marked as 'failed'. rate limits the emails sent per second.
+  Returns a (sent, failed) tuple.
+  """
+  limiter = RateLimiter(rate)
+  sent = failed = batches = 0
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    while max_batches is None or batches < max_batches:
+      emails = claim_outbox_batch(batch_size)
+      if not emails:
+        break
+      batches += 1
+
+      errors = executor.map(lambda email: deliver_outbox_email(email, limiter), emails)
+
+      delivered = []
+      for email, error in zip(emails, errors):
+        if error is None:
+          delivered.append(email.pk)
+          continue
+
+        email.attempts += 1
+        email.last_error = error
+        email.claimed_by = None
+        if email.attempts >= max_attempts:
+          email.status = 'failed'
+          failed += 1
+        else:
+          email.status = 'pending'
+          email.next_attempt_date = timezone.now() + timedelta(minutes=2 ** email.attempts)
+        email.save(update_fields=['attempts', 'last_error', 'claimed_by', 'status', 'next_attempt_date'])
+
+      OutboxEmail.objects.filter(pk__in=delivered).update(status='sent', sent_date=timezone.now(), claimed_by=None)
+      sent += len(delivered)
+
+  return (sent, failed)
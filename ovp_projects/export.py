@@ -0,0 +1,125 @@
+"""
+Streaming exports
+
+Rows are read in keyset chunks and encoded as they are produced, so
+exporting a queryset costs memory proportional to a chunk instead of the
+whole table. The encoders are generators meant for StreamingHttpResponse.
+"""
+
+import csv
+import re
+import zipfile
+
+from xml.sax.saxutils import escape
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_rows(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+  """ Yields values_list rows of fields, fetched in chunks ordered by pk.
+      Chunks are fetched with pk > last pk, which is bounded on every
+      database backend unlike QuerySet.iterator() on SQLite """
+  last_pk = None
+  while True:
+    chunk = queryset.order_by('pk')
+    if last_pk is not None:
+      chunk = chunk.filter(pk__gt=last_pk)
+    chunk = list(chunk.values_list('pk', *fields)[:chunk_size])
+
+    for row in chunk:
+      yield row[1:]
+
+    if len(chunk) < chunk_size:
+      break
+    last_pk = chunk[-1][0]
+
+
+class Echo(object):
+  """ File-like object which returns what is written instead of storing it """
+  def write(self, value):
+    return value
+
+
+def iter_csv(rows):
+  """ Yields CSV encoded lines for rows """
+  writer = csv.writer(Echo())
+  for row in rows:
+    yield writer.writerow(row)
+
+
+class StreamBuffer(object):
+  """ Unseekable file-like object collecting bytes written by zipfile """
+  def __init__(self):
+    self.chunks = []
+    self.position = 0
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+    self.position += len(data)
+    return len(data)
+
+  def tell(self):
+    return self.position
+
+  def flush(self):
+    pass
+
+  def pop(self):
+    data = b''.join(self.chunks)
+    self.chunks = []
+    return data
+
+
+XLSX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/><Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>"""
+
+XLSX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>"""
+
+XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="{}" sheetId="1" r:id="rId1"/></sheets></workbook>"""
+
+XLSX_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/></Relationships>"""
+
+XLSX_SHEET_START = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>"""
+
+XLSX_SHEET_END = """</sheetData></worksheet>"""
+
+
+# Characters XML 1.0 documents can't hold, even escaped
+ILLEGAL_XML_CHARS_RE = re.compile('[^\u0009\u000a\u000d\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+
+def xml_text(value):
+  """ Returns value as escaped XML text, without characters XML can't hold """
+  return escape(ILLEGAL_XML_CHARS_RE.sub('', '' if value is None else str(value)))
+
+
+def _xlsx_row(row):
+  cells = ''.join('<c t="inlineStr"><is><t>{}</t></is></c>'.format(xml_text(value)) for value in row)
+  return '<row>{}</row>'.format(cells)
+
+
+def iter_xlsx(rows, sheet_name='root', flush_every=500):
+  """ Yields a single sheet XLSX file for rows.
+      Cells are written as inline strings, so no shared strings table has
+      to be kept in memory, and the zip is flushed every flush_every rows """
+  buffer = StreamBuffer()
+  with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+    archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+    archive.writestr('_rels/.rels', XLSX_RELS)
+    archive.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(xml_text(sheet_name).replace('"', '&quot;')))
+    archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+    yield buffer.pop()
+
+    with archive.open('xl/worksheets/sheet1.xml', mode='w') as sheet:
+      sheet.write(XLSX_SHEET_START.encode('utf-8'))
+      for i, row in enumerate(rows, 1):
+        sheet.write(_xlsx_row(row).encode('utf-8'))
+        if i % flush_every == 0:
+          yield buffer.pop()
+      sheet.write(XLSX_SHEET_END.encode('utf-8'))
+
+  yield buffer.pop()
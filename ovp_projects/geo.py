@@ -0,0 +1,142 @@
+"""
+Proximity search
+
+Project coordinates are denormalized from their address onto indexed
+latitude and longitude columns. Nearby projects are prefiltered with a
+bounding box on those columns, and the haversine distance of the
+candidates inside the box is computed by the database, which also
+applies the (distance, pk) cursor and the page limit.
+
+Projects with hidden_address are positioned on a coarse grid, both when
+exposed and when measured, so distances can't be used to find out their
+exact position.
+"""
+
+from django.db.backends.signals import connection_created
+from django.db.models import Case, F, FloatField, Func, Q, Value, When
+
+from ovp_core.helpers import get_address_model
+
+from math import asin, cos, degrees, radians, sin, sqrt
+
+import sqlite3
+
+EARTH_RADIUS_KM = 6371.0088
+COARSE_POSITION_PRECISION = 2 # decimal places, about 1km
+
+
+def get_coarse_position(latitude, longitude):
+  """ Returns latitude and longitude rounded to the coarse grid """
+  return (round(latitude, COARSE_POSITION_PRECISION), round(longitude, COARSE_POSITION_PRECISION))
+
+
+def get_address_positions(address_ids):
+  """ Returns a {pk: (lat, lng)} dict of stored address coordinates, empty
+      if the address model has none. Coordinates are read from the
+      database, as geocoding writes them with a queryset update """
+  model = get_address_model()
+  field_names = [field.name for field in model._meta.concrete_fields]
+  if not address_ids or 'lat' not in field_names or 'lng' not in field_names:
+    return {}
+
+  return {pk: (lat, lng) for pk, lat, lng in model.objects.filter(pk__in=address_ids).values_list('pk', 'lat', 'lng')}
+
+
+def get_address_position(address_id):
+  """ Returns the (lat, lng) of address_id, or (None, None) """
+  return get_address_positions([address_id] if address_id is not None else []).get(address_id, (None, None))
+
+
+def get_bounding_box(latitude, longitude, radius, margin=0):
+  """ Returns the (min lat, max lat, min lng, max lng) box containing every
+      point within radius km, widened by margin degrees. Longitude bounds
+      are None if the box reaches a pole or crosses the antimeridian """
+  delta = degrees(radius / EARTH_RADIUS_KM) + margin
+  min_latitude, max_latitude = latitude - delta, latitude + delta
+
+  if min_latitude <= -90 or max_latitude >= 90:
+    return (max(min_latitude, -90), min(max_latitude, 90), None, None)
+
+  delta = degrees(asin(min(1, sin(radius / EARTH_RADIUS_KM) / cos(radians(latitude))))) + margin
+  min_longitude, max_longitude = longitude - delta, longitude + delta
+
+  if min_longitude < -180 or max_longitude > 180:
+    return (min_latitude, max_latitude, None, None)
+
+  return (min_latitude, max_latitude, min_longitude, max_longitude)
+
+
+def sql_function(name, *expressions):
+  """ Returns a float valued call of SQL function name """
+  return Func(*expressions, function=name, output_field=FloatField())
+
+
+def float_value(value):
+  return Value(value, output_field=FloatField())
+
+
+class CoarseDegrees(Func):
+  """ Rounds degrees to the coarse grid, as get_coarse_position does """
+  function = 'ROUND'
+  template = '%(function)s(%(expressions)s, {})'.format(COARSE_POSITION_PRECISION)
+
+  def __init__(self, expression):
+    super(CoarseDegrees, self).__init__(expression, output_field=FloatField())
+
+  def as_postgresql(self, compiler, connection):
+    # PostgreSQL only rounds numerics to decimal places
+    return self.as_sql(compiler, connection, template='%(function)s((%(expressions)s)::numeric, {})::float8'.format(COARSE_POSITION_PRECISION))
+
+
+def get_distance_expression(latitude, longitude):
+  """ Returns an expression of the haversine distance in km from
+      (latitude, longitude) to projects. Trigonometry for the origin is
+      computed once, and asin() is given no more than 1 as candidates
+      are inside a bounding box far smaller than a hemisphere """
+  project_latitude = Case(When(hidden_address=True, then=CoarseDegrees(F('latitude'))), default=F('latitude'), output_field=FloatField())
+  project_longitude = Case(When(hidden_address=True, then=CoarseDegrees(F('longitude'))), default=F('longitude'), output_field=FloatField())
+
+  project_latitude = sql_function('RADIANS', project_latitude)
+  half_dlat = sql_function('SIN', (project_latitude - float_value(radians(latitude))) / float_value(2))
+  half_dlng = sql_function('SIN', (sql_function('RADIANS', project_longitude) - float_value(radians(longitude))) / float_value(2))
+  a = half_dlat * half_dlat + float_value(cos(radians(latitude))) * sql_function('COS', project_latitude) * half_dlng * half_dlng
+  return float_value(2 * EARTH_RADIUS_KM) * sql_function('ASIN', sql_function('SQRT', a))
+
+
+def find_nearby(queryset, latitude, longitude, radius, position=None, limit=None):
+  """ Returns (pk, distance) pairs of queryset projects within radius km
+      of (latitude, longitude), ordered by distance and then pk, starting
+      after the (distance, pk) position """
+  min_latitude, max_latitude, min_longitude, max_longitude = get_bounding_box(latitude, longitude, radius, margin=0.5 * 10 ** -COARSE_POSITION_PRECISION)
+
+  queryset = queryset.filter(latitude__gte=min_latitude, latitude__lte=max_latitude)
+  if min_longitude is not None:
+    queryset = queryset.filter(longitude__gte=min_longitude, longitude__lte=max_longitude)
+
+  queryset = queryset.annotate(nearby_distance=get_distance_expression(latitude, longitude)).filter(nearby_distance__lte=radius)
+  if position is not None:
+    distance, pk = position
+    queryset = queryset.filter(Q(nearby_distance__gt=distance) | Q(nearby_distance=distance, pk__gt=pk))
+
+  matches = queryset.order_by('nearby_distance', 'pk').values_list('pk', 'nearby_distance')
+  if limit is not None:
+    matches = matches[:limit]
+  return list(matches)
+
+
+MATH_FUNCTIONS = [('RADIANS', radians), ('SIN', sin), ('COS', cos), ('ASIN', asin), ('SQRT', sqrt)]
+
+
+def register_math_functions(sender, connection, **kwargs):
+  """ Registers the math functions used by find_nearby on SQLite builds
+      compiled without them """
+  if connection.vendor != 'sqlite':
+    return
+
+  try:
+    connection.connection.execute('SELECT SIN(0)')
+  except sqlite3.OperationalError:
+    for name, function in MATH_FUNCTIONS:
+      connection.connection.create_function(name, 1, function)
+
+connection_created.connect(register_math_functions)
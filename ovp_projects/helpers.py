@@ -1,4 +1,80 @@
 from django.conf import settings
+from django.db import connections
+from django.db.models import Case, When, Value, Q
 
 def get_settings():
   return getattr(settings, "OVP_PROJECTS", {})
+
+
+def diff_nested(instances, items):
+  """ Diffs nested payload items against existing instances by 'id'.
+
+  Items without an id are new. Instances whose values differ from their
+  item get the item values assigned. Returns a (new items, changed
+  instances, removed instances) tuple.
+  """
+  existing = {instance.pk: instance for instance in instances}
+  new, changed, kept = [], [], set()
+
+  for item in items:
+    pk = item.get('id', None)
+    if pk is None:
+      new.append(item)
+      continue
+
+    instance = existing[pk]
+    kept.add(pk)
+
+    modified = False
+    for attr, value in item.items():
+      if attr != 'id' and getattr(instance, attr) != value:
+        setattr(instance, attr, value)
+        modified = True
+
+    if modified:
+      changed.append(instance)
+
+  removed = [instance for pk, instance in existing.items() if pk not in kept]
+  return (new, changed, removed)
+
+
+def bulk_update(model, instances, fields):
+  """ Writes fields of instances with a single UPDATE ... CASE query """
+  if not instances or not fields:
+    return
+
+  values = {}
+  for name in fields:
+    field = model._meta.get_field(name)
+    whens = [When(pk=instance.pk, then=Value(getattr(instance, name), output_field=field)) for instance in instances]
+    values[name] = Case(*whens, output_field=field)
+
+  model.objects.filter(pk__in=[instance.pk for instance in instances]).update(**values)
+
+
+# Greater than any character, so prefix + PREFIX_UPPER_BOUND bounds the strings starting with prefix
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+def filter_prefix(queryset, fields, prefix):
+  """ Filters queryset rows where any of fields starts with prefix, case insensitively.
+
+  SQLite only serves LIKE from an index when the pattern is known as the
+  statement is prepared, which is never the case with bound parameters,
+  so it's compared as a range on the NOCASE collation instead. Ranges
+  depend on the collation order, which is byte order on SQLite, so other
+  backends use istartswith.
+  """
+  if connections[queryset.db].vendor != 'sqlite':
+    condition = Q()
+    for field in fields:
+      condition |= Q(**{'{}__istartswith'.format(field): prefix})
+    return queryset.filter(condition)
+
+  table = queryset.model._meta.db_table
+  ranges, params = [], []
+  for field in fields:
+    column = '"{}"."{}"'.format(table, queryset.model._meta.get_field(field).column)
+    ranges.append('({column} >= %s COLLATE NOCASE AND {column} < %s COLLATE NOCASE)'.format(column=column))
+    params += [prefix, prefix + PREFIX_UPPER_BOUND]
+  return queryset.extra(where=[' OR '.join(ranges)], params=params)
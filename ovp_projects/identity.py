@@ -0,0 +1,95 @@
+from django.http import Http404
+
+
+class IdentityMap(object):
+  """
+  Request-scoped map of loaded model instances and membership checks.
+
+  Permissions, views and serializers handling the same request share it
+  through get_identity_map, so each object is loaded at most once and
+  each membership is checked with a single EXISTS query.
+  """
+  def __init__(self):
+    self._objects = {}
+    self._memberships = {}
+
+  def get(self, queryset, **lookup):
+    """ Returns the object of queryset matching lookup, loading it only
+        if it's not on the map yet. Raises Http404 if it does not exist """
+    obj = self.get_or_none(queryset, **lookup)
+    if obj is None:
+      raise Http404('No {} matches the given query.'.format(queryset.model._meta.object_name))
+    return obj
+
+  def get_or_none(self, queryset, **lookup):
+    """ Same as .get(), but returns None if the object does not exist """
+    key = self._key(queryset.model, lookup)
+    if key not in self._objects:
+      obj = queryset.filter(**lookup).first()
+      if obj is None:
+        return None
+      self.add(obj, **lookup)
+    return self._objects[key]
+
+  def add(self, obj, **lookup):
+    """ Adds obj to the map under its pk and lookup, along with any
+        related object joined through select_related """
+    self._objects[self._key(type(obj), {'pk': obj.pk})] = obj
+    if lookup:
+      self._objects[self._key(type(obj), lookup)] = obj
+
+    for field in obj._meta.concrete_fields:
+      if field.is_relation:
+        related = getattr(obj, field.get_cache_name(), None)
+        if related is not None:
+          self._objects.setdefault(self._key(type(related), {'pk': related.pk}), related)
+
+    return obj
+
+  def get_related(self, obj, name):
+    """ Returns obj foreign key name through the map. Already loaded
+        objects are reused and assigned to obj instead of fetched again """
+    field = obj._meta.get_field(name)
+    pk = getattr(obj, field.attname)
+    if pk is None:
+      return None
+
+    if not hasattr(obj, field.get_cache_name()):
+      setattr(obj, name, self.get(field.related_model._default_manager.all(), pk=pk))
+    return getattr(obj, name)
+
+  def is_organization_member(self, organization, user):
+    """ Returns True if user is a member of organization. Memoized """
+    if organization is None or user is None or user.pk is None:
+      return False
+
+    key = (organization.pk, user.pk)
+    if key not in self._memberships:
+      self._memberships[key] = organization.members.filter(pk=user.pk).exists()
+    return self._memberships[key]
+
+  def can_manage_project(self, project, user):
+    """ Returns True if user owns project or owns or is a member of its organization """
+    if user is None or user.pk is None:
+      return False
+
+    if project.owner_id == user.pk:
+      return True
+
+    organization = self.get_related(project, 'organization')
+    if organization is None:
+      return False
+
+    return organization.owner_id == user.pk or self.is_organization_member(organization, user)
+
+  def _key(self, model, lookup):
+    return (model, tuple(sorted((name, str(value)) for name, value in lookup.items())))
+
+
+def get_identity_map(request):
+  """ Returns the identity map bound to request, creating it on first use """
+  request = getattr(request, '_request', request)
+
+  if not hasattr(request, '_ovp_identity_map'):
+    request._ovp_identity_map = IdentityMap()
+  return request._ovp_identity_map
@@ -1,17 +1,49 @@
 # -*- coding: utf-8 -*-
-import sys
-
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from ovp_projects.models import Project
+from django.utils.dateparse import parse_datetime, parse_date
+
+from ovp_projects.transitions import close_finished_projects, DEFAULT_BATCH_SIZE
+
+import datetime
 
 class Command(BaseCommand):
   help = "Close projects which have a Job and end_date has already passed"
 
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Projects closed per transaction')
+    parser.add_argument('--since', default=None, help='Only close projects whose job ended after this date or datetime')
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only report projects which would be closed')
+
   def handle(self, *args, **options):
-    projects = Project \
-                 .objects \
-                 .filter(closed=False, \
-                         job__end_date__lt=timezone.now())
-    print("Closing {} finished projects".format(projects.count()))
-    projects.update(closed=True)
+    dry_run = options.get('dry_run', False)
+
+    def report(batch, size, elapsed):
+      print("Batch {}: {} projects in {:.1f}ms".format(batch, size, elapsed * 1000))
+
+    closed = close_finished_projects(
+      batch_size=options.get('batch_size', DEFAULT_BATCH_SIZE),
+      since=self.parse_since(options.get('since', None)),
+      dry_run=dry_run,
+      report=report,
+    )
+
+    if dry_run:
+      print("Would close {} finished projects".format(closed))
+    else:
+      print("Closed {} finished projects".format(closed))
+
+  def parse_since(self, value):
+    if value is None:
+      return None
+
+    since = parse_datetime(value)
+    if since is None:
+      date = parse_date(value)
+      if date is None:
+        raise CommandError("Invalid --since value: {}".format(value))
+      since = datetime.datetime.combine(date, datetime.time())
+
+    if timezone.is_naive(since):
+      since = timezone.make_aware(since)
+    return since
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from ovp_projects.counters import recount_applied_counters
+
+class Command(BaseCommand):
+  help = "Reconcile VolunteerRole and Project applied_count with existing applies"
+
+  def handle(self, *args, **options):
+    roles, projects = recount_applied_counters()
+    print("Fixed applied count on {} roles and {} projects".format(roles, projects))
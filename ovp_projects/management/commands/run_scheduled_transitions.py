@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from ovp_projects.transitions import run_scheduled_transitions, DEFAULT_BATCH_SIZE
+
+class Command(BaseCommand):
+  help = "Publish and close projects whose publish_at and close_at dates are due"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Projects updated per transaction')
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only report projects which would be updated')
+
+  def handle(self, *args, **options):
+    dry_run = options.get('dry_run', False)
+
+    def report(name, batch, size, elapsed):
+      print("{} batch {}: {} projects in {:.1f}ms".format(name.capitalize(), batch, size, elapsed * 1000))
+
+    processed = run_scheduled_transitions(
+      batch_size=options.get('batch_size', DEFAULT_BATCH_SIZE),
+      dry_run=dry_run,
+      report=report,
+    )
+
+    verb = "Would update" if dry_run else "Updated"
+    print("{}: {} published, {} closed".format(verb, processed['published'], processed['closed']))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from ovp_projects.emails import drain_outbox
+
+class Command(BaseCommand):
+  help = "Send emails queued on the outbox"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed per batch')
+    parser.add_argument('--workers', type=int, default=4, help='Threads sending emails')
+    parser.add_argument('--rate', type=float, default=None, help='Maximum emails sent per second')
+    parser.add_argument('--max-attempts', type=int, default=5, help='Attempts before an email is marked as failed')
+
+  def handle(self, *args, **options):
+    sent, failed = drain_outbox(
+      batch_size=options.get('batch_size', 100),
+      workers=options.get('workers', 4),
+      rate=options.get('rate', None),
+      max_attempts=options.get('max_attempts', 5),
+    )
+    print("Sent {} emails, {} failed".format(sent, failed))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0044_auto_20180326_1157'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template_name', models.CharField(max_length=100, verbose_name='template name')),
+                ('from_email', models.CharField(blank=True, default='', max_length=190, verbose_name='from email')),
+                ('recipient', models.CharField(max_length=190, verbose_name='recipient')),
+                ('subject', models.CharField(max_length=255, verbose_name='subject')),
+                ('text_content', models.TextField(verbose_name='text content')),
+                ('html_content', models.TextField(verbose_name='html content')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='last error')),
+                ('claimed_by', models.CharField(blank=True, max_length=32, null=True, verbose_name='claimed by')),
+                ('next_attempt_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='next attempt date')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='created date')),
+                ('sent_date', models.DateTimeField(blank=True, null=True, verbose_name='sent date')),
+            ],
+            options={
+                'verbose_name': 'outbox email',
+                'verbose_name_plural': 'outbox emails',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxemail',
+            index_together=set([('status', 'next_attempt_date')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:21
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0045_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='apply',
+            index_together=set([('project', 'username'), ('project', 'email')]),
+        ),
+    ]
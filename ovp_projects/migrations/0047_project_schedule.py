@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0046_apply_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='close_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Close at'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Publish at'),
+        ),
+        migrations.AlterIndexTogether(
+            name='project',
+            index_together=set([('closed', 'close_at'), ('published', 'publish_at')]),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:28
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Partial indexes on projects still waiting for a transition. Django 1.10
+# can't declare them on models, so they're created only on backends
+# supporting CREATE INDEX ... WHERE.
+PARTIAL_INDEXES = [
+  ('ovp_projects_project_open_idx', 'id', 'NOT closed'),
+  ('ovp_projects_project_unpublished_idx', 'publish_at', 'NOT published AND NOT deleted'),
+  ('ovp_projects_project_closing_idx', 'close_at', 'NOT closed'),
+]
+
+
+def supports_partial_indexes(schema_editor):
+  return schema_editor.connection.vendor in ['postgresql', 'sqlite']
+
+
+def create_partial_indexes(apps, schema_editor):
+  if not supports_partial_indexes(schema_editor):
+    return
+
+  for name, column, condition in PARTIAL_INDEXES:
+    schema_editor.execute('CREATE INDEX {} ON ovp_projects_project ({}) WHERE {}'.format(name, column, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+  if not supports_partial_indexes(schema_editor):
+    return
+
+  # SQLite may have dropped them already, when rebuilding the table
+  for name, column, condition in PARTIAL_INDEXES:
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0047_project_schedule'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='apply',
+            index_together=set([('user', 'project'), ('project', 'username'), ('project', 'canceled'), ('project', 'email')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('end_date', 'project')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='jobdate',
+            index_together=set([('job', 'start_date'), ('job', 'end_date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='project',
+            index_together=set([('closed', 'close_at'), ('published', 'publish_at'), ('deleted', 'published', 'closed')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
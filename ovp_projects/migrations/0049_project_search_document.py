@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# SQLite indexes the search document on an external content FTS5 table,
+# kept in sync by triggers. PostgreSQL indexes it through a GIN expression
+# index, matching the to_tsvector() call made by the search backend.
+#
+# Names and the document layout are copied from ovp_projects.search as of
+# this migration, so later changes to it don't alter what it does.
+SEARCH_TABLE = 'ovp_projects_project_search'
+SEARCH_CONFIG = 'simple'
+SEARCH_DOCUMENT_SEPARATOR = '\n\x1e\n'
+CHUNK_SIZE = 500
+
+SQLITE_FORWARDS = [
+  "CREATE VIRTUAL TABLE {table} USING fts5(search_document, content='ovp_projects_project', content_rowid='id', tokenize='unicode61 remove_diacritics 1')",
+  "CREATE TRIGGER {table}_insert AFTER INSERT ON ovp_projects_project BEGIN INSERT INTO {table}(rowid, search_document) VALUES (new.id, new.search_document); END",
+  "CREATE TRIGGER {table}_delete AFTER DELETE ON ovp_projects_project BEGIN INSERT INTO {table}({table}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+  "CREATE TRIGGER {table}_update AFTER UPDATE OF search_document ON ovp_projects_project BEGIN INSERT INTO {table}({table}, rowid, search_document) VALUES ('delete', old.id, old.search_document); INSERT INTO {table}(rowid, search_document) VALUES (new.id, new.search_document); END",
+  "INSERT INTO {table}({table}) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+  "DROP TRIGGER {table}_update",
+  "DROP TRIGGER {table}_delete",
+  "DROP TRIGGER {table}_insert",
+  "DROP TABLE {table}",
+]
+
+POSTGRESQL_FORWARDS = [
+  "CREATE INDEX {table}_idx ON ovp_projects_project USING GIN (to_tsvector('{config}', search_document))",
+]
+
+POSTGRESQL_BACKWARDS = [
+  "DROP INDEX {table}_idx",
+]
+
+STATEMENTS = {
+  'sqlite': (SQLITE_FORWARDS, SQLITE_BACKWARDS),
+  'postgresql': (POSTGRESQL_FORWARDS, POSTGRESQL_BACKWARDS),
+}
+
+
+def run_statements(schema_editor, direction):
+  statements = STATEMENTS.get(schema_editor.connection.vendor, ([], []))[direction]
+  for statement in statements:
+    schema_editor.execute(statement.format(table=SEARCH_TABLE, config=SEARCH_CONFIG))
+
+
+def create_search_index(apps, schema_editor):
+  run_statements(schema_editor, 0)
+
+
+def drop_search_index(apps, schema_editor):
+  run_statements(schema_editor, 1)
+
+
+def build_search_document(project):
+  related = [project.organization.name if project.organization_id else None]
+  related += [cause.name for cause in project.causes.all()]
+  related += [skill.name for skill in project.skills.all()]
+
+  own = '\n'.join(part for part in [project.name, project.description, project.details] if part)
+  return own + SEARCH_DOCUMENT_SEPARATOR + '\n'.join(part for part in related if part)
+
+
+def build_search_documents(apps, schema_editor):
+  Project = apps.get_model('ovp_projects', 'Project')
+  projects = Project.objects.using(schema_editor.connection.alias).select_related('organization').prefetch_related('causes', 'skills').order_by('pk')
+  last_pk = 0
+
+  while True:
+    chunk = list(projects.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+    for project in chunk:
+      projects.filter(pk=project.pk).update(search_document=build_search_document(project))
+
+    if len(chunk) < CHUNK_SIZE:
+      break
+    last_pk = chunk[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0048_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Search document'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# SQLite rebuilds the project table to add or remove a column, dropping
+# the search triggers created by 0049. They're created again once the
+# table is rebuilt, in both directions. Rows are copied as they are, so the
+# FTS5 table is still in sync and doesn't need a rebuild.
+SEARCH_TABLE = 'ovp_projects_project_search'
+
+SEARCH_TRIGGERS = [
+  "CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON ovp_projects_project BEGIN INSERT INTO {table}(rowid, search_document) VALUES (new.id, new.search_document); END",
+  "CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON ovp_projects_project BEGIN INSERT INTO {table}({table}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+  "CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF search_document ON ovp_projects_project BEGIN INSERT INTO {table}({table}, rowid, search_document) VALUES ('delete', old.id, old.search_document); INSERT INTO {table}(rowid, search_document) VALUES (new.id, new.search_document); END",
+]
+
+
+def create_search_triggers(apps, schema_editor):
+  if schema_editor.connection.vendor != 'sqlite':
+    return
+
+  for statement in SEARCH_TRIGGERS:
+    schema_editor.execute(statement.format(table=SEARCH_TABLE))
+
+
+def copy_address_positions(apps, schema_editor):
+  Project = apps.get_model('ovp_projects', 'Project')
+  Address = Project._meta.get_field('address').related_model
+  field_names = [field.name for field in Address._meta.concrete_fields]
+  if 'lat' not in field_names or 'lng' not in field_names:
+    return
+
+  projects = Project.objects.using(schema_editor.connection.alias)
+  addresses = Address.objects.using(schema_editor.connection.alias).filter(pk__in=projects.exclude(address=None).values('address_id'))
+  for pk, lat, lng in list(addresses.values_list('pk', 'lat', 'lng')):
+    projects.filter(address_id=pk).update(latitude=lat, longitude=lng)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0049_project_search_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_triggers),
+        migrations.AddField(
+            model_name='project',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Longitude'),
+        ),
+        migrations.AlterIndexTogether(
+            name='project',
+            index_together=set([('latitude', 'longitude'), ('published', 'publish_at'), ('deleted', 'published', 'closed'), ('closed', 'close_at')]),
+        ),
+        migrations.RunPython(create_search_triggers, migrations.RunPython.noop),
+        migrations.RunPython(copy_address_positions, migrations.RunPython.noop),
+    ]
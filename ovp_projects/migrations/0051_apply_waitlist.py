@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 08:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0050_project_position'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apply',
+            name='status',
+            field=models.CharField(choices=[('applied', 'Applied'), ('unapplied', 'Canceled'), ('confirmed-volunteer', 'Confirmed Volunteer'), ('not-volunteer', 'Not a Volunteer'), ('waitlisted', 'Waitlisted')], default='applied', max_length=30, verbose_name='status'),
+        ),
+        migrations.AlterIndexTogether(
+            name='apply',
+            index_together=set([('role', 'status', 'date'), ('project', 'email'), ('project', 'username'), ('project', 'canceled'), ('user', 'project')]),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# SQLite drops every index Django doesn't know about whenever it rebuilds
+# the project table to add or remove a column, so the partial indexes
+# created by 0048 were lost by 0049 and 0050. They're created again here.
+# Later migrations rebuilding the project table on SQLite must create them
+# again as well.
+PARTIAL_INDEXES = [
+  ('ovp_projects_project_open_idx', 'id', 'NOT closed'),
+  ('ovp_projects_project_unpublished_idx', 'publish_at', 'NOT published AND NOT deleted'),
+  ('ovp_projects_project_closing_idx', 'close_at', 'NOT closed'),
+]
+
+
+def create_partial_indexes(apps, schema_editor):
+  if schema_editor.connection.vendor != 'sqlite':
+    return
+
+  for name, column, condition in PARTIAL_INDEXES:
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON ovp_projects_project ({}) WHERE {}'.format(name, column, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+  if schema_editor.connection.vendor != 'sqlite':
+    return
+
+  for name, column, condition in PARTIAL_INDEXES:
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0051_apply_waitlist'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
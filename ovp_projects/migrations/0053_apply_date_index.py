@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 09:36
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0052_restore_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='apply',
+            index_together=set([('project', 'canceled'), ('role', 'status', 'date'), ('project', 'email'), ('project', 'date'), ('user', 'project'), ('project', 'username')]),
+        ),
+    ]
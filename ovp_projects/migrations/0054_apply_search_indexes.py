@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Indexes serving the case insensitive username and email prefix search of
+# the applies list, which filters with istartswith. SQLite runs it as a
+# LIKE, served by an index on the NOCASE collated column. PostgreSQL runs
+# it as UPPER(column) LIKE UPPER(pattern), served by an expression index
+# with text_pattern_ops, which doesn't depend on the database collation.
+#
+# Django 1.10 can't declare them on models, and SQLite drops them whenever
+# it rebuilds the apply table, so later migrations doing so must create
+# them again.
+SEARCH_INDEXES = [
+  ('ovp_projects_apply_username_search_idx', 'username'),
+  ('ovp_projects_apply_email_search_idx', 'email'),
+]
+
+INDEX_EXPRESSIONS = {
+  'sqlite': '{column} COLLATE NOCASE',
+  'postgresql': 'UPPER({column}::text) text_pattern_ops',
+}
+
+
+def create_search_indexes(apps, schema_editor):
+  expression = INDEX_EXPRESSIONS.get(schema_editor.connection.vendor, None)
+  if not expression:
+    return
+
+  for name, column in SEARCH_INDEXES:
+    schema_editor.execute('CREATE INDEX {} ON ovp_projects_apply (project_id, {})'.format(name, expression.format(column=column)))
+
+
+def drop_search_indexes(apps, schema_editor):
+  if schema_editor.connection.vendor not in INDEX_EXPRESSIONS:
+    return
+
+  for name, column in SEARCH_INDEXES:
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ovp_projects', '0053_apply_date_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='apply',
+            index_together=set([('user', 'project'), ('project', 'canceled'), ('project', 'email'), ('project', 'date'), ('role', 'status', 'date')]),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
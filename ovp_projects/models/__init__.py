@@ -2,3 +2,10 @@ from ovp_projects.models.project import Project, VolunteerRole
 from ovp_projects.models.job import Job, JobDate
 from ovp_projects.models.work import Work
 from ovp_projects.models.apply import Apply
+from ovp_projects.models.outbox import OutboxEmail
+
+# Connects retrieve cache invalidation receivers
+from ovp_projects import cache
+
+# Registers math functions on SQLite connections lacking them
+from ovp_projects import geo
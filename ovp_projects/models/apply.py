@@ -1,17 +1,25 @@
 from django.db import models
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 
 from ovp_projects import emails
+from ovp_projects import counters
+from ovp_projects import capacity
+from ovp_projects.models.tracker import FieldTrackerMixin
 
 apply_status_choices = (
     ('applied', 'Applied'),
     ('unapplied', 'Canceled'),
     ('confirmed-volunteer', 'Confirmed Volunteer'),
     ('not-volunteer', 'Not a Volunteer'),
+    ('waitlisted', 'Waitlisted'),
 )
 
-class Apply(models.Model):
+# Applies are only waitlisted by capacity.admit, so it can't be set through the API
+apply_writable_status_choices = tuple(choice for choice in apply_status_choices if choice[0] != counters.WAITLISTED_STATUS)
+
+class Apply(FieldTrackerMixin, models.Model):
   user = models.ForeignKey('ovp_users.User', blank=True, null=True, verbose_name=_('user'))
   project = models.ForeignKey('ovp_projects.Project', verbose_name=_('project'))
   role = models.ForeignKey('ovp_projects.VolunteerRole', verbose_name=_('role'), blank=False, null=True)
@@ -24,23 +32,18 @@ class Apply(models.Model):
   email = models.CharField(_('email'), max_length=190, blank=True, null=True)
   phone = models.CharField(_('phone'), max_length=30, blank=True, null=True)
 
-  def __init__(self, *args, **kwargs):
-    super(Apply, self).__init__(*args, **kwargs)
-    self.__original_status = self.status
-    self.__original_canceled = self.canceled
-
   def mailing(self, async_mail=None):
     return emails.ApplyMail(self, async_mail)
 
   def save(self, *args, **kwargs):
+    previous_state = None
+    creating = self.pk == None
 
-    if self.pk == None:
-      # Object being created
-      self.mailing().sendAppliedToVolunteer({'apply': self})
-      self.mailing().sendAppliedToOwner({'apply': self})
-    else:
+    if not creating:
       # Object being updated
-      if self.__original_canceled != self.canceled:
+      previous_state = counters.get_counting_state(self.get_original('status'), self.get_original('canceled'), self.get_original('role'))
+
+      if self.has_changed('canceled'):
         # self.canceled was modified
         if self.canceled == True:
           self.status = "unapplied"
@@ -49,7 +52,7 @@ class Apply(models.Model):
 
       # Status can be set without modifying .canceled directly
       # Therefore we reset values checked on the previous ifs
-      if self.__original_status != self.status:
+      if self.has_changed('status'):
         if self.status == "unapplied":
           self.canceled = True
           self.canceled_date = timezone.now()
@@ -59,22 +62,25 @@ class Apply(models.Model):
           self.canceled = False
           self.canceled_date = None
 
-    # Update original values
-    self.__original_status = self.status
-    self.__original_canceled = self.canceled
-    return_data = super(Apply, self).save(*args, **kwargs)
+    with transaction.atomic(savepoint=False):
+      # With hard role capacity, applies get a seat or are waitlisted
+      reserved = capacity.admit([self], [previous_state])
 
-    if self.role:
-      if self.status == 'applied' or self.status == 'confirmed-volunteer':
-        self.role.applied_count = self.role.applied_count + 1
-        self.role.save()
-      else:
-        self.role.applied_count = self.role.applied_count - 1
-        self.role.save()
+      return_data = super(Apply, self).save(*args, **kwargs)
+      self.snapshot_fields()
+
+      # Update role and project applied_count
+      counters.update_apply_counters(self, previous_state, reserved=bool(reserved))
+      new_state = counters.get_counting_state(self.status, self.canceled, self.role_id)
+      capacity.promote_freed_seats(counters.get_counter_deltas([(self.project_id, previous_state, new_state)])[0])
 
-    # Updating project applied_count
-    self.project.applied_count = self.project.get_volunteers_numbers()
-    self.project.save()
+    if creating:
+      # Sent once the row is inserted, so conflicting inserts send nothing
+      if self.status == counters.WAITLISTED_STATUS:
+        self.mailing().sendWaitlistedToVolunteer({'apply': self})
+      else:
+        self.mailing().sendAppliedToVolunteer({'apply': self})
+      self.mailing().sendAppliedToOwner({'apply': self})
 
     return return_data
 
@@ -84,4 +90,5 @@ class Apply(models.Model):
     verbose_name = _('apply')
     verbose_name_plural = _('applies')
     unique_together = (("email", "project"), )
+    index_together = (("project", "email"), ("project", "canceled"), ("project", "date"), ("user", "project"), ("role", "status", "date"))
 
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Max, Min
 from django.utils.translation import ugettext_lazy as _
 
 class JobDate(models.Model):
@@ -16,6 +17,7 @@ class JobDate(models.Model):
     app_label = 'ovp_projects'
     verbose_name = _('job date')
     verbose_name_plural = _('job dates')
+    index_together = (("job", "start_date"), ("job", "end_date"))
 
 
 class Job(models.Model):
@@ -45,14 +47,16 @@ class Job(models.Model):
     return "{}: {} ~ {}".format(name, start_date, end_date)
 
   def update_dates(self):
-    start = self.dates.all().order_by('start_date').first().start_date
-    end   = self.dates.all().order_by('-end_date').first().end_date
-    self.start_date = start
-    self.end_date = end
-    self.save()
+    """ Sets start and end dates from job dates with a single aggregate query.
+        Saving through an update avoids the date sync done on .save() """
+    dates = self.dates.aggregate(start=Min('start_date'), end=Max('end_date'))
+    self.start_date = dates['start']
+    self.end_date = dates['end']
+    Job.objects.filter(pk=self.pk).update(start_date=self.start_date, end_date=self.end_date)
 
   class Meta:
     app_label = 'ovp_projects'
     verbose_name = _('job')
     verbose_name_plural = _('jobs')
+    index_together = (("end_date", "project"), )
 
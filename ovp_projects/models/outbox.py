@@ -0,0 +1,38 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+outbox_status_choices = (
+    ('pending', 'Pending'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+class OutboxEmail(models.Model):
+  """
+  Rendered email waiting to be dispatched by the send_outbox_emails command
+  """
+  template_name = models.CharField(_('template name'), max_length=100)
+  from_email = models.CharField(_('from email'), max_length=190, blank=True, default='')
+  recipient = models.CharField(_('recipient'), max_length=190)
+  subject = models.CharField(_('subject'), max_length=255)
+  text_content = models.TextField(_('text content'))
+  html_content = models.TextField(_('html content'))
+
+  status = models.CharField(_('status'), max_length=10, choices=outbox_status_choices, default='pending')
+  attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+  last_error = models.TextField(_('last error'), blank=True, null=True)
+  claimed_by = models.CharField(_('claimed by'), max_length=32, blank=True, null=True)
+  next_attempt_date = models.DateTimeField(_('next attempt date'), default=timezone.now)
+  created_date = models.DateTimeField(_('created date'), auto_now_add=True)
+  sent_date = models.DateTimeField(_('sent date'), blank=True, null=True)
+
+  def __str__(self):
+    return '%s to %s (%s)' % (self.template_name, self.recipient, self.status)
+
+  class Meta:
+    app_label = 'ovp_projects'
+    verbose_name = _('outbox email')
+    verbose_name_plural = _('outbox emails')
+    index_together = [('status', 'next_attempt_date')]
@@ -1,21 +1,33 @@
 from django.db import models
+from django.db import transaction
+from django.db import IntegrityError
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 from django.db.models import Sum
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from ovp_core.helpers import get_address_model
 
 from ovp_projects import emails
+from ovp_projects import capacity
 from ovp_projects.models.apply import Apply
+from ovp_projects.models.tracker import FieldTrackerMixin
+from ovp_projects.search import build_search_document, get_related_search_text, refresh_search_documents
+from ovp_projects.geo import get_address_position
 
 import urllib.request as request
 import urllib.parse as parse
 
+from collections import OrderedDict
+
 import json
+import re
+
+# Attempts to create a project before giving up on slug conflicts
+SLUG_CONFLICT_RETRIES = 5
 
-class Project(models.Model):
+class Project(FieldTrackerMixin, models.Model):
   """
   Project model
   """
@@ -52,10 +64,31 @@ class Project(models.Model):
   created_date = models.DateTimeField(_('Created date'), auto_now_add=True)
   modified_date = models.DateTimeField(_('Modified date'), auto_now=True)
 
+  # Scheduled transitions, applied by the run_scheduled_transitions command
+  publish_at = models.DateTimeField(_("Publish at"), blank=True, null=True)
+  close_at = models.DateTimeField(_("Close at"), blank=True, null=True)
+
   # About
   details = models.TextField(_('Details'), max_length=3000)
   description = models.TextField(_('Short description'), max_length=160, blank=True, null=True)
 
+  # Address coordinates, denormalized for proximity search, see ovp_projects.geo
+  latitude = models.FloatField(_('Latitude'), blank=True, null=True, editable=False)
+  longitude = models.FloatField(_('Longitude'), blank=True, null=True, editable=False)
+
+  # Precomputed text indexed by project search, see ovp_projects.search
+  search_document = models.TextField(_('Search document'), blank=True, default='', editable=False)
+
+  # Flags which set a date and optionally email the owner when flipped to True
+  TRANSITIONS = OrderedDict([
+    ('published', ('published_date', 'sendProjectPublished')),
+    ('closed', ('closed_date', 'sendProjectClosed')),
+    ('deleted', ('deleted_date', None)),
+  ])
+
+  # Fields which are part of the search document, besides related names
+  SEARCH_DOCUMENT_FIELDS = ['name', 'description', 'details']
+
   def mailing(self, async_mail=None):
     return emails.ProjectMail(self, async_mail)
 
@@ -74,6 +107,13 @@ class Project(models.Model):
   def get_volunteers_numbers(self):
     return Apply.objects.filter(project=self, canceled=False).count()
 
+  def update_max_applies_from_roles(self, save=True):
+    vacancies = VolunteerRole.objects.filter(project=self).aggregate(Sum('vacancies')).get('vacancies__sum')
+    self.max_applies_from_roles = vacancies if vacancies else 0
+
+    if save:
+      self.save()
+
   '''
   Model operation methods
   '''
@@ -82,27 +122,22 @@ class Project(models.Model):
     self.published = False
     self.save()
 
+  def run_transition(self, name, now=None):
+    """ Side effects of flipping flag name to True: sets its date and
+        sends the owner email. Run by .save() and by bulk transitions """
+    date_field, email = self.TRANSITIONS[name]
+    setattr(self, date_field, now or timezone.now())
+
+    if email:
+      getattr(self.mailing(), email)({'project': self})
+
   def save(self, *args, **kwargs):
-    if self.pk is not None:
-      orig = Project.objects.get(pk=self.pk)
-      if not orig.published and self.published:
-        self.published_date = timezone.now()
-        self.mailing().sendProjectPublished({'project': self})
-
-      if not orig.closed and self.closed:
-        self.closed_date = timezone.now()
-        self.mailing().sendProjectClosed({'project': self})
-
-      if not orig.deleted and self.deleted:
-        self.deleted_date = timezone.now()
-    else:
-      # Project being created
-      self.slug = self.generate_slug()
-      self.mailing().sendProjectCreated({'project': self})
-      try:
-        self.admin_mailing().sendProjectCreated({'project': self})
-      except:
-        pass
+    creating = self.pk is None
+
+    if not creating:
+      for name in self.TRANSITIONS:
+        if self.has_changed(name) and not self.get_original(name) and getattr(self, name):
+          self.run_transition(name)
 
     # If there is no description, take 100 chars from the details
     if not self.description:
@@ -111,26 +146,79 @@ class Project(models.Model):
       else:
         self.description = self.details
 
+    if self.has_changed('address') or (creating and self.address_id):
+      self.latitude, self.longitude = get_address_position(self.address_id)
+
+    # Related names are kept from the current document unless the organization changed
+    if creating or self.has_changed('organization'):
+      self.search_document = build_search_document(self)
+    elif any(self.has_changed(name) for name in self.SEARCH_DOCUMENT_FIELDS):
+      self.search_document = build_search_document(self, get_related_search_text(self.search_document))
+
     self.modified_date = timezone.now()
 
-    return super(Project, self).save(*args, **kwargs)
+    # Loaded instances only write modified columns, so counters updated
+    # elsewhere are not overwritten with stale values
+    if not self._state.adding and not args and kwargs.get('update_fields') is None:
+      kwargs['update_fields'] = self.get_dirty_fields()
+
+    if creating:
+      return_data = self.create_with_unique_slug(*args, **kwargs)
+
+      self.mailing().sendProjectCreated({'project': self})
+      try:
+        self.admin_mailing().sendProjectCreated({'project': self})
+      except:
+        pass
+    else:
+      return_data = super(Project, self).save(*args, **kwargs)
+
+    self.snapshot_fields(kwargs.get('update_fields'))
+
+    return return_data
+
+  def create_with_unique_slug(self, *args, **kwargs):
+    """ Inserts the project with a generated slug. Concurrent creates may pick
+        the same slug, in which case the unique index rejects the insert and a
+        new slug is generated. """
+    for attempt in range(SLUG_CONFLICT_RETRIES):
+      self.slug = self.generate_slug()
+      try:
+        with transaction.atomic():
+          return super(Project, self).save(*args, **kwargs)
+      except IntegrityError:
+        last_attempt = attempt == SLUG_CONFLICT_RETRIES - 1
+        if last_attempt or self.slug is None or not Project.objects.filter(slug=self.slug).exists():
+          raise
 
 
   def generate_slug(self):
     if self.name:
       slug = slugify(self.name)[0:99]
+
+      # Fetch every slug taken by this name in a single query, startswith
+      # narrows the scan through the slug index before the regex is checked
+      pattern = r'^{}(-[0-9]+)?$'.format(re.escape(slug))
+      taken = set(Project.objects.filter(slug__startswith=slug, slug__regex=pattern).values_list('slug', flat=True))
+
       append = ''
       i = 0
-
-      query = Project.objects.filter(slug=slug + append)
-      while query.count() > 0:
+      while slug + append in taken:
         i += 1
         append = '-' + str(i)
-        query = Project.objects.filter(slug=slug + append)
       return slug + append
     return None
 
+  def update_search_document(self):
+    """ Rebuilds the search document and writes it without saving the project """
+    self.search_document = build_search_document(self)
+    Project.objects.filter(pk=self.pk).update(search_document=self.search_document)
+    self.snapshot_fields(['search_document'])
+
   def active_apply_set(self):
+    # Populated by the 'active_apply_set' prefetch on ovp_projects.prefetch
+    if hasattr(self, 'prefetched_active_applies'):
+      return self.prefetched_active_applies
     return self.apply_set.filter(canceled=False)
 
   def __str__(self):
@@ -140,6 +228,7 @@ class Project(models.Model):
     app_label = 'ovp_projects'
     verbose_name = _('project')
     verbose_name_plural = _('projects')
+    index_together = (("published", "publish_at"), ("closed", "close_at"), ("deleted", "published", "closed"), ("latitude", "longitude"))
 
 
 class VolunteerRole(models.Model):
@@ -171,7 +260,43 @@ def update_max_applies_from_roles(sender, **kwargs):
     project = kwargs['instance'].project
 
     if project:
-      queryset = VolunteerRole.objects.filter(project=project)
-      vacancies = queryset.aggregate(Sum('vacancies')).get('vacancies__sum')
-      project.max_applies_from_roles = vacancies if vacancies else 0
-      project.save()
+      project.update_max_applies_from_roles()
+
+
+@receiver(post_save, sender=VolunteerRole)
+def promote_role_waitlist(sender, instance, **kwargs):
+  # Raised vacancies may free seats for waitlisted applies
+  if not kwargs.get('raw', False) and not kwargs.get('created', False):
+    capacity.promote_waitlist([instance.pk])
+
+
+@receiver(m2m_changed, sender=Project.causes.through)
+@receiver(m2m_changed, sender=Project.skills.through)
+def update_search_document(sender, instance, action, reverse, pk_set, **kwargs):
+  if not reverse:
+    if action in ['post_add', 'post_remove', 'post_clear']:
+      instance.update_search_document()
+    return
+
+  # Changed from a cause or skill, pk_set holds projects. It's not sent on
+  # clear, so projects are read before the relation is cleared
+  relation = 'causes' if sender is Project.causes.through else 'skills'
+  if action == 'pre_clear':
+    instance._cleared_project_pks = list(Project.objects.filter(**{relation: instance}).values_list('pk', flat=True))
+  if action == 'post_clear':
+    pk_set = instance.__dict__.pop('_cleared_project_pks', [])
+  if action in ['post_add', 'post_remove', 'post_clear'] and pk_set:
+    refresh_search_documents(Project.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_save, sender='ovp_organizations.Organization')
+def update_organization_search_documents(sender, instance, raw=False, **kwargs):
+  if not raw and not kwargs.get('created', False):
+    refresh_search_documents(Project.objects.filter(organization=instance))
+
+
+@receiver(post_save, sender=get_address_model())
+def update_project_position(sender, instance, raw=False, **kwargs):
+  if not raw:
+    latitude, longitude = get_address_position(instance.pk)
+    Project.objects.filter(address_id=instance.pk).update(latitude=latitude, longitude=longitude)
@@ -0,0 +1,53 @@
+class FieldTrackerMixin(object):
+  """
+  Model mixin which snapshots concrete field values when an instance is
+  loaded, so changes can be detected without fetching the row again.
+  """
+  def __init__(self, *args, **kwargs):
+    super(FieldTrackerMixin, self).__init__(*args, **kwargs)
+    self.snapshot_fields()
+
+  def refresh_from_db(self, using=None, fields=None):
+    super(FieldTrackerMixin, self).refresh_from_db(using=using, fields=fields)
+    self.snapshot_fields(fields)
+
+  def snapshot_fields(self, fields=None):
+    """ Stores current values as the original ones. Deferred fields are skipped. """
+    if fields is None:
+      self._field_snapshot = {}
+
+    for field in self._meta.concrete_fields:
+      if fields is not None and field.name not in fields and field.attname not in fields:
+        continue
+      if field.attname in self.__dict__:
+        self._field_snapshot[field.attname] = self.__dict__[field.attname]
+
+  def has_changed(self, name):
+    """ Returns True if field name was modified since the instance was loaded """
+    attname = self._meta.get_field(name).attname
+    if attname not in self.__dict__:
+      return False # Deferred and never loaded or assigned
+    if attname not in self._field_snapshot:
+      return True
+    return self._field_snapshot[attname] != self.__dict__[attname]
+
+  def get_original(self, name):
+    """ Returns the value field name had when the instance was loaded """
+    attname = self._meta.get_field(name).attname
+    if attname in self._field_snapshot:
+      return self._field_snapshot[attname]
+
+    if attname not in self.__dict__:
+      return getattr(self, attname) # Deferred and never assigned, loading it is enough
+
+    if self.pk is None or self._state.adding:
+      return None
+
+    # Field was deferred and then assigned, the original value only lives on the database
+    value = type(self)._default_manager.filter(pk=self.pk).values_list(attname, flat=True).get()
+    self._field_snapshot[attname] = value
+    return value
+
+  def get_dirty_fields(self):
+    """ Returns the names of modified fields """
+    return [field.name for field in self._meta.concrete_fields if not field.primary_key and self.has_changed(field.name)]
@@ -0,0 +1,168 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from ovp_projects import geo
+from ovp_projects import search
+
+
+class KeysetPagination(pagination.BasePagination):
+  """
+  Forward only cursor pagination keyed on (ordering field, pk).
+
+  The cursor holds the (value, pk) pair of the last row of a page and the
+  next page is fetched with WHERE field < value OR (field = value AND
+  pk < pk), so any page costs the same as the first one and rows sharing
+  the same value are never skipped or repeated.
+  """
+  cursor_query_param = 'cursor'
+  page_size = 20
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+  ordering = None
+  invalid_cursor_message = _('Invalid cursor')
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.base_url = request.build_absolute_uri()
+    self.page_size = self.get_page_size(request)
+    self.field = queryset.model._meta.get_field(self.ordering.lstrip('-'))
+    descending = self.ordering.startswith('-')
+
+    if descending:
+      queryset = queryset.order_by('-' + self.field.name, '-pk')
+    else:
+      queryset = queryset.order_by(self.field.name, 'pk')
+
+    position = self.decode_cursor(request)
+    if position is not None:
+      value, pk = position
+      lookup = 'lt' if descending else 'gt'
+      queryset = queryset.filter(Q(**{'{}__{}'.format(self.field.name, lookup): value}) | Q(**{self.field.name: value, 'pk__{}'.format(lookup): pk}))
+
+    results = list(queryset[:self.page_size + 1])
+    self.page = results[:self.page_size]
+    self.has_next = len(results) > self.page_size
+    return self.page
+
+  def get_paginated_response(self, data):
+    return Response(OrderedDict([
+      ('next', self.get_next_link()),
+      ('results', data)
+    ]))
+
+  def get_link_header(self):
+    """ Returns response headers linking the next page, for renderers which can't hold it on the body """
+    link = self.get_next_link()
+    if link is None:
+      return {}
+    return {'Link': '<{}>; rel="next"'.format(link)}
+
+  def get_page_size(self, request):
+    try:
+      page_size = int(request.query_params[self.page_size_query_param])
+    except (KeyError, ValueError):
+      return self.page_size
+
+    if page_size < 1:
+      return self.page_size
+    return min(page_size, self.max_page_size)
+
+  def get_next_link(self):
+    if not self.has_next:
+      return None
+
+    last = self.page[-1]
+    position = '{}|{}'.format(self.get_cursor_value(last), last.pk)
+    encoded = b64encode(position.encode('utf-8')).decode('ascii')
+    return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+  def decode_cursor(self, request):
+    """ Returns the (value, pk) position encoded in the request cursor or None """
+    encoded = request.query_params.get(self.cursor_query_param, None)
+    if encoded is None:
+      return None
+
+    try:
+      value, pk = b64decode(encoded.encode('ascii')).decode('utf-8').rsplit('|', 1)
+      return (self.parse_cursor_value(value), int(pk))
+    except (TypeError, ValueError, ValidationError):
+      raise NotFound(self.invalid_cursor_message)
+
+  def get_cursor_value(self, obj):
+    """ Returns the ordering value of obj as stored on cursors """
+    return self.field.value_to_string(obj)
+
+  def parse_cursor_value(self, value):
+    return self.field.to_python(value)
+
+
+class ManageableProjectsPagination(KeysetPagination):
+  ordering = '-modified_date'
+
+
+class ApplyPagination(KeysetPagination):
+  ordering = 'date'
+
+
+def rank_by_search(queryset, view, position, limit):
+  """ Ranks queryset projects matching the search terms validated by view """
+  return search.get_search_backend(queryset.db).search(queryset, view.get_search_query(), position, limit)
+
+
+def rank_by_distance(queryset, view, position, limit):
+  """ Ranks queryset projects by distance to the point validated by view """
+  point = view.get_proximity_query()
+  return geo.find_nearby(queryset, point['lat'], point['lng'], point['radius'], position, limit)
+
+
+class RankedPagination(KeysetPagination):
+  """
+  Keyset pagination on (rank, pk) pairs computed by ranking instead of a
+  model field. ranking(queryset, view, position, limit) returns up to
+  limit (pk, rank) pairs ordered by rank and pk, after the (rank, pk)
+  position. Only the projects on the page are loaded and their ranks are
+  kept on .ranks, keyed by pk.
+  """
+  ranking = None
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.base_url = request.build_absolute_uri()
+    self.page_size = self.get_page_size(request)
+
+    matches = self.ranking(queryset, view, self.decode_cursor(request), self.page_size + 1)
+
+    self.has_next = len(matches) > self.page_size
+    self.ranks = dict(matches[:self.page_size])
+
+    objects = queryset.in_bulk(list(self.ranks))
+    self.page = [objects[pk] for pk, rank in matches[:self.page_size] if pk in objects]
+    return self.page
+
+  def get_cursor_value(self, obj):
+    return repr(self.ranks[obj.pk])
+
+  def parse_cursor_value(self, value):
+    return float(value)
+
+
+class SearchPagination(RankedPagination):
+  """
+  Pagination of search results on (rank, pk).
+
+  Ranks are computed by the search backend for the terms validated by the
+  view, so matching, ranking and the keyset condition run on a single query.
+  """
+  ranking = staticmethod(rank_by_search)
+
+
+class ProximityPagination(RankedPagination):
+  """ Pagination of nearby projects on (distance, pk), for the point validated by the view """
+  ranking = staticmethod(rank_by_distance)
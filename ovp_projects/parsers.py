@@ -0,0 +1,27 @@
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+import csv
+import io
+
+
+class CSVParser(BaseParser):
+  """
+  Parses a CSV body into a list of dicts keyed by the header row.
+
+  Empty cells are left out of the row, so they are handled as missing
+  optional values instead of blank ones.
+  """
+  media_type = 'text/csv'
+
+  def parse(self, stream, media_type=None, parser_context=None):
+    encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+
+    try:
+      text = stream.read().decode(encoding)
+      reader = csv.DictReader(io.StringIO(text, newline=''))
+      return [{key.strip(): value for key, value in row.items() if key and value not in ('', None)} for row in reader]
+    except (UnicodeDecodeError, csv.Error) as e:
+      raise ParseError('CSV parse error - {}'.format(e))
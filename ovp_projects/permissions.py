@@ -3,8 +3,7 @@ from rest_framework import permissions
 from ovp_organizations.models import Organization
 
 from ovp_projects.models import Project
-
-from django.shortcuts import get_object_or_404
+from ovp_projects.identity import get_identity_map
 
 
 ##############################
@@ -23,26 +22,19 @@ class ProjectCreateOwnsOrIsOrganizationMember(permissions.BasePermission):
     if not isinstance(organization_pk, int):
       return True # Should fail on validator
 
-    try:
-      organization = Organization.objects.get(pk=organization_pk)
-      if organization.owner == request.user or request.user in organization.members.all():
-        return True
-    except Organization.DoesNotExist: #pragma: no cover
-      pass
-    return False
+    identity_map = get_identity_map(request)
+    organization = identity_map.get_or_none(Organization.objects.all(), pk=organization_pk)
+    if organization is None: #pragma: no cover
+      return False
+
+    return organization.owner_id == request.user.pk or identity_map.is_organization_member(organization, request.user)
 
 
 class ProjectRetrieveOwnsOrIsOrganizationMember(permissions.BasePermission):
   """ Permission that only allows the project owner, organization owner
       or organization member to retrieve/modify a existing project. """
   def has_object_permission(self, request, view, obj):
-    if request.user.is_authenticated:
-      if obj.owner == request.user:
-        return True
-      if obj.organization:
-        if request.user in obj.organization.members.all() or request.user == obj.organization.owner:
-          return True
-    return False
+    return get_identity_map(request).can_manage_project(obj, request.user)
 
 
 ##############################
@@ -53,12 +45,6 @@ class ProjectApplyPermission(permissions.BasePermission):
   """ Permission that only allows the project owner, organization owner
       or organization member to retrieve a full list of applies for a project """
   def has_permission(self, request, view):
-    project = get_object_or_404(Project, slug=view.kwargs.get("project_slug"))
-
-    if request.user.is_authenticated:
-      if request.user == project.owner:
-        return True
-      if project.organization:
-        if request.user in project.organization.members.all() or request.user == project.organization.owner:
-          return True
-    return False
+    identity_map = get_identity_map(request)
+    project = identity_map.get(Project.objects.select_related('organization'), slug=view.kwargs.get("project_slug"))
+    return identity_map.can_manage_project(project, request.user)
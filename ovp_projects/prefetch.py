@@ -0,0 +1,98 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+
+from rest_framework import serializers
+
+from ovp_projects import models
+
+# Sources which are not model relations but resolve to one.
+#
+# A source mapped to None is flattened: the fields of its serializer are
+# resolved against the parent model, as done by the disponibility field,
+# which reads from Project.job and Project.work.
+#
+# Any other source maps to a callable returning a (lookup, queryset, to_attr)
+# tuple used to build a Prefetch object.
+SOURCE_PLANS = {
+  (models.Project, 'disponibility'): None,
+  (models.Project, 'active_apply_set'): lambda: ('apply_set', models.Apply.objects.filter(canceled=False), 'prefetched_active_applies'),
+}
+
+
+class QueryPlan(object):
+  """
+  A select_related/prefetch_related plan for a serializer field tree.
+  """
+  def __init__(self):
+    self.select_related = []
+    self.prefetch_related = []
+
+  def apply(self, queryset):
+    if self.select_related:
+      queryset = queryset.select_related(*self.select_related)
+    if self.prefetch_related:
+      queryset = queryset.prefetch_related(*self.prefetch_related)
+    return queryset
+
+
+def get_query_plan(serializer_class, model=None, fields=None):
+  """ Returns a QueryPlan for serializer_class.
+
+  The plan is derived by walking the readable nested serializers and
+  resolving their sources against model(defaults to serializer Meta.model).
+  To-one relations are joined through select_related, to-many relations
+  are fetched through a Prefetch whose queryset gets the nested plan.
+  fields optionally restricts the top level fields that are walked.
+  """
+  serializer = serializer_class()
+  model = model or serializer.Meta.model
+
+  plan = QueryPlan()
+  _walk(serializer, model, '', plan, fields)
+  return plan
+
+
+def apply_query_plan(queryset, serializer_class, fields=None):
+  """ Applies the serializer_class QueryPlan to queryset """
+  return get_query_plan(serializer_class, queryset.model, fields).apply(queryset)
+
+
+def _walk(serializer, model, prefix, plan, fields=None):
+  for field in serializer.fields.values():
+    if field.write_only:
+      continue
+
+    if fields is not None and field.field_name not in fields:
+      continue
+
+    many = isinstance(field, serializers.ListSerializer)
+    child = field.child if many else field
+    if not isinstance(child, serializers.BaseSerializer) or field.source == '*':
+      continue
+
+    source = field.source
+    if (model, source) in SOURCE_PLANS:
+      source_plan = SOURCE_PLANS[(model, source)]
+      if source_plan is None:
+        _walk(child, model, prefix, plan)
+      else:
+        lookup, queryset, to_attr = source_plan()
+        queryset = get_query_plan(child.__class__, queryset.model).apply(queryset)
+        plan.prefetch_related.append(Prefetch(prefix + lookup, queryset=queryset, to_attr=to_attr))
+      continue
+
+    try:
+      model_field = model._meta.get_field(source)
+    except FieldDoesNotExist:
+      continue
+
+    if not model_field.is_relation:
+      continue
+
+    related_model = model_field.related_model
+    if model_field.many_to_many or model_field.one_to_many:
+      queryset = get_query_plan(child.__class__, related_model).apply(related_model._default_manager.all())
+      plan.prefetch_related.append(Prefetch(prefix + source, queryset=queryset))
+    else:
+      plan.select_related.append(prefix + source)
+      _walk(child, related_model, prefix + source + '__', plan)
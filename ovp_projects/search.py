@@ -0,0 +1,159 @@
+"""
+Project full-text search
+
+Each project keeps a precomputed search_document joining its name,
+description, details, organization name, causes and skills. The
+document is indexed by a FTS5 table on SQLite and by a tsvector
+expression index on PostgreSQL, both created on migration 0049. Other
+backends fall back to substring matching on the document.
+
+Backends return (pk, rank) pairs ordered by rank and then pk, lower
+ranks being better matches, so results can be paginated with a
+(rank, pk) keyset.
+"""
+
+from django.db import connections
+
+from ovp_projects.helpers import bulk_update
+
+import re
+
+SEARCH_TABLE = 'ovp_projects_project_search'
+SEARCH_CONFIG = 'simple'
+SEARCH_TERMS_RE = re.compile(r'\w+', re.UNICODE)
+REFRESH_CHUNK_SIZE = 500
+
+# Splits project fields from related names on the search document
+SEARCH_DOCUMENT_SEPARATOR = '\n\x1e\n'
+
+
+def build_search_document(project, related=None):
+  """ Returns the text indexed by project search.
+
+  Project fields come before the separator and organization, causes and
+  skills names after it. related may hold the related part of the current
+  document, so it's reused instead of read again.
+  """
+  if related is None:
+    parts = []
+    if project.organization_id:
+      parts.append(project.organization.name)
+    if project.pk:
+      parts += [cause.name for cause in project.causes.all()]
+      parts += [skill.name for skill in project.skills.all()]
+    related = '\n'.join(part for part in parts if part)
+
+  own = '\n'.join(part for part in [project.name, project.description, project.details] if part)
+  return own + SEARCH_DOCUMENT_SEPARATOR + related
+
+
+def get_related_search_text(document):
+  """ Returns the related part of a search document """
+  return (document or '').partition(SEARCH_DOCUMENT_SEPARATOR)[2]
+
+
+def refresh_search_documents(queryset, chunk_size=REFRESH_CHUNK_SIZE):
+  """ Rebuilds the search document of every project on queryset, reading
+      and writing each chunk of projects with a fixed number of queries """
+  queryset = queryset.select_related('organization').prefetch_related('causes', 'skills').order_by('pk')
+  last_pk = None
+
+  while True:
+    chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+    projects = list(chunk[:chunk_size])
+
+    for project in projects:
+      project.search_document = build_search_document(project)
+    if projects:
+      bulk_update(queryset.model, projects, ['search_document'])
+
+    if len(projects) < chunk_size:
+      break
+    last_pk = projects[-1].pk
+
+
+def get_search_terms(query):
+  """ Returns the lowercased words of query """
+  return [term.lower() for term in SEARCH_TERMS_RE.findall(query or '')]
+
+
+class SearchBackend(object):
+  """ Substring matching on the search document, for backends without full-text indexes """
+  def __init__(self, connection):
+    self.connection = connection
+
+  def search(self, queryset, terms, position=None, limit=None):
+    """ Returns (pk, rank) pairs of queryset projects matching every term,
+        starting after the (rank, pk) position """
+    for term in terms:
+      queryset = queryset.filter(search_document__icontains=term)
+    if position is not None:
+      queryset = queryset.filter(pk__gt=position[1])
+
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    if limit is not None:
+      pks = pks[:limit]
+    return [(pk, 0.0) for pk in pks]
+
+
+class RankedSearchMixin(object):
+  """ Searches with the (sql, params) returned by get_matches_sql(queryset,
+      terms) of the backend, selecting (pk, rank) of matching rows, wrapped
+      with the keyset condition and limit so a page is a single query """
+  def search(self, queryset, terms, position=None, limit=None):
+    sql, params = self.get_page_sql(queryset, terms, position, limit)
+    with self.connection.cursor() as cursor:
+      cursor.execute(sql, params)
+      return [(row[0], row[1]) for row in cursor.fetchall()]
+
+  def get_page_sql(self, queryset, terms, position, limit):
+    sql, params = self.get_matches_sql(queryset, terms)
+    sql = 'SELECT id, search_rank FROM ({}) AS matches'.format(sql)
+    params = list(params)
+
+    if position is not None:
+      sql += ' WHERE search_rank > %s OR (search_rank = %s AND id > %s)'
+      params += [position[0], position[0], position[1]]
+
+    sql += ' ORDER BY search_rank, id'
+    if limit is not None:
+      sql += ' LIMIT %s'
+      params.append(limit)
+    return sql, params
+
+  def get_base_sql(self, queryset):
+    """ Returns a (sql, params) subquery selecting queryset pks """
+    return queryset.order_by().values('pk').query.sql_with_params()
+
+
+class SQLiteSearchBackend(RankedSearchMixin, SearchBackend):
+  """ Ranks matches on the FTS5 table with bm25(), which is negative and lower for better matches """
+  def get_matches_sql(self, queryset, terms):
+    base_sql, base_params = self.get_base_sql(queryset)
+    match = ' '.join('"{}"*'.format(term) for term in terms)
+    sql = 'SELECT rowid AS id, bm25({table}) AS search_rank FROM {table} WHERE {table} MATCH %s AND rowid IN ({base})'.format(table=SEARCH_TABLE, base=base_sql)
+    return sql, [match] + list(base_params)
+
+
+class PostgreSQLSearchBackend(RankedSearchMixin, SearchBackend):
+  """ Ranks matches on the search document tsvector with ts_rank(), negated so lower is better.
+      The rank is cast to double precision so cursors hold it without loss """
+  def get_matches_sql(self, queryset, terms):
+    base_sql, base_params = self.get_base_sql(queryset)
+    vector = "to_tsvector('{}', search_document)".format(SEARCH_CONFIG)
+    query = "to_tsquery('{}', %s)".format(SEARCH_CONFIG)
+    sql = 'SELECT id, -ts_rank({vector}, {query})::float8 AS search_rank FROM ovp_projects_project WHERE {vector} @@ {query} AND id IN ({base})'.format(vector=vector, query=query, base=base_sql)
+    match = ' & '.join('{}:*'.format(term) for term in terms)
+    return sql, [match, match] + list(base_params)
+
+
+SEARCH_BACKENDS = {
+  'sqlite': SQLiteSearchBackend,
+  'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+  """ Returns the search backend for database alias using """
+  connection = connections[using]
+  return SEARCH_BACKENDS.get(connection.vendor, SearchBackend)(connection)
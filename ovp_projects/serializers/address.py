@@ -0,0 +1,80 @@
+from collections import OrderedDict
+
+from ovp_core.helpers import get_address_serializers
+
+from ovp_projects import geo
+from ovp_projects.identity import get_identity_map
+
+from rest_framework import serializers
+
+""" Address serializers """
+address_serializers = get_address_serializers()
+
+
+def can_see_hidden_address(request, project, context=None):
+  """ Returns True if request user is the project owner or a member of its organization.
+      Serializer contexts with 'public_only' set render as anonymous users do """
+  if context is not None and context.get('public_only', False):
+    return False
+
+  user = getattr(request, 'user', None)
+  if user is None or user.pk is None:
+    return False
+
+  if user.pk == project.owner_id:
+    return True
+
+  identity_map = get_identity_map(request)
+  return identity_map.is_organization_member(identity_map.get_related(project, 'organization'), user)
+
+
+class VisibilityAwareAddressField(address_serializers[1]):
+  """
+  Address field which renders None if the project has hidden_address set
+  and request user can't see it. It decides per instance without touching
+  the parent serializer fields, so it is safe to share between threads.
+  """
+  def get_attribute(self, instance):
+    if instance.hidden_address and not can_see_hidden_address(self.context.get('request', None), instance, self.context):
+      return None
+    return super(VisibilityAwareAddressField, self).get_attribute(instance)
+
+
+class PositionField(serializers.Field):
+  """
+  Read-only {lat, lng} of the project. Projects with hidden_address
+  expose a coarse position unless request user can see their address.
+  """
+  def __init__(self, **kwargs):
+    kwargs['source'] = '*'
+    kwargs['read_only'] = True
+    super(PositionField, self).__init__(**kwargs)
+
+  def to_representation(self, instance):
+    if instance.latitude is None or instance.longitude is None:
+      return None
+
+    position = (instance.latitude, instance.longitude)
+    if instance.hidden_address and not can_see_hidden_address(self.context.get('request', None), instance, self.context):
+      position = geo.get_coarse_position(*position)
+
+    return OrderedDict([('lat', position[0]), ('lng', position[1])])
+
+
+class DistanceField(serializers.Field):
+  """ Read-only distance in km, from the context['distances'] dict keyed by project pk """
+  def __init__(self, **kwargs):
+    kwargs['source'] = '*'
+    kwargs['read_only'] = True
+    super(DistanceField, self).__init__(**kwargs)
+
+  def to_representation(self, instance):
+    distance = self.context.get('distances', {}).get(instance.pk, None)
+    return round(distance, 3) if distance is not None else None
+
+
+class ProximityQuerySerializer(serializers.Serializer):
+  """ Validates the point and radius(km) of a proximity query """
+  lat = serializers.FloatField(min_value=-90, max_value=90)
+  lng = serializers.FloatField(min_value=-180, max_value=180)
+  radius = serializers.FloatField(min_value=0, max_value=500, default=10)
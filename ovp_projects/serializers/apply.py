@@ -1,25 +1,86 @@
 from ovp_projects import models
-from ovp_projects.models.apply import apply_status_choices
+from ovp_projects.models.apply import apply_writable_status_choices
 
 from ovp_users.serializers import ShortUserPublicRetrieveSerializer, UserApplyRetrieveSerializer
 from ovp_projects.serializers import role
 
 from rest_framework import serializers
 
+
+def get_applied_project_ids(user, projects=None):
+  """ Returns the set of ids of projects user applied to with a single query.
+      projects optionally restricts the lookup to an iterable of projects """
+  if user is None or user.is_anonymous():
+    return set()
+
+  applies = models.Apply.objects.filter(user=user)
+  if projects is not None:
+    applies = applies.filter(project__in=projects)
+
+  return set(applies.values_list('project_id', flat=True))
+
+
+class CurrentUserIsAppliedField(serializers.Field):
+  """
+  Whether request user applied to the project.
+
+  If serializer context holds 'applied_project_ids', as computed by
+  get_applied_project_ids, no query is done. Otherwise it falls back to
+  an EXISTS query, which is fine for single retrieves.
+  """
+  def __init__(self, **kwargs):
+    kwargs['source'] = '*'
+    kwargs['read_only'] = True
+    super(CurrentUserIsAppliedField, self).__init__(**kwargs)
+
+  def to_representation(self, project):
+    applied_project_ids = self.context.get('applied_project_ids', None)
+    if applied_project_ids is not None:
+      return project.pk in applied_project_ids
+
+    user = getattr(self.context.get('request', None), 'user', None)
+    if user is None or user.is_anonymous():
+      return False
+
+    return models.Apply.objects.filter(user=user, project=project).exists()
+
 class ApplyCreateSerializer(serializers.ModelSerializer):
   email = serializers.EmailField(required=False)
 
   class Meta:
     model = models.Apply
     fields = ['username', 'email', 'phone', 'project', 'user', 'role']
+    # (email, project) conflicts are resolved by the apply route
+    validators = []
+
+class ApplyImportSerializer(serializers.Serializer):
+  """
+  A row of a bulk apply import.
+
+  role is checked against context['role_ids'], the ids of the project
+  roles, so validating a batch doesn't query roles once per row.
+  """
+  username = serializers.CharField(max_length=200, required=False, allow_blank=True)
+  email = serializers.EmailField(max_length=190)
+  phone = serializers.CharField(max_length=30, required=False, allow_blank=True)
+  role = serializers.IntegerField(required=False, allow_null=True)
+
+  def validate_role(self, value):
+    if value is not None and value not in self.context['role_ids']:
+      raise serializers.ValidationError('Invalid role "{}" for this project.'.format(value))
+    return value
 
 class ApplyUpdateSerializer(serializers.ModelSerializer):
-  status = serializers.ChoiceField(choices=apply_status_choices)
+  status = serializers.ChoiceField(choices=apply_writable_status_choices)
 
   class Meta:
     model = models.Apply
     fields = ['status']
 
+class ApplyBulkStatusSerializer(serializers.Serializer):
+  ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+  status = serializers.ChoiceField(choices=apply_writable_status_choices)
+
 class ApplyRetrieveSerializer(serializers.ModelSerializer):
   user = UserApplyRetrieveSerializer()
   status = serializers.CharField()
@@ -0,0 +1,35 @@
+from ovp_core.serializers import cause
+from ovp_core.serializers import skill
+
+from rest_framework import serializers
+
+
+"""
+Association serializers
+
+ovp_core association serializers validate each item with its own query.
+These skip per item validation, items are validated in bulk by
+get_associated_objects.
+"""
+class CauseAssociationSerializer(cause.CauseAssociationSerializer):
+  class Meta(cause.CauseAssociationSerializer.Meta):
+    validators = []
+
+class SkillAssociationSerializer(skill.SkillAssociationSerializer):
+  class Meta(skill.SkillAssociationSerializer.Meta):
+    validators = []
+
+
+def get_associated_objects(model, items):
+  """ Returns the model instances for a list of {'id': pk} items with a
+      single query, raising ValidationError for inexistent ids. """
+  objects = model.objects.in_bulk([item['id'] for item in items])
+
+  if len(objects) != len(set(item['id'] for item in items)):
+    name = model._meta.object_name
+    raise serializers.ValidationError([
+      {} if item['id'] in objects else {'id': ["{} with 'id' {} does not exist.".format(name, item['id'])]}
+      for item in items
+    ])
+
+  return [objects[item['id']] for item in items]
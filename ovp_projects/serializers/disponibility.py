@@ -5,7 +5,6 @@ from ovp_projects.serializers.work import WorkSerializer
 from rest_framework import serializers
 
 from collections import OrderedDict
-from functools import wraps
 
 
 """
@@ -33,42 +32,18 @@ def disponibility_object_validate(d, k):
 
 
 """
-Representation decorator
+Helpers
 """
-def add_disponibility_representation(func):
-  @wraps(func)
-  def _impl(self, instance):
-    # We pop disponibility field to avoid AttributeError on default Serializer.to_representation
-    for i, field in enumerate(self._readable_fields):
-      if field.field_name == "disponibility":
-        disponibility = self._readable_fields.pop(i)
-
-    ret = func(self, instance)
-    self._readable_fields.insert(i, disponibility) # Put disp back
-
-    # Add disponibility representation
-    obj = None
-    ret["disponibility"] = None
-
-    try:
-      type = "job"
-      obj = JobSerializer().to_representation(instance.job)
-    except models.Job.DoesNotExist:
-      try:
-        type = "work"
-        obj = WorkSerializer().to_representation(instance.work)
-      except models.Work.DoesNotExist: # pragma: no cover
-        pass
-
-    if obj:
-      ret["disponibility"] = {
-        "type": type,
-        type: obj
-      }
-
-
-    return ret
-  return _impl
+def get_reverse_one_to_one(instance, name):
+  """ Returns the object related to instance through reverse one-to-one
+      relation name or None. The select_related cache is read if present,
+      otherwise the object is fetched and cached """
+  descriptor = getattr(type(instance), name)
+  if not hasattr(instance, descriptor.cache_name):
+    related_model = descriptor.related.related_model
+    obj = related_model.objects.filter(**{descriptor.related.field.name: instance}).first()
+    setattr(instance, descriptor.cache_name, obj)
+  return getattr(instance, descriptor.cache_name)
 
 
 """
@@ -81,3 +56,20 @@ class DisponibilitySerializer(serializers.Serializer):
 
   class Meta:
     validators=[disponibility_validate]
+
+
+class DisponibilityField(DisponibilitySerializer):
+  """
+  Disponibility read from project job or work.
+  Joined job and work are read without queries or DoesNotExist handling.
+  """
+  def get_attribute(self, instance):
+    return instance
+
+  def to_representation(self, instance):
+    for type in ['job', 'work']:
+      obj = get_reverse_one_to_one(instance, type)
+      if obj is not None:
+        return OrderedDict([("type", type), (type, self.fields[type].to_representation(obj))])
+
+    return None
@@ -1,4 +1,5 @@
 from ovp_projects import models
+from ovp_projects import helpers
 from rest_framework import serializers
 
 """
@@ -18,9 +19,11 @@ def dates_validator(data):
 Serializers
 """
 class JobDateSerializer(serializers.ModelSerializer):
+  id = serializers.IntegerField(required=False)
+
   class Meta:
     model = models.JobDate
-    fields = ['name', 'start_date', 'end_date']
+    fields = ['id', 'name', 'start_date', 'end_date']
 
 class JobSerializer(serializers.ModelSerializer):
   dates = JobDateSerializer(many=True)
@@ -36,11 +39,29 @@ class JobSerializer(serializers.ModelSerializer):
     dates = validated_data.pop('dates')
 
     job = models.Job.objects.create(**validated_data)
-
-    for date in dates:
-      sr = JobDateSerializer(data=date)
-      date_obj = sr.create(date)
-      job.dates.add(date_obj)
+    models.JobDate.objects.bulk_create([models.JobDate(job=job, **date) for date in dates])
     job.update_dates()
 
     return job
+
+  def update(self, instance, validated_data):
+    dates = validated_data.pop('dates', None)
+
+    # Job.save() rewrites the job date, fields are written with an update instead
+    for attr, value in validated_data.items():
+      setattr(instance, attr, value)
+    if validated_data:
+      models.Job.objects.filter(pk=instance.pk).update(**validated_data)
+
+    if dates is not None:
+      new, changed, removed = helpers.diff_nested(instance.dates.all(), dates)
+
+      if removed:
+        models.JobDate.objects.filter(pk__in=[date.pk for date in removed]).delete()
+      helpers.bulk_update(models.JobDate, changed, ['name', 'start_date', 'end_date'])
+      models.JobDate.objects.bulk_create([models.JobDate(job=instance, **date) for date in new])
+
+      if new or changed or removed:
+        instance.update_dates()
+
+    return instance
@@ -1,16 +1,18 @@
 from ovp_projects import models
 from ovp_projects import helpers
-from ovp_projects.decorators import hide_address, add_current_user_is_applied_representation
-from ovp_projects.serializers.disponibility import DisponibilitySerializer, add_disponibility_representation
+from ovp_projects import capacity
+from ovp_projects.identity import get_identity_map
+from ovp_projects.serializers.address import address_serializers, VisibilityAwareAddressField, PositionField, DistanceField
+from ovp_projects.serializers.disponibility import DisponibilityField
 from ovp_projects.serializers.job import JobSerializer
 from ovp_projects.serializers.work import WorkSerializer
 from ovp_projects.serializers.role import VolunteerRoleSerializer
-from ovp_projects.serializers.apply import ProjectAppliesSerializer
+from ovp_projects.serializers.apply import ProjectAppliesSerializer, CurrentUserIsAppliedField
+from ovp_projects.serializers.association import CauseAssociationSerializer, SkillAssociationSerializer, get_associated_objects
 
 from ovp_core import models as core_models
-from ovp_core.helpers import get_address_serializers
-from ovp_core.serializers.cause import CauseSerializer, CauseAssociationSerializer, FullCauseSerializer
-from ovp_core.serializers.skill import SkillSerializer, SkillAssociationSerializer
+from ovp_core.serializers.cause import CauseSerializer, FullCauseSerializer
+from ovp_core.serializers.skill import SkillSerializer
 
 from ovp_uploads.serializers import UploadedImageSerializer
 
@@ -24,9 +26,6 @@ from rest_framework import exceptions
 from rest_framework.compat import set_many
 from rest_framework.utils import model_meta
 
-""" Address serializers """
-address_serializers = get_address_serializers()
-
 """ Validators """
 def organization_validator(data):
   settings = helpers.get_settings()
@@ -39,18 +38,54 @@ def organization_validator(data):
       raise exceptions.ValidationError({'organization': ['This field is required.']})
 
 
+def nested_ids_validator(items, existing, name):
+  """ Ensures nested items ids refer to existing objects """
+  pks = set(obj.pk for obj in existing)
+  errors = []
+
+  for item in items:
+    pk = item.get('id', None)
+    if pk is not None and pk not in pks:
+      errors.append({'id': ["{} with 'id' {} does not exist.".format(name, pk)]})
+    else:
+      errors.append({})
+
+  if any(errors):
+    raise serializers.ValidationError(errors)
+  return items
+
+
+""" Fields """
+class IdentityMapPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+  """ PrimaryKeyRelatedField resolving objects through the request identity map """
+  def to_internal_value(self, data):
+    request = self.context.get('request', None)
+    if request is None:
+      return super(IdentityMapPrimaryKeyRelatedField, self).to_internal_value(data)
+
+    try:
+      obj = get_identity_map(request).get_or_none(self.get_queryset(), pk=data)
+    except (TypeError, ValueError):
+      self.fail('incorrect_type', data_type=type(data).__name__)
+
+    if obj is None:
+      self.fail('does_not_exist', pk_value=data)
+    return obj
+
+
 """ Serializers """
 class ProjectCreateUpdateSerializer(serializers.ModelSerializer):
   address = address_serializers[0]()
-  disponibility = DisponibilitySerializer()
+  organization = IdentityMapPrimaryKeyRelatedField(queryset=Organization.objects.all(), required=False, allow_null=True)
+  disponibility = DisponibilityField()
   roles = VolunteerRoleSerializer(many=True, required=False)
   causes = CauseAssociationSerializer(many=True, required=False)
   skills = SkillAssociationSerializer(many=True, required=False)
 
   class Meta:
     model = models.Project
-    fields = ['id', 'image', 'name', 'slug', 'owner', 'details', 'description', 'highlighted', 'published', 'published_date', 'created_date', 'address', 'organization', 'disponibility', 'roles', 'max_applies', 'minimum_age', 'hidden_address', 'crowdfunding', 'public_project', 'causes', 'skills', 'mode']
-    read_only_fields = ['slug', 'highlighted', 'published', 'published_date', 'created_date']
+    fields = ['id', 'image', 'name', 'slug', 'owner', 'details', 'description', 'highlighted', 'published', 'published_date', 'created_date', 'address', 'organization', 'disponibility', 'roles', 'max_applies', 'minimum_age', 'hidden_address', 'crowdfunding', 'public_project', 'causes', 'skills', 'mode', 'publish_at', 'close_at']
+    read_only_fields = ['slug', 'highlighted', 'published', 'published_date', 'created_date', 'publish_at']
 
   def create(self, validated_data):
     causes = validated_data.pop('causes', [])
@@ -70,10 +105,9 @@ class ProjectCreateUpdateSerializer(serializers.ModelSerializer):
     project = models.Project.objects.create(**validated_data)
 
     # Roles
-    for role_data in roles:
-      role_sr = VolunteerRoleSerializer(data=role_data)
-      role = role_sr.create(role_data)
-      project.roles.add(role)
+    if roles:
+      models.VolunteerRole.objects.bulk_create([models.VolunteerRole(project=project, **role_data) for role_data in roles])
+      project.update_max_applies_from_roles()
 
 
     # Disponibility
@@ -89,15 +123,12 @@ class ProjectCreateUpdateSerializer(serializers.ModelSerializer):
       job_sr = JobSerializer(data=job_data)
       job = job_sr.create(job_data)
 
-    # Associate causes
-    for cause in causes:
-      c = core_models.Cause.objects.get(pk=cause['id'])
-      project.causes.add(c)
+    # Associate causes and skills
+    if causes:
+      project.causes.add(*causes)
 
-    # Associate skills
-    for skill in skills:
-      s = core_models.Skill.objects.get(pk=skill['id'])
-      project.skills.add(s)
+    if skills:
+      project.skills.add(*skills)
 
     return project
 
@@ -125,74 +156,111 @@ class ProjectCreateUpdateSerializer(serializers.ModelSerializer):
       address = address_sr.create(address_data)
       instance.address = address
 
-    if roles:
-      instance.roles.clear()
-      for role_data in roles:
-        role_sr = VolunteerRoleSerializer(data=role_data)
-        role = role_sr.create(role_data)
-        instance.roles.add(role)
+    if roles is not None:
+      self.update_roles(instance, roles)
 
     if disp:
-      models.Work.objects.filter(project=instance).delete()
-      models.Job.objects.filter(project=instance).delete()
+      self.update_disponibility(instance, disp)
 
-      if disp['type'] == 'work':
-        work_data = disp['work']
-        work_data['project'] = instance
-        work_sr = WorkSerializer(data=work_data)
-        work = work_sr.create(work_data)
-
-      if disp['type'] == 'job':
-        job_data = disp['job']
-        job_data['project'] = instance
-        job_sr = JobSerializer(data=job_data)
-        job = job_sr.create(job_data)
-
-    # Associate causes
+    # Associate causes and skills
     if causes:
-      instance.causes.clear()
-      for cause in causes:
-        c = core_models.Cause.objects.get(pk=cause['id'])
-        instance.causes.add(c)
+      instance.causes.set(causes)
 
-    # Associate skills
     if skills:
-      instance.skills.clear()
-      for skill in skills:
-        s = core_models.Skill.objects.get(pk=skill['id'])
-        instance.skills.add(s)
+      instance.skills.set(skills)
 
     instance.save()
 
     return instance
 
+  def update_roles(self, instance, roles):
+    """ Diffs roles by id: unchanged roles are skipped, changed ones are
+        bulk updated, removed ones deleted and new ones bulk created """
+    new, changed, removed = helpers.diff_nested(instance.roles.all(), roles)
+
+    if removed:
+      pks = [role.pk for role in removed]
+      # Keep applies for removed roles. Waitlisted ones are applied, as
+      # applies without a role have no capacity limit. Roles are detached
+      # before deletion so the post_delete signal does not recompute the
+      # project once per role
+      capacity.release_waitlist(pks)
+      models.Apply.objects.filter(role__in=pks).update(role=None)
+      models.VolunteerRole.objects.filter(pk__in=pks).update(project=None)
+      models.VolunteerRole.objects.filter(pk__in=pks).delete()
+    helpers.bulk_update(models.VolunteerRole, changed, ['name', 'prerequisites', 'details', 'vacancies'])
+    models.VolunteerRole.objects.bulk_create([models.VolunteerRole(project=instance, **role_data) for role_data in new])
+
+    # Raised vacancies may free seats for waitlisted applies
+    capacity.promote_waitlist([role.pk for role in changed])
+
+    if new or changed or removed:
+      instance.update_max_applies_from_roles(save=False)
+
+  def update_disponibility(self, instance, disp):
+    """ Updates job or work in place. Job dates are diffed by id """
+    if disp['type'] == 'work':
+      models.Job.objects.filter(project=instance).delete()
+      work_data = disp['work']
+      work = models.Work.objects.filter(project=instance).first()
+
+      if work:
+        WorkSerializer().update(work, work_data)
+      else:
+        work_data['project'] = instance
+        WorkSerializer(data=work_data).create(work_data)
+
+    if disp['type'] == 'job':
+      models.Work.objects.filter(project=instance).delete()
+      job_data = disp['job']
+      job = models.Job.objects.filter(project=instance).first()
+
+      if job:
+        JobSerializer().update(job, job_data)
+      else:
+        job_data['project'] = instance
+        JobSerializer(data=job_data).create(job_data)
+
+  def validate_roles(self, roles):
+    existing = self.instance.roles.all() if self.instance else []
+    return nested_ids_validator(roles, existing, 'Role')
+
+  def validate_disponibility(self, disp):
+    job = disp.get('job', None)
+    if disp['type'] == 'job' and job:
+      existing = []
+      if self.instance:
+        existing = models.JobDate.objects.filter(job__project=self.instance)
+      try:
+        nested_ids_validator(job['dates'], existing, 'Date')
+      except serializers.ValidationError as e:
+        raise serializers.ValidationError({'job': {'dates': e.detail}})
+    return disp
+
+  def validate_causes(self, causes):
+    return get_associated_objects(core_models.Cause, causes)
+
+  def validate_skills(self, skills):
+    return get_associated_objects(core_models.Skill, skills)
+
   def get_validators(self):
     return super(ProjectCreateUpdateSerializer, self).get_validators() + [organization_validator]
 
-  @add_disponibility_representation
-  def to_representation(self, instance):
-    return super(ProjectCreateUpdateSerializer, self).to_representation(instance)
-
 class ProjectRetrieveSerializer(serializers.ModelSerializer):
   image = UploadedImageSerializer()
-  address = address_serializers[1]()
+  address = VisibilityAwareAddressField()
   organization = OrganizationSearchSerializer()
-  disponibility = DisponibilitySerializer()
+  disponibility = DisponibilityField()
   roles = VolunteerRoleSerializer(many=True)
   owner = UserProjectRetrieveSerializer()
   applies = ProjectAppliesSerializer(many=True, source="active_apply_set")
   causes = FullCauseSerializer(many=True)
   skills = SkillSerializer(many=True)
+  current_user_is_applied = CurrentUserIsAppliedField()
 
   class Meta:
     model = models.Project
-    fields = ['slug', 'image', 'name', 'description', 'highlighted', 'published_date', 'address', 'details', 'created_date', 'organization', 'disponibility', 'roles', 'owner', 'minimum_age', 'applies', 'applied_count', 'max_applies', 'max_applies_from_roles', 'closed', 'closed_date', 'published', 'hidden_address', 'crowdfunding', 'public_project', 'causes', 'skills']
-
-  @add_current_user_is_applied_representation
-  @hide_address
-  @add_disponibility_representation
-  def to_representation(self, instance):
-    return super(ProjectRetrieveSerializer, self).to_representation(instance)
+    fields = ['slug', 'image', 'name', 'description', 'highlighted', 'published_date', 'address', 'details', 'created_date', 'organization', 'disponibility', 'roles', 'owner', 'minimum_age', 'applies', 'applied_count', 'max_applies', 'max_applies_from_roles', 'closed', 'closed_date', 'published', 'hidden_address', 'crowdfunding', 'public_project', 'causes', 'skills', 'publish_at', 'close_at', 'current_user_is_applied']
 
 class CompactOrganizationSerializer(serializers.ModelSerializer):
   address = address_serializers[2]()
@@ -203,8 +271,8 @@ class CompactOrganizationSerializer(serializers.ModelSerializer):
 
 class ProjectOnOrganizationRetrieveSerializer(serializers.ModelSerializer):
   image = UploadedImageSerializer()
-  address = address_serializers[1]()
-  disponibility = DisponibilitySerializer()
+  address = VisibilityAwareAddressField()
+  disponibility = DisponibilityField()
   causes = CauseSerializer(many=True)
   skills = SkillSerializer(many=True)
   owner = UserProjectRetrieveSerializer()
@@ -214,25 +282,23 @@ class ProjectOnOrganizationRetrieveSerializer(serializers.ModelSerializer):
     model = models.Project
     fields = ['slug', 'image', 'name', 'description', 'highlighted', 'published_date', 'address', 'details', 'created_date', 'disponibility', 'minimum_age', 'applied_count', 'max_applies', 'max_applies_from_roles', 'closed', 'closed_date', 'published', 'hidden_address', 'crowdfunding', 'public_project', 'causes', 'skills', 'owner', 'organization']
 
-  @hide_address
-  @add_disponibility_representation
-  def to_representation(self, instance):
-    return super(ProjectOnOrganizationRetrieveSerializer, self).to_representation(instance)
-
 
 class ProjectSearchSerializer(serializers.ModelSerializer):
   image = UploadedImageSerializer()
-  address = address_serializers[1]()
+  address = VisibilityAwareAddressField()
   organization = CompactOrganizationSerializer()
   owner = ShortUserPublicRetrieveSerializer()
-  disponibility = DisponibilitySerializer()
+  disponibility = DisponibilityField()
 
   class Meta:
     model = models.Project
     fields = ['slug', 'image', 'name', 'description', 'disponibility', 'highlighted', 'published_date', 'address', 'organization', 'owner', 'applied_count', 'max_applies', 'hidden_address', 'closed']
 
-  @hide_address
-  @add_disponibility_representation
-  def to_representation(self, instance):
-    return super(ProjectSearchSerializer, self).to_representation(instance)
 
+class ProjectProximitySerializer(ProjectSearchSerializer):
+  position = PositionField()
+  distance = DistanceField()
+
+  class Meta:
+    model = models.Project
+    fields = ProjectSearchSerializer.Meta.fields + ['position', 'distance']
@@ -3,9 +3,12 @@ from rest_framework import serializers
 from ovp_projects.models import VolunteerRole
 
 class VolunteerRoleSerializer(serializers.ModelSerializer):
+  id = serializers.IntegerField(required=False)
+
   class Meta:
     model = VolunteerRole
-    fields = ['name', 'prerequisites', 'details', 'vacancies', 'applied_count']
+    fields = ['id', 'name', 'prerequisites', 'details', 'vacancies', 'applied_count']
+    read_only_fields = ['applied_count']
 
 class VolunteerRoleApplySerializer(serializers.ModelSerializer):
   class Meta:
@@ -0,0 +1,200 @@
+"""
+Endpoint benchmarks
+
+Each endpoint is requested through the DRF test client over seeded
+datasets of increasing size. After a warm up request, ITERATIONS requests
+are timed and their queries counted, and one more request is traced for
+peak memory, as tracemalloc would skew timings.
+
+Results are compared against baseline.json. Query counts don't depend on
+the machine, so any increase fails the benchmark. Latency and memory are
+only flagged when they exceed the baseline by more than
+OVP_BENCHMARK_TOLERANCE (0.5 by default), and fail the benchmark with
+OVP_BENCHMARK_STRICT=1. `make benchmark-baseline` stores new results.
+"""
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from ovp_projects.models import Project, VolunteerRole, Apply
+from ovp_users.models import User
+
+import json
+import math
+import os
+import time
+import tracemalloc
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+ITERATIONS = int(os.environ.get('OVP_BENCHMARK_ITERATIONS', 20))
+TOLERANCE = float(os.environ.get('OVP_BENCHMARK_TOLERANCE', 0.5))
+STRICT = os.environ.get('OVP_BENCHMARK_STRICT', '') == '1'
+UPDATE_BASELINE = os.environ.get('OVP_BENCHMARK_UPDATE_BASELINE', '') == '1'
+
+# Absolute slack added to tolerances, so tiny values don't flag on noise
+LATENCY_SLACK_MS = 1
+MEMORY_SLACK_KIB = 64
+
+
+def percentile(samples, percent):
+  """ Nearest rank percentile of samples """
+  ordered = sorted(samples)
+  return ordered[max(0, int(math.ceil(percent / 100.0 * len(ordered))) - 1)]
+
+
+def load_baseline():
+  try:
+    with open(BASELINE_PATH) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return {}
+
+
+def save_baseline(results):
+  with open(BASELINE_PATH, 'w') as f:
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.write('\n')
+
+
+def get_regressions(result, baseline):
+  """ Returns (regression, fatal) tuples of result against its baseline """
+  regressions = []
+  if result['queries'] > baseline['queries']:
+    regressions.append(("queries {} > {}".format(result['queries'], baseline['queries']), True))
+
+  for key, slack in [('p50_ms', LATENCY_SLACK_MS), ('p95_ms', LATENCY_SLACK_MS), ('peak_kib', MEMORY_SLACK_KIB)]:
+    allowed = baseline[key] * (1 + TOLERANCE) + slack
+    if result[key] > allowed:
+      regressions.append(("{} {:.2f} > {:.2f}".format(key, result[key], allowed), STRICT))
+
+  return regressions
+
+
+class EndpointBenchmark(TestCase):
+  """ Latency, query count and peak memory of projects and applies endpoints with an increasing dataset """
+  sizes = (10, 100, 1000)
+
+  def setUp(self):
+    self.owner = User.objects.create_user(email="bench_owner@test.com", password="bench_owner")
+    self.project = Project.objects.create(name="endpoint benchmark", details="abc", owner=self.owner, published=True)
+    self.roles = [VolunteerRole.objects.create(name="role {}".format(i), project=self.project, vacancies=None) for i in range(3)]
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.owner)
+    self.results = {}
+
+  def grow(self, size):
+    """ Brings the owner projects and the project applies, half of them from users, up to size """
+    existing = Project.objects.filter(owner=self.owner).count()
+    Project.objects.bulk_create([Project(name="owned {}".format(i), slug="owned-{}".format(i), details="abc", owner=self.owner) for i in range(existing, size)])
+
+    existing = Apply.objects.filter(project=self.project, email__startswith="bench_volunteer").count()
+    users = [User(email="bench_volunteer{}@test.com".format(i), name="volunteer {}".format(i), slug="bench-volunteer-{}".format(i)) for i in range(existing, size) if i % 2]
+    User.objects.bulk_create(users)
+    users = {user.email: user for user in User.objects.filter(email__in=[user.email for user in users])}
+
+    applies = []
+    for i in range(existing, size):
+      email = "bench_volunteer{}@test.com".format(i)
+      applies.append(Apply(project=self.project, user=users.get(email, None), role=self.roles[i % len(self.roles)], username="volunteer {}".format(i), email=email, phone="123"))
+    Apply.objects.bulk_create(applies)
+
+  def get_appliers(self, size):
+    """ Returns a client authenticated as a new user for each request of a measurement """
+    users = [User(email="bench_applier{}_{}@test.com".format(size, i), name="applier {}".format(i), slug="bench-applier-{}-{}".format(size, i)) for i in range(ITERATIONS + 2)]
+    User.objects.bulk_create(users)
+
+    clients = []
+    for user in User.objects.filter(email__in=[user.email for user in users]).order_by('pk'):
+      client = APIClient()
+      client.force_authenticate(user=user)
+      clients.append(client)
+    return clients
+
+  def consume(self, response):
+    if response.streaming:
+      b''.join(response.streaming_content)
+    return response
+
+  def measure(self, endpoint, size, requests):
+    """ Measures requests, ITERATIONS + 2 callables each sending one request """
+    warmup, timed, traced = requests[0], requests[1:-1], requests[-1]
+    self.consume(warmup())
+
+    latencies = []
+    queries = []
+    for request in timed:
+      with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        response = self.consume(request())
+        latencies.append((time.perf_counter() - start) * 1000)
+      queries.append(len(context.captured_queries))
+      self.assertTrue(response.status_code == 200, "{} answered {}".format(endpoint, response.status_code))
+
+    tracemalloc.start()
+    self.consume(traced())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {'p50_ms': round(percentile(latencies, 50), 2), 'p95_ms': round(percentile(latencies, 95), 2), 'queries': max(queries), 'peak_kib': round(peak / 1024.0, 1)}
+    self.results.setdefault(endpoint, {})[str(size)] = result
+    print("\n{} with {} applies: p50 {:.2f}ms, p95 {:.2f}ms, {} queries, peak memory {:.1f}KiB".format(endpoint, size, result['p50_ms'], result['p95_ms'], result['queries'], result['peak_kib']))
+
+  def request(self, method, url, data=None, client=None):
+    client = client or self.client
+    return lambda: getattr(client, method)(url, data, format="json")
+
+  def repeat(self, method, url, data=None):
+    return [self.request(method, url, data)] * (ITERATIONS + 2)
+
+  def test_endpoints(self):
+    """ Assert endpoints don't regress against the stored baseline """
+    slug = self.project.slug
+
+    for size in self.sizes:
+      self.grow(size)
+
+      self.measure("retrieve", size, self.repeat("get", reverse("project-detail", [slug])))
+      self.measure("manageable", size, self.repeat("get", reverse("project-manageable")))
+      self.measure("export_applied_users", size, self.repeat("get", reverse("project-export-applied-users", [slug]), {"format": "csv"}))
+      self.measure("applies/list", size, self.repeat("get", reverse("project-applies-list", [slug])))
+
+      # Every request moves the apply to another status
+      url = reverse("project-applies-detail", [slug, Apply.objects.filter(project=self.project).latest('pk').pk])
+      self.measure("partial_update", size, [self.request("patch", url, {"status": ["confirmed-volunteer", "applied"][i % 2]}) for i in range(ITERATIONS + 2)])
+
+      # Unapply requests come from the users who just applied
+      appliers = self.get_appliers(size)
+      self.measure("apply", size, [self.request("post", reverse("project-applies-apply", [slug]), client=client) for client in appliers])
+      self.measure("unapply", size, [self.request("post", reverse("project-applies-unapply", [slug]), client=client) for client in appliers])
+
+    self.compare()
+
+  def compare(self):
+    if UPDATE_BASELINE:
+      save_baseline(self.results)
+      print("\nBaseline stored at {}".format(BASELINE_PATH))
+      return
+
+    baseline = load_baseline()
+    if not baseline:
+      print("\nNo baseline at {}, run make benchmark-baseline to store one".format(BASELINE_PATH))
+      return
+
+    failures = []
+    for endpoint, sizes in sorted(self.results.items()):
+      for size, result in sorted(sizes.items(), key=lambda item: int(item[0])):
+        if size not in baseline.get(endpoint, {}):
+          print("\n{} with {} applies: no baseline".format(endpoint, size))
+          continue
+
+        for regression, fatal in get_regressions(result, baseline[endpoint][size]):
+          print("\nREGRESSION {} with {} applies: {}".format(endpoint, size, regression))
+          if fatal:
+            failures.append("{} with {} applies: {}".format(endpoint, size, regression))
+
+    self.assertTrue(not failures, "Endpoints regressed against baseline: {}".format(failures))
@@ -0,0 +1,53 @@
+from django.test import TestCase
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from ovp_projects.export import EXPORT_CHUNK_SIZE
+from ovp_projects.models import Project, Apply
+from ovp_users.models import User
+
+import time
+import tracemalloc
+
+
+class ExportAppliedUsersBenchmark(TestCase):
+  """ Streaming export latency and peak memory with an increasing number of applies """
+  sizes = (1000, 10000, 50000)
+
+  def test_peak_memory_is_bounded(self):
+    """ Assert streaming export peak memory does not grow with the number of applies """
+    user = User.objects.create_user(email="bench_export@test.com", password="bench_export")
+    project = Project(name="export benchmark", details="abc", owner=user)
+    project.save()
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    export = lambda export_format: client.get(reverse("project-export-applied-users", [project.slug]), {"format": export_format})
+
+    # Imports and caches filled by the first requests are not export memory
+    for export_format in ["csv", "xlsx"]:
+      b"".join(export(export_format).streaming_content)
+
+    peaks = {}
+    for size in self.sizes:
+      existing = Apply.objects.count()
+      Apply.objects.bulk_create([Apply(project=project, username="user {}".format(i), email="user{}@test.com".format(i), phone="123") for i in range(existing, size)])
+
+      for export_format in ["csv", "xlsx"]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = export(export_format)
+        length = sum(len(chunk) for chunk in response.streaming_content)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        peaks.setdefault(export_format, []).append(peak)
+        print("\n{} applies as {}: {:.2f}ms, {} bytes, peak memory {:.1f}KiB".format(size, export_format, elapsed * 1000, length, peak / 1024))
+
+    # Exports of less than a chunk hold all their rows at once, so only larger ones are compared
+    chunked = [index for index, size in enumerate(self.sizes) if size > EXPORT_CHUNK_SIZE]
+    for export_format, values in peaks.items():
+      values = [values[index] for index in chunked]
+      self.assertTrue(values[-1] < values[0] * 1.5, "{} peak memory grows with applies: {}".format(export_format, values))
@@ -0,0 +1,36 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ovp_projects.models import Project
+from ovp_users.models import User
+
+import time
+
+
+class SlugGenerationBenchmark(TestCase):
+  """ Project creation latency with an increasing number of colliding names """
+  sizes = (10, 1000, 10000)
+  name = "Mutirão de limpeza"
+
+  def test_creation_latency_with_colliding_names(self):
+    """ Assert creating a project with colliding names costs constant queries """
+    user = User.objects.create_user(email="bench_slug@test.com", password="bench_slug")
+
+    queries = []
+    for size in self.sizes:
+      existing = Project.objects.count()
+      Project.objects.bulk_create([Project(name=self.name, slug="mutirao-de-limpeza-{}".format(i) if i else "mutirao-de-limpeza", details="abc", owner=user) for i in range(existing, size)])
+
+      project = Project(name=self.name, details="abc", owner=user)
+      with CaptureQueriesContext(connection) as context:
+        start = time.perf_counter()
+        project.save()
+        elapsed = time.perf_counter() - start
+      # Project.delete() only flags the project as deleted, keeping its slug
+      Project.objects.filter(pk=project.pk).delete()
+
+      queries.append(len(context.captured_queries))
+      print("\n{} colliding names: {:.2f}ms, {} queries".format(size, elapsed * 1000, queries[-1]))
+
+    self.assertTrue(len(set(queries)) == 1)
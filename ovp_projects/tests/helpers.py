@@ -0,0 +1,31 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+  """ TestCase mixin with assertions over the number of executed queries """
+  def count_queries(self, func):
+    with CaptureQueriesContext(connection) as context:
+      func()
+    return len(context.captured_queries)
+
+  def assertQueryCountIsFlat(self, grow, func, sizes=(1, 5, 20)):
+    """ Assert func() runs the same number of queries for every size.
+
+    grow(size) is called before each measurement and should bring the
+    dataset up to size objects. Returns the measured query count.
+    """
+    counts = []
+    for size in sizes:
+      grow(size)
+      counts.append(self.count_queries(func))
+
+    self.assertTrue(len(set(counts)) == 1, "Query count grows with dataset size: {}".format(dict(zip(sizes, counts))))
+    return counts[0]
+
+
+# Surrogate keys received by stub_purge_hook, for OVP_PROJECTS.PURGE_HOOK
+purged_keys = []
+
+def stub_purge_hook(keys):
+  purged_keys.extend(keys)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import glob
 import os
+import tempfile
 import sys
 
 import django
@@ -82,6 +83,9 @@ settings.configure(
     DATABASES={
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
+            # A file, so concurrency tests can open several connections to it.
+            # Named after the process, so concurrent runs don't share it
+            'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'ovp_projects_tests_{}.sqlite3'.format(os.getpid()))},
         }
     },
     LANGUAGE_CODE='en-us',
@@ -140,6 +144,8 @@ else: #pragma: no cover
 args.append(test_cases)
 # ``verbosity`` can be overwritten from command line.
 args.append('--verbosity=2')
+# Never prompt, the test database file belongs to this run only
+args.append('--noinput')
 args.extend(sys.argv[offset:])
 
 execute_from_command_line(args)
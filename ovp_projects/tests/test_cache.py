@@ -0,0 +1,240 @@
+import threading
+
+from django.core.cache import caches
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from ovp_users.models import User
+from ovp_organizations.models import Organization
+from ovp_core.models import GoogleAddress
+
+from ovp_projects import cache
+from ovp_projects.tests import helpers
+from ovp_projects.models import Project, VolunteerRole, Apply, Job, JobDate
+
+
+@override_settings(OVP_PROJECTS={"RETRIEVE_CACHE": True})
+class RetrieveCacheTestCase(TestCase):
+  def setUp(self):
+    caches["default"].clear()
+    self.owner = User.objects.create_user(email="test_owner@test.com", password="test_owner")
+    self.user = User.objects.create_user(email="test_user@test.com", password="test_user")
+
+    address = GoogleAddress(typed_address="Rua. Teçaindá, 81")
+    address.save()
+    self.project = Project(name="test project", details="abc", owner=self.owner, address=address, hidden_address=True, published=True)
+    self.project.save()
+
+    self.client = APIClient()
+
+  def retrieve(self):
+    return self.client.get(reverse("project-detail", ["test-project"]), format="json")
+
+  def test_anonymous_retrieve_is_cached(self):
+    """Test a repeated anonymous retrieve runs no queries"""
+    self.assertTrue(self.retrieve().status_code == 200)
+    with self.assertNumQueries(0):
+      response = self.retrieve()
+    self.assertTrue(response.data["name"] == "test project")
+
+  def test_unknown_slug(self):
+    """Test retrieving an unknown slug returns 404"""
+    response = self.client.get(reverse("project-detail", ["unknown"]), format="json")
+    self.assertTrue(response.status_code == 404)
+
+  def test_invalidation(self):
+    """Test changes to the project, roles, applies, job and job dates invalidate the cached payload"""
+    self.retrieve()
+
+    self.project.name = "changed"
+    self.project.save()
+    self.assertTrue(self.retrieve().data["name"] == "changed")
+
+    role = VolunteerRole.objects.create(name="role", vacancies=1, project=self.project)
+    self.assertTrue(len(self.retrieve().data["roles"]) == 1)
+
+    Apply.objects.create(user=self.user, project=self.project, email=self.user.email)
+    self.assertTrue(self.retrieve().data["applied_count"] == 1)
+
+    job = Job.objects.create(project=self.project, start_date="2030-01-01T10:00:00Z", end_date="2030-01-01T12:00:00Z")
+    self.assertTrue(self.retrieve().data["disponibility"]["type"] == "job")
+
+    date = job.dates.first()
+    date.name = "renamed"
+    date.save()
+    self.assertTrue(self.retrieve().data["disponibility"]["job"]["dates"][0]["name"] == "renamed")
+
+  def test_reused_slug(self):
+    """Test a slug freed by a slug change or a hard delete resolves to the project now holding it"""
+    self.retrieve()
+    self.project.slug = "renamed-project"
+    self.project.save()
+
+    other = Project(name="test project", details="other", owner=self.owner, published=True)
+    other.save()
+    self.assertTrue(other.slug == "test-project")
+    self.assertTrue(self.retrieve().data["details"] == "other")
+
+    Project.objects.filter(pk=other.pk).delete()
+    third = Project(name="test project", details="third", owner=self.owner, published=True)
+    third.save()
+    self.assertTrue(third.slug == "test-project")
+    self.assertTrue(self.retrieve().data["details"] == "third")
+
+  def test_related_invalidation(self):
+    """Test changes to the project organization, address and owner invalidate the cached payload"""
+    organization = Organization(name="test organization", type=0, owner=self.owner)
+    organization.save()
+    self.project.organization = organization
+    self.project.save()
+    self.client.force_authenticate(user=self.owner)
+    self.retrieve()
+
+    organization.name = "renamed organization"
+    organization.save()
+    self.assertTrue(self.retrieve().data["organization"]["name"] == "renamed organization")
+
+    self.owner.name = "renamed owner"
+    self.owner.save()
+    self.assertTrue(self.retrieve().data["owner"]["name"] == "renamed owner")
+
+    address = self.project.address
+    address.typed_address = "Rua Capote Valente, 701"
+    address.save()
+    self.assertTrue(self.retrieve().data["address"]["typed_address"] == "Rua Capote Valente, 701")
+
+  def test_user_fields_are_layered(self):
+    """Test current_user_is_applied and hidden address visibility follow request user on cached payloads"""
+    Apply.objects.create(user=self.user, project=self.project, email=self.user.email)
+
+    response = self.retrieve()
+    self.assertTrue(response.data["address"] is None)
+    self.assertFalse(response.data["current_user_is_applied"])
+
+    self.client.force_authenticate(user=self.user)
+    response = self.retrieve()
+    self.assertTrue(response.data["address"] is None)
+    self.assertTrue(response.data["current_user_is_applied"])
+
+    self.client.force_authenticate(user=self.owner)
+    response = self.retrieve()
+    self.assertTrue(response.data["address"]["typed_address"] == "Rua. Teçaindá, 81")
+    self.assertFalse(response.data["current_user_is_applied"])
+
+    self.client.force_authenticate(user=None)
+    self.assertTrue(self.retrieve().data["address"] is None)
+
+
+@override_settings(OVP_PROJECTS={"RETRIEVE_CACHE": True})
+class SingleFlightTestCase(TestCase):
+  def setUp(self):
+    caches["default"].clear()
+
+  def test_waits_for_builder(self):
+    """Test a miss waits for the request holding the lock instead of building again"""
+    calls = []
+    def build():
+      calls.append(1)
+      return "built"
+
+    caches["default"].add("key:lock", 1)
+    threading.Timer(0.1, lambda: caches["default"].set("key", "from builder")).start()
+
+    self.assertTrue(cache.get_or_build("key", build) == "from builder")
+    self.assertTrue(calls == [])
+
+  def test_builds_once(self):
+    """Test the lock holder builds the value once and releases the lock"""
+    calls = []
+    def build():
+      calls.append(1)
+      return "built"
+
+    self.assertTrue(cache.get_or_build("key", build) == "built")
+    self.assertTrue(cache.get_or_build("key", build) == "built")
+    self.assertTrue(calls == [1])
+    self.assertTrue(caches["default"].get("key:lock") is None)
+
+
+@override_settings(OVP_PROJECTS={"CONDITIONAL_RETRIEVE": True})
+class ConditionalRetrieveTestCase(TestCase):
+  def setUp(self):
+    caches["default"].clear()
+    self.owner = User.objects.create_user(email="test_owner@test.com", password="test_owner")
+    self.project = Project(name="test project", details="abc", owner=self.owner, published=True)
+    self.project.save()
+    self.client = APIClient()
+
+  def retrieve(self, **headers):
+    return self.client.get(reverse("project-detail", ["test-project"]), format="json", **headers)
+
+  def test_validators(self):
+    """Test retrieve responses carry ETag, Last-Modified and Surrogate-Key headers"""
+    response = self.retrieve()
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response["ETag"].startswith('"'))
+    self.assertTrue(response["Last-Modified"])
+    self.assertTrue(response["Surrogate-Key"] == "project-{}".format(self.project.pk))
+
+  def test_if_none_match(self):
+    """Test a matching If-None-Match returns 304 without running queries"""
+    etag = self.retrieve()["ETag"]
+
+    with self.assertNumQueries(0):
+      response = self.retrieve(HTTP_IF_NONE_MATCH=etag)
+    self.assertTrue(response.status_code == 304)
+    self.assertTrue(response["ETag"] == etag)
+
+  def test_etag_follows_changes(self):
+    """Test the ETag changes when the project or its children change"""
+    etag = self.retrieve()["ETag"]
+
+    VolunteerRole.objects.create(name="role", vacancies=1, project=self.project)
+    response = self.retrieve(HTTP_IF_NONE_MATCH=etag)
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response["ETag"] != etag)
+    self.assertTrue(len(response.data["roles"]) == 1)
+
+  def test_etag_follows_related_changes(self):
+    """Test the ETag changes when the project organization is renamed"""
+    organization = Organization(name="test organization", type=0, owner=self.owner)
+    organization.save()
+    self.project.organization = organization
+    self.project.save()
+    etag = self.retrieve()["ETag"]
+
+    organization.name = "renamed organization"
+    organization.save()
+    response = self.retrieve(HTTP_IF_NONE_MATCH=etag)
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response.data["organization"]["name"] == "renamed organization")
+
+  def test_etag_varies_by_user(self):
+    """Test users get their own ETags, as representations include per-user fields"""
+    etag = self.retrieve()["ETag"]
+
+    self.client.force_authenticate(user=self.owner)
+    response = self.retrieve(HTTP_IF_NONE_MATCH=etag)
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response["ETag"] != etag)
+
+
+@override_settings(OVP_PROJECTS={"PURGE_HOOK": "ovp_projects.tests.helpers.stub_purge_hook"})
+class PurgeHookTestCase(TransactionTestCase):
+  def setUp(self):
+    caches["default"].clear()
+    del helpers.purged_keys[:]
+
+  def test_purge_on_change(self):
+    """Test the purge hook receives the surrogate keys of changed projects once changes commit"""
+    owner = User.objects.create_user(email="test_owner@test.com", password="test_owner")
+    project = Project(name="test project", details="abc", owner=owner)
+    project.save()
+    del helpers.purged_keys[:]
+
+    VolunteerRole.objects.create(name="role", vacancies=1, project=project)
+    self.assertTrue("project-{}".format(project.pk) in helpers.purged_keys)
@@ -0,0 +1,102 @@
+from django.core import mail
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from ovp_users.models import User
+
+from ovp_projects import capacity
+from ovp_projects.applies import import_applies, update_applies_status
+from ovp_projects.counters import recount_applied_counters
+from ovp_projects.models import Project, VolunteerRole, Apply
+from ovp_projects.serializers.project import ProjectCreateUpdateSerializer
+
+
+@override_settings(OVP_PROJECTS={"HARD_ROLE_CAPACITY": True})
+class HardRoleCapacityTestCase(TransactionTestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.project = Project.objects.create(name="test project", owner=self.owner)
+    self.role = VolunteerRole.objects.create(name="role", vacancies=2, project=self.project)
+
+  def _apply(self, email):
+    apply = Apply(project=self.project, role=self.role, email=email)
+    apply.save()
+    return apply
+
+  def _assert_counts(self, role_count, project_count):
+    self.assertTrue(VolunteerRole.objects.get(pk=self.role.pk).applied_count == role_count)
+    self.assertTrue(Project.objects.get(pk=self.project.pk).applied_count == project_count)
+
+  def _statuses(self):
+    return list(Apply.objects.filter(project=self.project).order_by('pk').values_list('status', flat=True))
+
+  def test_applies_beyond_vacancies_are_waitlisted(self):
+    """ Assert applies beyond role vacancies are waitlisted and not counted """
+    mail.outbox = []
+    applies = [self._apply("user{}@test.com".format(i)) for i in range(4)]
+
+    self.assertTrue([apply.status for apply in applies] == ["applied", "applied", "waitlisted", "waitlisted"])
+    self._assert_counts(2, 2)
+    self.assertTrue(len([email for email in mail.outbox if email.subject == "Waitlisted for project"]) == 2)
+
+    self.assertTrue(recount_applied_counters() == (0, 0))
+
+  def test_freed_seats_promote_waitlist_in_order(self):
+    """ Assert seats freed by unapplies and raised vacancies promote the oldest waitlisted applies """
+    applies = [self._apply("user{}@test.com".format(i)) for i in range(5)]
+    mail.outbox = []
+
+    applies[0].canceled = True
+    applies[0].save()
+    self.assertTrue(self._statuses() == ["unapplied", "applied", "applied", "waitlisted", "waitlisted"])
+    self._assert_counts(2, 2)
+    self.assertTrue([email.to for email in mail.outbox if email.subject == "Applied to project"] == [["user2@test.com"]])
+
+    role = VolunteerRole.objects.get(pk=self.role.pk)
+    role.vacancies = 10
+    role.save()
+    self.assertTrue(self._statuses() == ["unapplied", "applied", "applied", "applied", "applied"])
+    self._assert_counts(4, 4)
+
+  def test_roles_without_vacancies_are_unlimited(self):
+    """ Assert roles without vacancies never waitlist applies """
+    self.role.vacancies = None
+    self.role.save()
+    for i in range(3):
+      self._apply("user{}@test.com".format(i))
+    self._assert_counts(3, 3)
+
+  def test_bulk_operations_respect_capacity(self):
+    """ Assert imports and bulk status updates give the seats left in order and waitlist the others """
+    import_applies(self.project, [{"email": "user{}@test.com".format(i), "role": self.role.pk} for i in range(3)])
+    self.assertTrue(self._statuses() == ["applied", "applied", "waitlisted"])
+    self._assert_counts(2, 2)
+
+    pk = Apply.objects.filter(project=self.project).order_by('pk').first().pk
+    results = update_applies_status(self.project, [pk], "not-volunteer")
+    self.assertTrue(results == {pk: "updated"})
+    self.assertTrue(self._statuses() == ["not-volunteer", "applied", "applied"])
+    self._assert_counts(2, 3)
+
+    results = update_applies_status(self.project, [pk], "confirmed-volunteer")
+    self.assertTrue(results == {pk: "waitlisted"})
+    self._assert_counts(2, 2)
+
+  def test_reserve_seats(self):
+    """ Assert reserve_seats never exceeds vacancies """
+    self.assertTrue(capacity.reserve_seats(self.role.pk) == 1)
+    self.assertTrue(capacity.reserve_seats(self.role.pk, 5) == 1)
+    self.assertTrue(capacity.reserve_seats(self.role.pk) == 0)
+    self._assert_counts(2, 0)
+
+  def test_removed_role_releases_waitlist(self):
+    """ Assert waitlisted applies of a removed role are applied and counted on the project """
+    applies = [self._apply("user{}@test.com".format(i)) for i in range(3)]
+    mail.outbox = []
+
+    ProjectCreateUpdateSerializer().update_roles(self.project, [])
+    self.assertTrue(self._statuses() == ["applied", "applied", "applied"])
+    self.assertTrue(Apply.objects.filter(role__isnull=False).count() == 0)
+    self.assertTrue(Project.objects.get(pk=self.project.pk).applied_count == 3)
+    self.assertTrue([email.to for email in mail.outbox if email.subject == "Applied to project"] == [[applies[2].email]])
+    self.assertTrue(recount_applied_counters() == (0, 0))
@@ -1,39 +1,183 @@
 import sys
 from io import StringIO
 
-from django.test import TestCase
+from django.core import mail
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
 from django.utils import timezone
 
 from ovp_users.models import User
-from ovp_projects.models import Project, Job
+from ovp_projects.models import Project, Job, OutboxEmail
 from ovp_projects.management.commands.close_finished_projects import Command as CloseFinishedProjects
+from ovp_projects.management.commands.run_scheduled_transitions import Command as RunScheduledTransitions
+from ovp_projects.transitions import close_finished_projects
+from ovp_projects.transitions import run_scheduled_transitions
 
+from datetime import timedelta
 
 
-class TestCloseProjectsCommand(TestCase):
-  def test_close_finished_projects(self):
-    """Test close_finished_projects command"""
-    user = User.objects.create_user(email="test_owner@test.com", password="test_owner")
-    user.save()
+def run_command(command, **options):
+  saved_stdout = sys.stdout
+  try:
+    out = StringIO()
+    sys.stdout = out
+    command.handle(**options)
+    return out.getvalue().strip().split("\n")
+  finally:
+    sys.stdout = saved_stdout
+
+
+def create_finished_project(owner, name="test", ended=timedelta(days=1)):
+  project = Project(name=name, owner=owner)
+  project.save()
 
-    p = Project(name="test", owner=user)
-    p.save()
+  end_date = timezone.now() - ended
+  job = Job(start_date=end_date, end_date=end_date, project=project)
+  job.save()
+  return project
 
-    job = Job(start_date=timezone.now(), end_date=timezone.now(), project=p)
-    job.save()
 
-    saved_stdout = sys.stdout
-    try:
-      out = StringIO()
-      sys.stdout = out
+class TestCloseProjectsCommand(TransactionTestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_owner@test.com", password="test_owner")
 
-      cmd = CloseFinishedProjects()
-      cmd.handle()
+  def test_close_finished_projects(self):
+    """Test close_finished_projects command"""
+    p = create_finished_project(self.user)
+    mail.outbox = []
 
-      output = out.getvalue().strip()
-    finally:
-      sys.stdout = saved_stdout
+    output = run_command(CloseFinishedProjects())
 
     p = Project.objects.get(pk=p.pk)
-    self.assertTrue(output == "Closing 1 finished projects")
+    self.assertTrue(output[-1] == "Closed 1 finished projects")
+    self.assertTrue(output[0].startswith("Batch 1: 1 projects in "))
     self.assertTrue(p.closed)
+    self.assertTrue(p.closed_date)
+    self.assertTrue(len(mail.outbox) == 1)
+    self.assertTrue(mail.outbox[0].to == ["test_owner@test.com"])
+
+  def test_dry_run(self):
+    """Test close_finished_projects --dry-run does not close projects"""
+    p = create_finished_project(self.user)
+
+    output = run_command(CloseFinishedProjects(), dry_run=True)
+
+    self.assertTrue(output[-1] == "Would close 1 finished projects")
+    self.assertFalse(Project.objects.get(pk=p.pk).closed)
+
+  def test_batches_and_since(self):
+    """Test close_finished_projects closes in batches and skips projects which ended before --since"""
+    for i in range(5):
+      create_finished_project(self.user, "recent")
+    old = create_finished_project(self.user, "old", ended=timedelta(days=30))
+    open_project = create_finished_project(self.user, "open", ended=-timedelta(days=1))
+
+    since = (timezone.now() - timedelta(days=7)).isoformat()
+    output = run_command(CloseFinishedProjects(), batch_size=2, since=since)
+
+    self.assertTrue(len(output) == 4)
+    self.assertTrue(output[-1] == "Closed 5 finished projects")
+    self.assertTrue(Project.objects.filter(closed=True, name="recent").count() == 5)
+    self.assertFalse(Project.objects.get(pk=old.pk).closed)
+    self.assertFalse(Project.objects.get(pk=open_project.pk).closed)
+
+  @override_settings(OVP_EMAILS={"projectClosed": {"disabled": True}})
+  def test_batch_query_count_is_flat(self):
+    """Test closing a batch costs the same number of queries regardless of its size"""
+    def close(size):
+      for i in range(size):
+        create_finished_project(self.user)
+      with CaptureQueriesContext(connection) as context:
+        self.assertTrue(close_finished_projects(batch_size=100) == size)
+      return len(context.captured_queries)
+
+    self.assertTrue(close(1) == close(20))
+
+
+class TestScheduledTransitionsCommand(TransactionTestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_owner@test.com", password="test_owner")
+
+  def create_scheduled_project(self, name="test", **schedule):
+    project = Project(name=name, owner=self.user, **schedule)
+    project.save()
+    return project
+
+  def test_run_scheduled_transitions(self):
+    """Test run_scheduled_transitions publishes and closes due projects and clears their schedule"""
+    past = timezone.now() - timedelta(hours=1)
+    future = timezone.now() + timedelta(hours=1)
+    to_publish = self.create_scheduled_project(publish_at=past)
+    to_close = self.create_scheduled_project(close_at=past)
+    not_due = self.create_scheduled_project(publish_at=future, close_at=future)
+    mail.outbox = []
+
+    output = run_command(RunScheduledTransitions())
+
+    self.assertTrue(output[-1] == "Updated: 1 published, 1 closed")
+    self.assertTrue(output[0].startswith("Published batch 1: 1 projects in "))
+
+    to_publish = Project.objects.get(pk=to_publish.pk)
+    self.assertTrue(to_publish.published)
+    self.assertTrue(to_publish.published_date)
+    self.assertTrue(to_publish.publish_at is None)
+
+    to_close = Project.objects.get(pk=to_close.pk)
+    self.assertTrue(to_close.closed)
+    self.assertTrue(to_close.closed_date)
+    self.assertTrue(to_close.close_at is None)
+
+    not_due = Project.objects.get(pk=not_due.pk)
+    self.assertFalse(not_due.published)
+    self.assertFalse(not_due.closed)
+    self.assertTrue(not_due.publish_at and not_due.close_at)
+
+    self.assertTrue(len(mail.outbox) == 2)
+
+  def test_dry_run(self):
+    """Test run_scheduled_transitions --dry-run does not update projects"""
+    project = self.create_scheduled_project(publish_at=timezone.now() - timedelta(hours=1))
+
+    output = run_command(RunScheduledTransitions(), dry_run=True)
+
+    self.assertTrue(output[-1] == "Would update: 1 published, 0 closed")
+    self.assertFalse(Project.objects.get(pk=project.pk).published)
+
+  def test_deleted_projects_are_skipped(self):
+    """Test deleted projects are not published by their schedule"""
+    project = self.create_scheduled_project(publish_at=timezone.now() - timedelta(hours=1))
+    Project.objects.filter(pk=project.pk).update(deleted=True)
+
+    self.assertTrue(run_scheduled_transitions() == {'published': 0, 'closed': 0})
+
+  @override_settings(OVP_EMAILS={"projectPublished": {"disabled": True}, "projectClosed": {"disabled": True}})
+  def test_query_count_is_flat(self):
+    """Test applying scheduled transitions costs the same number of queries regardless of the number of projects"""
+    def run(size):
+      past = timezone.now() - timedelta(hours=1)
+      for i in range(size):
+        self.create_scheduled_project(publish_at=past, close_at=past)
+      with CaptureQueriesContext(connection) as context:
+        self.assertTrue(run_scheduled_transitions(batch_size=100) == {'published': size, 'closed': size})
+      return len(context.captured_queries)
+
+    self.assertTrue(run(1) == run(20))
+
+
+@override_settings(OVP_PROJECTS={"EMAIL_OUTBOX": True})
+class TestCloseProjectsOutbox(TransactionTestCase):
+  def test_emails_are_enqueued_in_bulk(self):
+    """Test closing emails are enqueued on the outbox with a single insert per batch"""
+    user = User.objects.create_user(email="test_owner@test.com", password="test_owner")
+    for i in range(3):
+      create_finished_project(user)
+    OutboxEmail.objects.all().delete()
+
+    with CaptureQueriesContext(connection) as context:
+      self.assertTrue(close_finished_projects() == 3)
+
+    inserts = [q for q in context.captured_queries if q["sql"].startswith('INSERT INTO "ovp_projects_outboxemail"')]
+    self.assertTrue(len(inserts) == 1)
+    self.assertTrue(OutboxEmail.objects.filter(template_name="projectClosed", recipient="test_owner@test.com").count() == 3)
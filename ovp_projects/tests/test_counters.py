@@ -0,0 +1,105 @@
+import sys
+from io import StringIO
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ovp_users.models import User
+from ovp_projects.models import Project, VolunteerRole, Apply
+from ovp_projects.management.commands.recount_applied_counters import Command as RecountAppliedCounters
+
+
+class AppliedCountersTestCase(TestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.project = Project(name="test project", details="abc", owner=self.owner)
+    self.project.save()
+    self.role = VolunteerRole(name="role", vacancies=5, project=self.project)
+    self.role.save()
+
+  def _assert_counts(self, role_count, project_count):
+    self.assertTrue(VolunteerRole.objects.get(pk=self.role.pk).applied_count == role_count)
+    self.assertTrue(Project.objects.get(pk=self.project.pk).applied_count == project_count)
+
+  def test_counters_follow_status_transitions(self):
+    """ Assert counters are only touched when the counting state changes """
+    apply = Apply(project=self.project, role=self.role, email="a@test.com")
+    apply.save()
+    self._assert_counts(1, 1)
+
+    apply.save()
+    self._assert_counts(1, 1)
+
+    apply.status = "not-volunteer"
+    apply.save()
+    self._assert_counts(0, 1)
+
+    apply.status = "confirmed-volunteer"
+    apply.save()
+    self._assert_counts(1, 1)
+
+    apply.canceled = True
+    apply.save()
+    self._assert_counts(0, 0)
+
+    apply.canceled = False
+    apply.save()
+    self._assert_counts(1, 1)
+
+  def test_counters_do_not_overwrite_concurrent_updates(self):
+    """ Assert stale in-memory instances don't lose counter updates """
+    first = Apply(project=self.project, role=self.role, email="a@test.com")
+    second = Apply(project=Project.objects.get(pk=self.project.pk), role=VolunteerRole.objects.get(pk=self.role.pk), email="b@test.com")
+
+    first.save()
+    second.save()
+    self._assert_counts(2, 2)
+
+  def test_changing_role_moves_count(self):
+    """ Assert moving an apply to another role moves the role count """
+    other_role = VolunteerRole(name="other role", vacancies=5, project=self.project)
+    other_role.save()
+
+    apply = Apply(project=self.project, role=self.role, email="a@test.com")
+    apply.save()
+    apply.role = other_role
+    apply.save()
+
+    self._assert_counts(0, 1)
+    self.assertTrue(VolunteerRole.objects.get(pk=other_role.pk).applied_count == 1)
+
+  @override_settings(OVP_EMAILS={"volunteerApplied-ToVolunteer": {"disabled": True}, "volunteerApplied-ToOwner": {"disabled": True}})
+  def test_apply_does_not_save_project(self):
+    """ Assert applying costs one insert and two counter updates """
+    apply = Apply(project=self.project, role=self.role, email="a@test.com")
+
+    with self.assertNumQueries(3):
+      apply.save()
+
+
+class RecountAppliedCountersCommandTestCase(TestCase):
+  def test_recount_fixes_drift(self):
+    """ Assert recount_applied_counters reconciles drifted counters """
+    owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    project = Project(name="test project", details="abc", owner=owner)
+    project.save()
+    role = VolunteerRole(name="role", vacancies=5, project=project)
+    role.save()
+
+    Apply(project=project, role=role, email="a@test.com").save()
+    Apply(project=project, role=role, email="b@test.com").save()
+    VolunteerRole.objects.filter(pk=role.pk).update(applied_count=10)
+    Project.objects.filter(pk=project.pk).update(applied_count=0)
+
+    saved_stdout = sys.stdout
+    try:
+      out = StringIO()
+      sys.stdout = out
+      RecountAppliedCounters().handle()
+      output = out.getvalue().strip()
+    finally:
+      sys.stdout = saved_stdout
+
+    self.assertTrue(output == "Fixed applied count on 1 roles and 1 projects")
+    self.assertTrue(VolunteerRole.objects.get(pk=role.pk).applied_count == 2)
+    self.assertTrue(Project.objects.get(pk=project.pk).applied_count == 2)
@@ -1,12 +1,21 @@
 from django.test import TestCase
+from django.test import TransactionTestCase
 from django.core import mail
+from django.core.mail.backends import locmem
+from django.db import transaction
 from django.test.utils import override_settings
+from django.utils import timezone
 
 from ovp_core.helpers import get_email_subject, is_email_enabled
 from ovp_users.models import User
-from ovp_projects.models import Project, Apply
+from ovp_projects.models import Project, Apply, OutboxEmail
+from ovp_projects.emails import drain_outbox, RateLimiter
 
-class TestEmailTriggers(TestCase):
+from smtplib import SMTPException
+
+import time
+
+class TestEmailTriggers(TransactionTestCase):
   def test_project_creation_trigger_email(self):
     """Assert that email is triggered when creating a project"""
     user = User.objects.create_user(email="test_project@project.com", password="test_project")
@@ -103,3 +112,108 @@ class TestEmailTriggers(TestCase):
     if is_email_enabled("volunteerUnapplied-ToOwner"): # pragma: no cover
       self.assertTrue(get_email_subject("volunteerUnapplied-ToOwner", "Volunteer unapplied from project") in subjects)
       self.assertTrue("test_volunteer@project.com" in recipients)
+
+  def test_emails_are_sent_on_commit(self):
+    """Assert emails are sent once the transaction commits, and not sent if it rolls back"""
+    user = User.objects.create_user(email="test_project@project.com", password="test_project")
+    mail.outbox = []
+
+    try:
+      with transaction.atomic():
+        Project(name="rolled back", details="abc", description="abc", owner=user).save()
+        raise RuntimeError()
+    except RuntimeError:
+      pass
+    self.assertTrue(len(mail.outbox) == 0)
+
+    with transaction.atomic():
+      Project(name="test project", details="abc", description="abc", owner=user).save()
+      self.assertTrue(len(mail.outbox) == 0)
+
+    if is_email_enabled("projectCreated"):
+      self.assertTrue(len(mail.outbox) == 1)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+  """ locmem backend which fails for recipients starting with 'fail' """
+  def send_messages(self, messages):
+    for message in messages:
+      if message.to[0].startswith('fail'):
+        raise SMTPException('Recipient refused')
+    return super(FailingEmailBackend, self).send_messages(messages)
+
+
+@override_settings(OVP_PROJECTS={"EMAIL_OUTBOX": True})
+class TestEmailOutboxEnqueue(TransactionTestCase):
+  def test_emails_are_enqueued_on_commit(self):
+    """Assert emails are enqueued on the outbox when the transaction commits instead of being sent"""
+    user = User.objects.create_user(email="test_project@project.com", password="test_project")
+    mail.outbox = []
+
+    with transaction.atomic():
+      project = Project(name="test project", details="abc", description="abc", owner=user)
+      project.save()
+      self.assertTrue(OutboxEmail.objects.count() == 0)
+
+    self.assertTrue(len(mail.outbox) == 0)
+    self.assertTrue(OutboxEmail.objects.filter(recipient="test_project@project.com", template_name="projectCreated").count() == 1)
+
+  def test_emails_are_discarded_on_rollback(self):
+    """Assert no email is enqueued if the transaction rolls back"""
+    user = User.objects.create_user(email="test_project@project.com", password="test_project")
+
+    try:
+      with transaction.atomic():
+        project = Project(name="test project", details="abc", description="abc", owner=user)
+        project.save()
+        raise RuntimeError()
+    except RuntimeError:
+      pass
+
+    self.assertTrue(OutboxEmail.objects.count() == 0)
+
+
+class TestEmailOutboxWorker(TestCase):
+  def _enqueue(self, recipient):
+    return OutboxEmail.objects.create(template_name="projectCreated", recipient=recipient, subject="Project created", text_content="text", html_content="<p>html</p>")
+
+  def test_drain_outbox_sends_pending_emails(self):
+    """Assert the worker sends every pending email in batches"""
+    for i in range(5):
+      self._enqueue("volunteer{}@test.com".format(i))
+    mail.outbox = []
+
+    sent, failed = drain_outbox(batch_size=2, workers=2)
+
+    self.assertTrue((sent, failed) == (5, 0))
+    self.assertTrue(len(mail.outbox) == 5)
+    self.assertTrue(mail.outbox[0].alternatives[0] == ("<p>html</p>", "text/html"))
+    self.assertTrue(OutboxEmail.objects.filter(status="sent", sent_date__isnull=False).count() == 5)
+
+    self.assertTrue(drain_outbox() == (0, 0))
+
+  @override_settings(EMAIL_BACKEND="ovp_projects.tests.test_emails.FailingEmailBackend")
+  def test_drain_outbox_retries_failed_emails(self):
+    """Assert failed emails are retried later and marked as failed after max_attempts"""
+    self._enqueue("ok@test.com")
+    email = self._enqueue("fail@test.com")
+
+    self.assertTrue(drain_outbox(max_attempts=2) == (1, 0))
+    email.refresh_from_db()
+    self.assertTrue(email.status == "pending")
+    self.assertTrue(email.attempts == 1)
+    self.assertTrue("Recipient refused" in email.last_error)
+    self.assertTrue(email.next_attempt_date > timezone.now())
+
+    OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_date=timezone.now())
+    self.assertTrue(drain_outbox(max_attempts=2) == (0, 1))
+    email.refresh_from_db()
+    self.assertTrue(email.status == "failed")
+
+  def test_rate_limiter_spaces_calls(self):
+    """Assert RateLimiter spaces calls according to rate"""
+    limiter = RateLimiter(rate=50)
+    start = time.monotonic()
+    for i in range(5):
+      limiter.wait()
+    self.assertTrue(time.monotonic() - start >= 4 / 50)
@@ -0,0 +1,58 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ovp_users.models import User
+
+from ovp_projects import geo
+from ovp_projects.models import Project
+
+
+class GeoTestCase(TestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_geo@gmail.com", password="testgeo")
+
+  def create_project(self, latitude, longitude, hidden_address=False):
+    project = Project.objects.create(name="project", details="details", owner=self.user, hidden_address=hidden_address)
+    Project.objects.filter(pk=project.pk).update(latitude=latitude, longitude=longitude)
+    return project.pk
+
+  def test_distances(self):
+    """Test haversine distances between known points"""
+    sao_paulo = self.create_project(-23.5505, -46.6333)
+    rio = self.create_project(-22.9068, -43.1729)
+    distances = dict(geo.find_nearby(Project.objects.all(), -23.5505, -46.6333, 500))
+
+    self.assertTrue(distances[sao_paulo] == 0)
+    self.assertTrue(355 < distances[rio] < 362)
+    self.assertTrue(rio not in dict(geo.find_nearby(Project.objects.all(), -23.5505, -46.6333, 300)))
+
+  def test_hidden_address_distance_uses_coarse_position(self):
+    """Test distances to projects with hidden address are measured from their coarse position"""
+    exact = self.create_project(0.004, 0.004)
+    coarse = self.create_project(0.004, 0.004, hidden_address=True)
+    distances = dict(geo.find_nearby(Project.objects.all(), 0, 0, 1))
+
+    self.assertTrue(distances[exact] > 0)
+    self.assertTrue(distances[coarse] == 0)
+
+  def test_pages_are_limited_by_the_database(self):
+    """Test a page after a cursor reads only the projects on it"""
+    pks = [self.create_project(0.01 * i, 0) for i in range(10)]
+    matches = geo.find_nearby(Project.objects.all(), 0, 0, 100, limit=3)
+    self.assertTrue([pk for pk, distance in matches] == pks[:3])
+
+    with CaptureQueriesContext(connection) as context:
+      matches = geo.find_nearby(Project.objects.all(), 0, 0, 100, position=matches[-1], limit=3)
+    self.assertTrue([pk for pk, distance in matches] == pks[3:6])
+    self.assertTrue(len(context.captured_queries) == 1)
+    self.assertTrue('LIMIT 3' in context.captured_queries[0]['sql'])
+
+  def test_bounding_box(self):
+    """Test bounding box contains points at radius and drops longitude bounds across the antimeridian"""
+    min_lat, max_lat, min_lng, max_lng = geo.get_bounding_box(-23.5505, -46.6333, 360)
+    self.assertTrue(min_lat < -22.9068 < max_lat)
+    self.assertTrue(min_lng < -43.1729 < max_lng)
+
+    self.assertTrue(geo.get_bounding_box(0, 179.9, 100)[2:] == (None, None))
+    self.assertTrue(geo.get_bounding_box(89.9, 0, 100)[1:] == (90, None, None))
@@ -0,0 +1,108 @@
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from ovp_projects.identity import IdentityMap, get_identity_map
+from ovp_projects.models import Project, Apply
+from ovp_users.models import User
+from ovp_organizations.models import Organization
+
+import re
+
+
+class IdentityMapTestCase(TestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.member = User.objects.create_user(email="member_user@gmail.com", password="test_member")
+    self.organization = Organization(name="test", type=0, owner=self.owner)
+    self.organization.save()
+    self.organization.members.add(self.member)
+    self.project = Project(name="test project", details="abc", owner=self.owner, organization=self.organization)
+    self.project.save()
+
+  def test_objects_are_loaded_once(self):
+    """ Assert an object is loaded once and shared by pk and lookup """
+    identity_map = IdentityMap()
+    with self.assertNumQueries(1):
+      project = identity_map.get(Project.objects.select_related('organization'), slug="test-project")
+      self.assertTrue(identity_map.get(Project.objects.all(), slug="test-project") is project)
+      self.assertTrue(identity_map.get(Project.objects.all(), pk=str(project.pk)) is project)
+      self.assertTrue(identity_map.get(Organization.objects.all(), pk=self.organization.pk) is project.organization)
+
+  def test_missing_objects(self):
+    """ Assert get raises Http404 and get_or_none returns None for missing objects """
+    identity_map = IdentityMap()
+    self.assertTrue(identity_map.get_or_none(Project.objects.all(), slug="inexistent") is None)
+    with self.assertRaises(Http404):
+      identity_map.get(Project.objects.all(), slug="inexistent")
+
+  def test_membership_is_memoized(self):
+    """ Assert membership is checked with a single query per organization and user """
+    identity_map = IdentityMap()
+    with self.assertNumQueries(2):
+      self.assertTrue(identity_map.is_organization_member(self.organization, self.member))
+      self.assertTrue(identity_map.is_organization_member(self.organization, self.member))
+      self.assertFalse(identity_map.is_organization_member(self.organization, self.owner))
+      self.assertFalse(identity_map.is_organization_member(self.organization, self.owner))
+
+  def test_can_manage_project(self):
+    """ Assert project owner, organization owner and members can manage the project """
+    identity_map = IdentityMap()
+    stranger = User.objects.create_user(email="stranger@gmail.com", password="test_stranger")
+    project = Project.objects.get(pk=self.project.pk)
+
+    self.assertTrue(identity_map.can_manage_project(project, self.owner))
+    self.assertTrue(identity_map.can_manage_project(project, self.member))
+    self.assertFalse(identity_map.can_manage_project(project, stranger))
+
+  def test_map_is_bound_to_request(self):
+    """ Assert the same map is returned for a request """
+    request = RequestFactory().get('/')
+    self.assertTrue(get_identity_map(request) is get_identity_map(request))
+    self.assertFalse(get_identity_map(request) is get_identity_map(RequestFactory().get('/')))
+
+
+@override_settings(OVP_PROJECTS={"CAN_CREATE_PROJECTS_WITHOUT_ORGANIZATION": True})
+class ViewsLoadObjectsOnceTestCase(TestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.member = User.objects.create_user(email="member_user@gmail.com", password="test_member")
+    self.organization = Organization(name="test", type=0, owner=self.owner)
+    self.organization.save()
+    self.organization.members.add(self.member)
+    self.project = Project(name="test project", details="abc", owner=self.owner, organization=self.organization)
+    self.project.save()
+    self.apply = Apply.objects.create(project=self.project, email="apply@test.com")
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.member)
+
+  def _count_table_queries(self, table, func):
+    with CaptureQueriesContext(connection) as context:
+      response = func()
+    self.assertTrue(response.status_code == 200)
+    pattern = r'^SELECT .*(FROM|JOIN) "{}"'.format(table)
+    return len([q for q in context.captured_queries if re.search(pattern, q["sql"])])
+
+  def test_applies_list(self):
+    """ Assert listing applies loads the project and checks membership once """
+    list_applies = lambda: self.client.get(reverse("project-applies-list", ["test-project"]), format="json")
+    self.assertTrue(self._count_table_queries("ovp_projects_project", list_applies) == 1)
+    self.assertTrue(self._count_table_queries("ovp_organizations_organization_members", list_applies) == 1)
+
+  def test_apply_partial_update(self):
+    """ Assert updating an apply loads the project once """
+    update = lambda: self.client.patch(reverse("project-applies-detail", ["test-project", self.apply.pk]), {"status": "confirmed-volunteer"}, format="json")
+    self.assertTrue(self._count_table_queries("ovp_projects_project", update) == 1)
+
+  def test_project_partial_update(self):
+    """ Assert updating a project loads it and its organization once """
+    update = lambda: self.client.patch(reverse("project-detail", ["test-project"]), {"details": "update"}, format="json")
+    self.assertTrue(self._count_table_queries("ovp_projects_project", update) == 1)
+    self.assertTrue(self._count_table_queries("ovp_organizations_organization", update) == 1)
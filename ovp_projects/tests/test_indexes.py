@@ -0,0 +1,96 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from ovp_users.models import User
+
+from ovp_projects.helpers import filter_prefix
+from ovp_projects.models import Project, Apply, Job, JobDate, VolunteerRole
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class HotQueryIndexesTestCase(TestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_owner@test.com", password="test_owner")
+    self.project = Project.objects.create(name="test project", owner=self.user)
+
+  def explain(self, queryset):
+    """ Returns SQLite query plan details for queryset """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+      cursor.execute('EXPLAIN QUERY PLAN {}'.format(sql), params)
+      return [row[-1] for row in cursor.fetchall()]
+
+  def get_index_names(self, model, columns):
+    """ Returns the names of model indexes on exactly columns, in any order """
+    with connection.cursor() as cursor:
+      constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    names = [name for name, constraint in constraints.items() if constraint['index'] and set(constraint['columns']) == set(columns)]
+    self.assertTrue(names, '{} has no index on {}'.format(model._meta.db_table, columns))
+    return names
+
+  def assertUsesIndex(self, queryset, model, columns):
+    """Assert queryset plan reads model through an index on columns"""
+    names = self.get_index_names(model, columns)
+    plan = self.explain(queryset)
+    self.assertTrue(any('INDEX {} '.format(name) in detail for detail in plan for name in names), plan)
+
+  def assertNoFullScan(self, queryset):
+    """Assert every table on queryset plan is read through an index"""
+    plan = self.explain(queryset)
+    self.assertFalse([detail for detail in plan if detail.startswith('SCAN') and 'INDEX' not in detail], plan)
+
+  def test_apply_indexes(self):
+    """Assert apply lookups by (project, canceled), (user, project) and (project, email) use composite indexes"""
+    self.assertUsesIndex(Apply.objects.filter(project=self.project, canceled=False), Apply, ['project_id', 'canceled'])
+    self.assertUsesIndex(Apply.objects.filter(user=self.user, project__in=[self.project.pk]), Apply, ['user_id', 'project_id'])
+    self.assertUsesIndex(Apply.objects.filter(project=self.project, email="test@test.com"), Apply, ['project_id', 'email'])
+
+  def test_waitlist_index(self):
+    """Assert the head of a role waitlist is read through the (role, status, date) index"""
+    role = VolunteerRole.objects.create(name="role", project=self.project, vacancies=1)
+    self.assertUsesIndex(Apply.objects.filter(role=role, status="waitlisted").order_by('date', 'pk')[:10], Apply, ['role_id', 'status', 'date'])
+
+  def test_project_flags_index(self):
+    """Assert project lookups by published, closed and deleted flags use a composite index"""
+    self.assertUsesIndex(Project.objects.filter(deleted=False, published=True, closed=False), Project, ['deleted', 'published', 'closed'])
+
+  def test_job_dates_index(self):
+    """Assert job date aggregates read the (job, start_date) and (job, end_date) indexes"""
+    job = Job.objects.create(project=self.project, start_date=timezone.now(), end_date=timezone.now())
+    queryset = JobDate.objects.filter(job=job)
+
+    self.assertUsesIndex(queryset.order_by('start_date'), JobDate, ['job_id', 'start_date'])
+    self.assertUsesIndex(queryset.order_by('-end_date'), JobDate, ['job_id', 'end_date'])
+
+  def test_finished_projects_index(self):
+    """Assert finished projects are found without scanning projects or jobs"""
+    self.get_index_names(Job, ['end_date', 'project_id'])
+    self.assertNoFullScan(Project.objects.filter(closed=False, job__end_date__lt=timezone.now()).order_by('pk'))
+
+  def test_scheduled_transitions_indexes(self):
+    """Assert due scheduled transitions are found through an index"""
+    now = timezone.now()
+    self.assertNoFullScan(Project.objects.filter(published=False, deleted=False, publish_at__lte=now).order_by('pk'))
+    self.assertNoFullScan(Project.objects.filter(closed=False, close_at__lte=now).order_by('pk'))
+
+  def test_partial_indexes(self):
+    """Assert partial indexes on open and unpublished projects survive project table rebuilds"""
+    names = ["ovp_projects_project_open_idx", "ovp_projects_project_unpublished_idx", "ovp_projects_project_closing_idx"]
+    with connection.cursor() as cursor:
+      cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'ovp_projects_project'")
+      indexes = [row[0] for row in cursor.fetchall()]
+    self.assertTrue(set(names) <= set(indexes), indexes)
+
+  def test_apply_list_indexes(self):
+    """Assert applies pages are read in (date, id) order from the (project, date) index and searched case insensitively through the username and email search indexes"""
+    applies = Apply.objects.filter(project=self.project)
+    page = applies.order_by('date', 'pk')[:21]
+    self.assertUsesIndex(page, Apply, ['project_id', 'date'])
+    self.assertFalse([detail for detail in self.explain(page) if 'TEMP B-TREE' in detail])
+
+    plan = self.explain(filter_prefix(applies, ['username', 'email'], "Mar"))
+    for name in ["ovp_projects_apply_username_search_idx", "ovp_projects_apply_email_search_idx"]:
+      self.assertTrue(any('INDEX {} '.format(name) in detail for detail in plan), plan)
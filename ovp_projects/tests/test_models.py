@@ -104,6 +104,88 @@ class ProjectModelTestCase(TestCase):
     project.save()
     self.assertTrue(project.slug == "test-slug-1")
 
+  def test_field_tracker_detects_changes(self):
+    """ Assert .has_changed() and .get_original() track values since load """
+    user = User.objects.create_user(email="test_tracker@test.com", password="test_tracker")
+    project = Project(name="test tracker", details="abc", owner=user)
+    project.save()
+
+    project = Project.objects.get(pk=project.pk)
+    self.assertFalse(project.has_changed('published'))
+
+    project.published = True
+    self.assertTrue(project.has_changed('published'))
+    self.assertTrue(project.get_original('published') == False)
+    self.assertTrue(project.get_dirty_fields() == ['published'])
+
+    project.save()
+    self.assertFalse(project.has_changed('published'))
+
+  def test_save_does_not_refetch_project(self):
+    """ Assert updating a project costs a single UPDATE query """
+    user = User.objects.create_user(email="test_refetch@test.com", password="test_refetch")
+    project = Project(name="test refetch", details="abc", owner=user)
+    project.save()
+
+    project = Project.objects.get(pk=project.pk)
+    project.name = "another name"
+    with self.assertNumQueries(1):
+      project.save()
+
+  def test_save_only_writes_dirty_fields(self):
+    """ Assert saving a stale instance does not overwrite columns it did not modify """
+    user = User.objects.create_user(email="test_dirty@test.com", password="test_dirty")
+    project = Project(name="test dirty", details="abc", owner=user)
+    project.save()
+
+    stale = Project.objects.get(pk=project.pk)
+    Project.objects.filter(pk=project.pk).update(applied_count=5)
+
+    stale.name = "another name"
+    stale.save()
+
+    project = Project.objects.get(pk=project.pk)
+    self.assertTrue(project.name == "another name")
+    self.assertTrue(project.applied_count == 5)
+
+  def test_slug_uses_smallest_free_suffix(self):
+    """ Assert slug generation reuses gaps and ignores slugs that only share a prefix """
+    user = User.objects.create_user(email="test_str@test.com", password="test_str_test")
+    Project.objects.bulk_create([
+      Project(name="test slug", slug="test-slug", details="abc", owner=user),
+      Project(name="test slug", slug="test-slug-2", details="abc", owner=user),
+      Project(name="test slugs", slug="test-slug-1-extra", details="abc", owner=user),
+    ])
+
+    project = Project(name="test slug", details="abc", owner=user)
+    self.assertTrue(project.generate_slug() == "test-slug-1")
+
+  def test_slug_generation_costs_one_query(self):
+    """ Assert slug generation costs a single query regardless of collisions """
+    user = User.objects.create_user(email="test_str@test.com", password="test_str_test")
+    Project.objects.bulk_create([Project(name="test slug", slug="test-slug" + ("-{}".format(i) if i else ""), details="abc", owner=user) for i in range(50)])
+
+    project = Project(name="test slug", details="abc", owner=user)
+    with self.assertNumQueries(1):
+      self.assertTrue(project.generate_slug() == "test-slug-50")
+
+  def test_slug_conflict_is_retried(self):
+    """ Assert a slug taken between generation and insert is regenerated """
+    user = User.objects.create_user(email="test_str@test.com", password="test_str_test")
+    project = Project(name="test slug", details="abc", owner=user)
+
+    # Simulate a concurrent create taking the slug after it was generated
+    generate_slug = project.generate_slug
+    def racing_generate_slug():
+      slug = generate_slug()
+      if not Project.objects.filter(slug=slug).exists() and slug == "test-slug":
+        Project.objects.bulk_create([Project(name="test slug", slug=slug, details="abc", owner=user)])
+      return slug
+    project.generate_slug = racing_generate_slug
+
+    project.save()
+    self.assertTrue(project.slug == "test-slug-1")
+
   def test_slug_is_not_generated_without_name(self):
     """ Assert that slug is not generated without name """
     user = User.objects.create_user(email="test_slug@test.com", password="test_slug_test")
@@ -0,0 +1,110 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+from django.test import RequestFactory
+from django.utils import timezone
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from ovp_projects.models import Project, VolunteerRole, Apply, Job, JobDate, Work
+from ovp_projects.prefetch import get_query_plan, apply_query_plan
+from ovp_projects.serializers.project import ProjectRetrieveSerializer
+from ovp_projects.serializers.disponibility import DisponibilityField
+from ovp_projects.tests.helpers import QueryBudgetMixin
+
+from ovp_core.models import Cause, Skill
+from ovp_users.models import User
+
+
+class QueryPlanTestCase(TestCase):
+  def test_plan_is_derived_from_serializer_fields(self):
+    """ Assert ProjectRetrieveSerializer plan joins to-one relations and prefetches to-many relations """
+    plan = get_query_plan(ProjectRetrieveSerializer)
+    prefetches = [p.prefetch_through for p in plan.prefetch_related]
+
+    for lookup in ['image', 'address', 'organization', 'organization__image', 'owner', 'owner__avatar', 'job', 'work']:
+      self.assertTrue(lookup in plan.select_related)
+
+    for lookup in ['roles', 'apply_set', 'causes', 'skills', 'job__dates']:
+      self.assertTrue(lookup in prefetches)
+
+  def test_active_applies_prefetch_excludes_canceled(self):
+    """ Assert active_apply_set is prefetched without canceled applies """
+    owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    project = Project(name="test project", details="abc", owner=owner)
+    project.save()
+    Apply(project=project, email="a@test.com").save()
+    canceled = Apply(project=project, email="b@test.com")
+    canceled.save()
+    canceled.canceled = True
+    canceled.save()
+
+    project = apply_query_plan(Project.objects.all(), ProjectRetrieveSerializer).get(pk=project.pk)
+    with self.assertNumQueries(0):
+      self.assertTrue([a.email for a in project.active_apply_set()] == ["a@test.com"])
+
+
+class ProjectRetrieveQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.causes = list(Cause.objects.all()[:2])
+    self.skills = list(Skill.objects.all()[:2])
+    self.request = RequestFactory().get('/')
+    self.request.user = AnonymousUser()
+
+  def _create_project(self, i):
+    project = Project(name="test project {}".format(i), details="abc", owner=self.owner)
+    project.save()
+    project.causes.add(*self.causes)
+    project.skills.add(*self.skills)
+    VolunteerRole(name="role", vacancies=2, project=project).save()
+
+    if i % 2:
+      job = Job(project=project)
+      job.save()
+      JobDate(start_date=timezone.now(), end_date=timezone.now(), job=job).save()
+    else:
+      Work(project=project, weekly_hours=2).save()
+
+    volunteer = User.objects.create_user(email="volunteer{}@gmail.com".format(i), password="test_volunteer")
+    Apply(project=project, user=volunteer, email=volunteer.email).save()
+    return project
+
+  def _grow(self, size):
+    while Project.objects.count() < size:
+      self._create_project(Project.objects.count())
+
+  def test_list_serialization_query_count_is_flat(self):
+    """ Assert serializing many projects through the query plan costs a constant number of queries """
+    def serialize():
+      queryset = apply_query_plan(Project.objects.all(), ProjectRetrieveSerializer)
+      data = ProjectRetrieveSerializer(queryset, many=True, context={"request": self.request}).data
+      self.assertTrue(all(p["disponibility"] for p in data))
+
+    self.assertQueryCountIsFlat(self._grow, serialize, sizes=(2, 5, 20))
+
+  def test_retrieve_query_count_is_flat(self):
+    """ Assert retrieving a project costs the same number of queries regardless of applies """
+    project = self._create_project(0)
+    client = APIClient()
+
+    def grow(size):
+      while project.apply_set.count() < size:
+        Apply(project=project, email="applier{}@test.com".format(project.apply_set.count())).save()
+
+    def retrieve():
+      response = client.get(reverse("project-detail", [project.slug]), format="json")
+      self.assertTrue(response.status_code == 200)
+
+    self.assertQueryCountIsFlat(grow, retrieve)
+
+  def test_disponibility_is_read_without_queries(self):
+    """ Assert disponibility of projects fetched through the query plan costs no queries """
+    self._grow(20)
+    projects = list(apply_query_plan(Project.objects.all(), ProjectRetrieveSerializer))
+
+    with self.assertNumQueries(0):
+      disponibilities = [DisponibilityField().to_representation(project) for project in projects]
+
+    self.assertTrue([d["type"] for d in disponibilities].count("job") == 10)
+    self.assertTrue(all(len(d["job"]["dates"]) == 1 for d in disponibilities if d["type"] == "job"))
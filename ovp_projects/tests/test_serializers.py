@@ -53,3 +53,19 @@ class HiddenAddressTestCase(TestCase):
     serializer = serializer_class(self.project, context={"request": self.request})
     self.assertTrue(serializer.data["address"] == None)
     self.assertTrue(serializer.data["hidden_address"] == True)
+
+  def test_list_hides_address_per_project(self):
+    """ Assert hidden addresses are decided per project without mutating serializer fields """
+    address = GoogleAddress(typed_address="Rua. Teçaindá, 81")
+    address.save()
+    visible = Project(name="visible project", details="abc", description="abc", owner=self.user, address=address)
+    visible.save()
+
+    self.request.user = self.third_user
+    serializer = ProjectSearchSerializer(Project.objects.order_by("pk"), many=True, context={"request": self.request})
+    fields = [field.field_name for field in serializer.child._readable_fields]
+
+    data = serializer.data
+    self.assertTrue(data[0]["address"] == None)
+    self.assertTrue(data[1]["address"]["typed_address"] == "Rua. Teçaindá, 81")
+    self.assertTrue([field.field_name for field in serializer.child._readable_fields] == fields)
@@ -1,14 +1,25 @@
+from django.core import mail
+from django.db import connection
 from django.test import TestCase
+from django.test import TransactionTestCase
 from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
-from ovp_projects.models import Project, Apply
+from ovp_projects.applies import get_applied_emails, update_applies_status
+from ovp_projects.models import Project, Apply, VolunteerRole, OutboxEmail
 from ovp_users.models import User
 from ovp_organizations.models import Organization
 
+from ovp_projects.tests.helpers import QueryBudgetMixin
+
 from collections import OrderedDict
+from unittest import skipIf
+from unittest.mock import patch
+
+import threading
 
 class ApplyAndUnapplyTestCase(TestCase):
   def test_can_apply_to_project(self):
@@ -29,8 +40,12 @@ class ApplyAndUnapplyTestCase(TestCase):
     self.assertTrue(response.data["detail"] == "Successfully applied.")
     self.assertTrue(response.status_code == 200)
 
+    # Applying again is a no-op
     response = client.post(reverse("project-applies-apply", ["test-project"]), format="json")
-    self.assertTrue(response.data["non_field_errors"][0] == "The fields email, project must make a unique set.")
+    self.assertTrue(response.data["detail"] == "Successfully applied.")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(Apply.objects.filter(project=project).count() == 1)
+    self.assertTrue(Project.objects.get(pk=project.pk).applied_count == 1)
 
     response = client.get(reverse("project-detail", ["test-project"]), format="json")
     self.assertTrue(type(response.data["applies"][0]["user"]) in [dict, OrderedDict])
@@ -56,9 +71,11 @@ class ApplyAndUnapplyTestCase(TestCase):
     project = Project.objects.get(slug="test-project")
     self.assertTrue(project.applied_count == 1)
 
-    # Unapply
-    response = client.post(reverse("project-applies-unapply", ["test-project"]), format="json")
-    self.assertTrue(response.data["detail"] == "Successfully unapplied.")
+    # Unapply, twice
+    for i in range(2):
+      response = client.post(reverse("project-applies-unapply", ["test-project"]), format="json")
+      self.assertTrue(response.data["detail"] == "Successfully unapplied.")
+      self.assertTrue(response.status_code == 200)
 
     a = Apply.objects.last()
     self.assertTrue(a.canceled == True)
@@ -154,15 +171,16 @@ class ProjectAppliesRetrievingTestCase(TestCase):
     self.assertTrue(response.status_code == 200)
 
   def _assert_apply_response_data(self, response):
-    self.assertTrue("email" in response.data[0])
-    self.assertTrue("date" in response.data[0])
-    self.assertTrue("canceled" in response.data[0])
-    self.assertTrue("canceled_date" in response.data[0])
-    self.assertTrue("status" in response.data[0])
-    self.assertTrue("name" in response.data[0]["user"])
-    self.assertTrue("avatar" in response.data[0]["user"])
-    self.assertTrue("email" in response.data[0]["user"])
-    self.assertTrue("phone" in response.data[0]["user"])
+    apply = response.data["results"][0]
+    self.assertTrue("email" in apply)
+    self.assertTrue("date" in apply)
+    self.assertTrue("canceled" in apply)
+    self.assertTrue("canceled_date" in apply)
+    self.assertTrue("status" in apply)
+    self.assertTrue("name" in apply["user"])
+    self.assertTrue("avatar" in apply["user"])
+    self.assertTrue("email" in apply["user"])
+    self.assertTrue("phone" in apply["user"])
 
   def test_project_owner_can_read_applies(self):
     """Assert that project owner can retrieve project applies"""
@@ -179,6 +197,61 @@ class ProjectAppliesRetrievingTestCase(TestCase):
     self.assertTrue(response.status_code == 200)
     self.assertTrue(response["Content-Type"] == "text/csv; charset=utf-8")
 
+  def test_applies_are_paginated(self):
+    """Assert applies are paginated with a cursor, oldest first"""
+    Apply.objects.bulk_create([Apply(project=self.project, username="user {}".format(i), email="user{}@test.com".format(i)) for i in range(4)])
+    self.client.force_authenticate(user=self.owner)
+
+    emails = []
+    url = reverse("project-applies-list", ["test-project"]) + "?page_size=2"
+    while url:
+      response = self.client.get(url, format="json")
+      self.assertTrue(response.status_code == 200)
+      emails += [apply["email"] for apply in response.data["results"]]
+      url = response.data["next"]
+
+    self.assertTrue(emails == ["apply_user@gmail.com"] + ["user{}@test.com".format(i) for i in range(4)])
+
+  def test_applies_list_query_count_is_flat(self):
+    """Assert a page of applies costs a constant number of queries"""
+    self.client.force_authenticate(user=self.owner)
+
+    def count(size):
+      users = [User.objects.create_user(email="user{}_{}@test.com".format(size, i), password="test") for i in range(size)]
+      Apply.objects.bulk_create([Apply(project=self.project, user=user, email=user.email) for user in users])
+      with CaptureQueriesContext(connection) as context:
+        response = self.client.get(reverse("project-applies-list", ["test-project"]), format="json")
+      self.assertTrue(response.status_code == 200)
+      return len(context.captured_queries)
+
+    self.assertTrue(count(1) == count(10))
+
+  def test_applies_can_be_filtered(self):
+    """Assert applies can be filtered by status, role, canceled and searched by username or email prefixes, case insensitively"""
+    role = VolunteerRole.objects.create(name="role", project=self.project, vacancies=2)
+    Apply.objects.bulk_create([
+      Apply(project=self.project, username="Maria", email="maria@test.com", role=role),
+      Apply(project=self.project, username="Joao", email="joao@test.com", status="unapplied", canceled=True),
+    ])
+    self.client.force_authenticate(user=self.owner)
+
+    def emails(params):
+      response = self.client.get(reverse("project-applies-list", ["test-project"]), params, format="json")
+      self.assertTrue(response.status_code == 200)
+      return [apply["email"] for apply in response.data["results"]]
+
+    self.assertTrue(emails({"status": "unapplied"}) == ["joao@test.com"])
+    self.assertTrue(emails({"status": "applied,unapplied"}) == ["apply_user@gmail.com", "maria@test.com", "joao@test.com"])
+    self.assertTrue(emails({"role": role.pk}) == ["maria@test.com"])
+    self.assertTrue(emails({"canceled": "false"}) == ["apply_user@gmail.com", "maria@test.com"])
+    self.assertTrue(emails({"search": "mar"}) == ["maria@test.com"])
+    self.assertTrue(emails({"search": "joao@"}) == ["joao@test.com"])
+    self.assertTrue(emails({"search": "Jo"}) == ["joao@test.com"])
+    self.assertTrue(emails({"search": "MAR"}) == ["maria@test.com"])
+    self.assertTrue(emails({"search": "mArIa"}) == ["maria@test.com"])
+    self.assertTrue(emails({"search": "JOAO@Test"}) == ["joao@test.com"])
+    self.assertTrue(emails({"search": "%"}) == [])
+
   def test_cant_retrieve_applies_while_unauthorized(self):
     """Assert that a user who is not project owner or organization owner/member can't read project applies"""
     response = self.client.get(reverse("project-applies-list", ["test-project"]), format="json")
@@ -229,7 +302,7 @@ class ProjectApplyStatusUpdateTestCase(TestCase):
 
     # Get apply
     response = self.client.get(reverse("project-applies-list", ["test-project"]), format="json")
-    self.assertTrue(response.data[0]["status"] == "unapplied")
+    self.assertTrue(response.data["results"][0]["status"] == "unapplied")
 
   def test_project_owner_can_update_apply_status(self):
     """Assert that project owner can update apply status"""
@@ -262,3 +335,257 @@ class ProjectApplyStatusUpdateTestCase(TestCase):
     response = self.client.patch(reverse("project-applies-detail", ["test-project", self.apply_id]), data={"status": "invalid-status"}, format="json")
     self.assertTrue(response.status_code == 400)
     self.assertTrue(response.data["status"] == ["\"invalid-status\" is not a valid choice."])
+
+  def test_cant_waitlist_apply(self):
+    """Assert that applies can't be waitlisted through the API, as only hard role capacity waitlists them"""
+    self.client.force_authenticate(user=self.project_owner)
+    response = self.client.patch(reverse("project-applies-detail", ["test-project", self.apply_id]), data={"status": "waitlisted"}, format="json")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data["status"] == ["\"waitlisted\" is not a valid choice."])
+    self.assertTrue(Apply.objects.get(pk=self.apply_id).status == "applied")
+
+
+class ProjectAppliesImportTestCase(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.project = Project(name="test project", details="abc", description="abc", owner=self.owner)
+    self.project.save()
+    self.role = VolunteerRole.objects.create(name="role", project=self.project, vacancies=10)
+    Apply.objects.create(project=self.project, email="existing@test.com", username="Existing")
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.owner)
+
+  def _import(self, data, **kwargs):
+    return self.client.post(reverse("project-applies-import", ["test-project"]), data, **kwargs)
+
+  def test_can_import_applies_as_json(self):
+    """Assert applies are imported from JSON, skipping emails already applied and repeated rows"""
+    rows = [
+      {"username": "Maria", "email": "maria@test.com", "phone": "123", "role": self.role.pk},
+      {"username": "Joao", "email": "joao@test.com"},
+      {"username": "Existing", "email": "EXISTING@test.com"},
+      {"username": "Maria", "email": "maria@test.com"},
+    ]
+    response = self._import(rows, format="json")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response.data["created"] == 2)
+    self.assertTrue(response.data["skipped"] == 2)
+
+    maria = Apply.objects.get(project=self.project, email="maria@test.com")
+    self.assertTrue((maria.username, maria.phone, maria.role_id, maria.status) == ("Maria", "123", self.role.pk, "applied"))
+
+    self.project.refresh_from_db()
+    self.role.refresh_from_db()
+    self.assertTrue(self.project.applied_count == 3)
+    self.assertTrue(self.role.applied_count == 1)
+
+  def test_can_import_applies_as_csv(self):
+    """Assert applies are imported from a CSV body"""
+    content = "username,email,phone,role\nMaria,maria@test.com,,{}\nJoao,joao@test.com,456,\n".format(self.role.pk)
+    response = self._import(content, content_type="text/csv")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response.data["created"] == 2)
+
+    joao = Apply.objects.get(project=self.project, email="joao@test.com")
+    self.assertTrue((joao.phone, joao.role_id) == ("456", None))
+
+  def test_import_validates_whole_batch(self):
+    """Assert nothing is imported if any row is invalid, reporting errors by row"""
+    other_role = VolunteerRole.objects.create(name="other", project=Project.objects.create(name="other project", owner=self.owner), vacancies=1)
+    rows = [
+      {"username": "Maria", "email": "maria@test.com"},
+      {"username": "Joao", "email": "invalid"},
+      {"username": "Ana", "email": "ana@test.com", "role": other_role.pk},
+    ]
+    response = self._import(rows, format="json")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data[0] == {})
+    self.assertTrue("email" in response.data[1])
+    self.assertTrue("role" in response.data[2])
+    self.assertTrue(Apply.objects.filter(project=self.project).count() == 1)
+
+  @override_settings(OVP_PROJECTS={"EMAIL_OUTBOX": True})
+  def test_import_query_count_is_flat(self):
+    """Assert an import costs a constant number of queries"""
+    batches = []
+
+    def grow(size):
+      batches.append([{"email": "user{}_{}@test.com".format(size, i), "role": self.role.pk} for i in range(size)])
+
+    def run():
+      response = self._import(batches[-1], format="json")
+      self.assertTrue(response.data["created"] == len(batches[-1]))
+
+    self.assertQueryCountIsFlat(grow, run)
+
+  def test_import_skips_concurrent_applies(self):
+    """Assert an email applied after existing emails were read is skipped instead of failing the import"""
+    stale = get_applied_emails(self.project)
+    Apply.objects.create(project=self.project, email="maria@test.com", username="Maria")
+
+    rows = [{"username": "Maria", "email": "maria@test.com"}, {"username": "Joao", "email": "joao@test.com"}]
+    with patch("ovp_projects.applies.get_applied_emails", side_effect=[stale, get_applied_emails(self.project)]):
+      response = self._import(rows, format="json")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue((response.data["created"], response.data["skipped"]) == (1, 1))
+    self.assertTrue(Apply.objects.filter(project=self.project, email="joao@test.com").count() == 1)
+
+    self.project.refresh_from_db()
+    self.assertTrue(self.project.applied_count == 3)
+
+  def test_cant_import_while_unauthorized(self):
+    """Assert only project managers can import applies"""
+    applier = User.objects.create_user(email="apply_user@gmail.com", password="apply_user")
+    self.client.force_authenticate(user=applier)
+    response = self._import([{"email": "maria@test.com"}], format="json")
+    self.assertTrue(response.status_code == 403)
+
+
+class ProjectAppliesBulkStatusTestCase(QueryBudgetMixin, TransactionTestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.project = Project(name="test project", details="abc", description="abc", owner=self.owner)
+    self.project.save()
+    self.role = VolunteerRole.objects.create(name="role", project=self.project, vacancies=10)
+
+    self.applies = [Apply.objects.create(project=self.project, email="user{}@test.com".format(i), role=self.role) for i in range(3)]
+    self.applies.append(Apply.objects.create(project=self.project, email="canceled@test.com", role=self.role, status="unapplied", canceled=True))
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.owner)
+
+  def _update(self, ids, status):
+    return self.client.post(reverse("project-applies-status", ["test-project"]), {"ids": ids, "status": status}, format="json")
+
+  def _assert_counters(self, project_count, role_count):
+    self.project.refresh_from_db()
+    self.role.refresh_from_db()
+    self.assertTrue(self.project.applied_count == project_count)
+    self.assertTrue(self.role.applied_count == role_count)
+
+  def test_can_update_many_applies_status(self):
+    """Assert applies are moved to status, reporting results by id"""
+    other = Apply.objects.create(project=Project.objects.create(name="other project", owner=self.owner), email="other@test.com")
+    ids = [apply.pk for apply in self.applies] + [other.pk]
+
+    response = self._update(ids, "confirmed-volunteer")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue([result["result"] for result in response.data["results"]] == ["updated"] * 4 + ["not_found"])
+    self.assertTrue([result["id"] for result in response.data["results"]] == ids)
+
+    self.assertTrue(Apply.objects.filter(project=self.project, status="confirmed-volunteer", canceled=False, canceled_date=None).count() == 4)
+    self._assert_counters(4, 4)
+
+    response = self._update(ids[:2], "confirmed-volunteer")
+    self.assertTrue([result["result"] for result in response.data["results"]] == ["unchanged"] * 2)
+
+  def test_bulk_unapply_updates_counters_and_notifies(self):
+    """Assert unapplied applies are canceled, counters adjusted and volunteers notified through the outbox, even if it's disabled"""
+    self._assert_counters(3, 3)
+    mail.outbox = []
+
+    response = self._update([apply.pk for apply in self.applies[:2]], "unapplied")
+    self.assertTrue(response.status_code == 200)
+
+    self.assertTrue(Apply.objects.filter(project=self.project, canceled=True, canceled_date__isnull=False).count() == 2)
+    self._assert_counters(1, 1)
+    self.assertTrue(len(mail.outbox) == 0)
+    self.assertTrue(OutboxEmail.objects.filter(template_name__startswith="volunteerUnapplied").count() == 4)
+
+    response = self._update([apply.pk for apply in self.applies], "not-volunteer")
+    self._assert_counters(4, 0)
+
+  def test_bulk_status_query_count_is_flat(self):
+    """Assert a bulk status update costs a constant number of queries"""
+    ids = []
+
+    def grow(size):
+      Apply.objects.filter(project=self.project).update(status="applied", canceled=False)
+      applies = [Apply(project=self.project, email="user{}_{}@test.com".format(size, i), role=self.role) for i in range(size)]
+      Apply.objects.bulk_create(applies)
+      ids[:] = Apply.objects.filter(project=self.project).values_list("pk", flat=True)[:size]
+
+    self.assertQueryCountIsFlat(grow, lambda: self._update(list(ids), "unapplied"))
+
+  def test_invalid_bulk_status(self):
+    """Assert invalid statuses and empty id lists are rejected"""
+    response = self._update([self.applies[0].pk], "invalid-status")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data["status"] == ["\"invalid-status\" is not a valid choice."])
+
+    response = self._update([], "applied")
+    self.assertTrue(response.status_code == 400)
+
+    response = self._update([self.applies[0].pk], "waitlisted")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data["status"] == ["\"waitlisted\" is not a valid choice."])
+    self.assertRaises(ValueError, update_applies_status, self.project, [self.applies[0].pk], "waitlisted")
+
+  def test_cant_update_status_while_unauthorized(self):
+    """Assert only project managers can update applies status"""
+    self.client.force_authenticate(user=User.objects.create_user(email="apply_user@gmail.com", password="apply_user"))
+    response = self._update([self.applies[0].pk], "unapplied")
+    self.assertTrue(response.status_code == 403)
+
+
+@skipIf(connection.vendor == "sqlite" and connection.is_in_memory_db(connection.settings_dict["NAME"]), "Threads need a file backed database")
+class ApplyConcurrencyTestCase(TransactionTestCase):
+  def setUp(self):
+    self.owner = User.objects.create_user(email="owner_user@gmail.com", password="test_owner")
+    self.project = Project.objects.create(name="test project", owner=self.owner)
+    self.role = VolunteerRole.objects.create(name="role", project=self.project, vacancies=10)
+    self.users = [User.objects.create_user(email="user{}@test.com".format(i), password="test") for i in range(4)]
+
+  def _run_concurrently(self, route, repeat=3):
+    """ Posts to route for every user from repeat threads at once. Returns response status codes """
+    barrier = threading.Barrier(len(self.users) * repeat)
+    codes = []
+
+    def post(user):
+      try:
+        client = APIClient()
+        client.force_authenticate(user=user)
+        barrier.wait()
+        codes.append(client.post(reverse(route, ["test-project"]), {"role": self.role.pk}, format="json").status_code)
+      finally:
+        connection.close()
+
+    threads = [threading.Thread(target=post, args=(user,)) for user in self.users for i in range(repeat)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return codes
+
+  def _assert_counters(self, count):
+    self.project.refresh_from_db()
+    self.role.refresh_from_db()
+    self.assertTrue(Apply.objects.filter(project=self.project, canceled=False).exclude(status="waitlisted").count() == count)
+    self.assertTrue(self.project.applied_count == count)
+    self.assertTrue(self.role.applied_count == count)
+
+  def test_concurrent_applies_and_unapplies_keep_counters(self):
+    """Assert repeated concurrent apply and unapply requests succeed and count each user once"""
+    codes = self._run_concurrently("project-applies-apply")
+    self.assertTrue(set(codes) == {200})
+    self.assertTrue(Apply.objects.filter(project=self.project).count() == len(self.users))
+    self._assert_counters(len(self.users))
+
+    codes = self._run_concurrently("project-applies-unapply")
+    self.assertTrue(set(codes) == {200})
+    self._assert_counters(0)
+
+    codes = self._run_concurrently("project-applies-apply")
+    self.assertTrue(set(codes) == {200})
+    self._assert_counters(len(self.users))
+
+  @override_settings(OVP_PROJECTS={"HARD_ROLE_CAPACITY": True})
+  def test_concurrent_applies_never_exceed_vacancies(self):
+    """Assert concurrent applies beyond role vacancies are waitlisted"""
+    VolunteerRole.objects.filter(pk=self.role.pk).update(vacancies=2)
+
+    codes = self._run_concurrently("project-applies-apply")
+    self.assertTrue(set(codes) == {200})
+    self._assert_counters(2)
+    self.assertTrue(Apply.objects.filter(project=self.project, status="waitlisted").count() == len(self.users) - 2)
@@ -1,18 +1,30 @@
+from django.db import connection
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
-from ovp_projects.models import Project
+from ovp_projects.models import Project, VolunteerRole, Apply, Job, JobDate
+from ovp_projects.tests.helpers import QueryBudgetMixin
+from ovp_projects import export
 from ovp_users.models import User
 from ovp_organizations.models import Organization
+from ovp_core.models import Cause, Skill, GoogleAddress
 
 from collections import OrderedDict
+from xml.etree import ElementTree
 
 import copy
+import csv
+import io
+import zipfile
 
 
+def without_ids(items):
+  return [{key: value for key, value in item.items() if key != "id"} for item in items]
+
 base_project = {"name": "test project", "slug": "test-cant-override-slug-on-creation", "details": "this is just a test project", "description": "the project is being tested", "minimum_age": 18, "address": {"typed_address": "r. tecainda, 81, sao paulo"}, "disponibility": {"type": "work", "work": {"description": "abc"}}, "causes": [{"id": 1}, {"id": 2}], "skills": [{"id": 3}, {"id": 4}]}
 
 @override_settings(OVP_PROJECTS={"CAN_CREATE_PROJECTS_WITHOUT_ORGANIZATION": True})
@@ -264,7 +276,7 @@ class ProjectWithOrganizationTestCase(TestCase):
     self.assertTrue(response.data["hidden_address"] == True)
 
 
-class ManageableProjectsRouteTestCase(TestCase):
+class ManageableProjectsRouteTestCase(QueryBudgetMixin, TestCase):
   def setUp(self):
     self.user = User.objects.create_user(email="test_can_create_project@gmail.com", password="testcancreate")
     self.user.save()
@@ -299,10 +311,258 @@ class ManageableProjectsRouteTestCase(TestCase):
     """Test hitting route authenticated returns projects"""
     response = self.client.get(reverse("project-manageable"), {}, format="json")
     self.assertTrue(response.status_code == 200)
-    self.assertTrue(len(response.data) == 3)
+    self.assertTrue(len(response.data["results"]) == 3)
+    self.assertTrue(response.data["next"] == None)
+
+  def test_projects_are_not_duplicated(self):
+    """Test projects are returned once when user matches through owner, organization owner and membership"""
+    self.organization.members.add(self.user)
+    self.organization.members.add(self.user2)
+
+    response = self.client.get(reverse("project-manageable"), {}, format="json")
+    self.assertTrue(sorted(p["name"] for p in response.data["results"]) == ["test project 1", "test project 2", "test project 3"])
+
+  def test_cursor_pagination(self):
+    """Test following next cursors returns every project once, most recently modified first"""
+    project = Project.objects.get(name="test project 1")
+    project.details = "modified"
+    project.save()
+
+    names = []
+    url = reverse("project-manageable") + "?page_size=2"
+    while url:
+      response = self.client.get(url, format="json")
+      self.assertTrue(response.status_code == 200)
+      self.assertTrue(len(response.data["results"]) <= 2)
+      names += [p["name"] for p in response.data["results"]]
+      url = response.data["next"]
+
+    self.assertTrue(names == ["test project 1", "test project 3", "test project 2"])
+
+  def test_invalid_cursor(self):
+    """Test an invalid cursor returns 404"""
+    response = self.client.get(reverse("project-manageable"), {"cursor": "invalid"}, format="json")
+    self.assertTrue(response.status_code == 404)
+
+  def test_filters(self):
+    """Test manageable can be filtered by published, closed and deleted"""
+    project = Project.objects.get(name="test project 1")
+    project.closed = True
+    project.save()
+
+    response = self.client.get(reverse("project-manageable"), {"closed": "true"}, format="json")
+    self.assertTrue([p["name"] for p in response.data["results"]] == ["test project 1"])
+
+    response = self.client.get(reverse("project-manageable"), {"closed": "false", "published": "false", "deleted": "false"}, format="json")
+    self.assertTrue(len(response.data["results"]) == 2)
+
+  def test_sparse_fields(self):
+    """Test fields parameter restricts the returned fields"""
+    response = self.client.get(reverse("project-manageable"), {"fields": "slug,name,disponibility"}, format="json")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(all(set(p.keys()) == set(["slug", "name", "disponibility"]) for p in response.data["results"]))
+
+    response = self.client.get(reverse("project-manageable"), {"fields": "slug,invalid"}, format="json")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data["fields"] == ["Invalid field names: invalid."])
+
+  def test_current_user_is_applied_query_count_is_flat(self):
+    """Test current_user_is_applied costs a single query regardless of the number of projects"""
+    def grow(size):
+      while Project.objects.count() < size:
+        project = Project(name="applied project", owner=self.user)
+        project.save()
+        Apply.objects.create(project=project, user=self.user, email=self.user.email)
+
+    def manageable():
+      response = self.client.get(reverse("project-manageable"), {"page_size": 100}, format="json")
+      self.assertTrue(response.status_code == 200)
+      results = response.data["results"]
+      self.assertTrue(len([p for p in results if p["current_user_is_applied"]]) == len(results) - 3)
+
+    self.assertQueryCountIsFlat(grow, manageable, sizes=(4, 10, 20))
 
 
 @override_settings(OVP_PROJECTS={"CAN_CREATE_PROJECTS_WITHOUT_ORGANIZATION": True})
+class ProjectSearchRouteTestCase(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_search@gmail.com", password="testsearch")
+    self.organization = Organization(name="Green Planet", type=0, owner=self.user)
+    self.organization.save()
+    self.cause = Cause.objects.create(name="Animal Welfare")
+
+    self.create_project("Beach cleanup", "Collect plastic from the beach")
+    self.create_project("Tree planting", "Plant native trees", organization=self.organization)
+    self.create_project("Dog shelter", "Walk the dogs").causes.add(self.cause)
+    self.create_project("Unpublished beach", "Beach cleanup draft", published=False)
+
+    self.client = APIClient()
+
+  def create_project(self, name, details, published=True, organization=None):
+    project = Project(name=name, details=details, owner=self.user, organization=organization, published=published)
+    project.save()
+    return project
+
+  def search(self, query, **params):
+    params["query"] = query
+    return self.client.get(reverse("project-search"), params, format="json")
+
+  def test_query_is_required(self):
+    """Test searching without terms returns 400"""
+    response = self.search("  ")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data == {"query": ["This field is required."]})
+
+  def test_search_published_projects(self):
+    """Test search matches name, details, organization and causes of published projects only"""
+    self.assertTrue([p["name"] for p in self.search("beach").data["results"]] == ["Beach cleanup"])
+    self.assertTrue([p["name"] for p in self.search("green").data["results"]] == ["Tree planting"])
+    self.assertTrue([p["name"] for p in self.search("welfare").data["results"]] == ["Dog shelter"])
+    self.assertTrue([p["name"] for p in self.search("plan").data["results"]] == ["Tree planting"])
+    self.assertTrue(self.search("volcano").data["results"] == [])
+
+  def test_search_document_is_updated(self):
+    """Test search document follows project fields, causes, skills and organization name changes"""
+    project = Project.objects.get(name="Beach cleanup")
+    project.name = "Sand castles"
+    project.details = "Collect glass bottles"
+    project.save()
+    self.assertTrue([p["name"] for p in self.search("bottles").data["results"]] == ["Sand castles"])
+    self.assertTrue(self.search("cleanup").data["results"] == [])
+
+    skill = Skill.objects.create(name="Swimming")
+    project.skills.add(skill)
+    self.assertTrue([p["name"] for p in self.search("swimming").data["results"]] == ["Sand castles"])
+
+    skill.project_set.clear()
+    self.assertTrue(self.search("swimming").data["results"] == [])
+
+    self.organization.name = "Blue Ocean"
+    self.organization.save()
+    self.assertTrue([p["name"] for p in self.search("ocean").data["results"]] == ["Tree planting"])
+
+  def test_results_are_ranked(self):
+    """Test projects matching the terms more often are ranked first"""
+    self.create_project("River cleanup", "River river river")
+    self.create_project("River trail", "Hike by the forest")
+
+    response = self.search("river")
+    self.assertTrue([p["name"] for p in response.data["results"]] == ["River cleanup", "River trail"])
+
+  def test_cursor_pagination(self):
+    """Test following next cursors returns every match once in rank order"""
+    for i in range(5):
+      self.create_project("Volunteer {}".format(i), "volunteer " * (i + 1))
+
+    names = []
+    response = self.search("volunteer", page_size=2)
+    while True:
+      self.assertTrue(len(response.data["results"]) <= 2)
+      names += [p["name"] for p in response.data["results"]]
+      if response.data["next"] is None:
+        break
+      response = self.client.get(response.data["next"], format="json")
+
+    self.assertTrue(names == ["Volunteer {}".format(i) for i in reversed(range(5))])
+
+  def test_query_count_is_flat(self):
+    """Test searching costs the same number of queries regardless of the number of matches"""
+    def grow(size):
+      while Project.objects.filter(name__startswith="Garden").count() < size:
+        project = self.create_project("Garden", "Community garden", organization=self.organization)
+        project.causes.add(self.cause)
+
+    self.assertQueryCountIsFlat(grow, lambda: self.search("garden"))
+
+
+class ProjectNearbyRouteTestCase(TestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_nearby@gmail.com", password="testnearby")
+
+    # Around Sao Paulo, at about 0km, 5km and 50km from the origin
+    self.center = self.create_project("Center", -23.5505, -46.6333)
+    self.near = self.create_project("Near", -23.5900, -46.6600)
+    self.far = self.create_project("Far", -23.9600, -46.3300)
+    self.create_project("Unpublished", -23.5505, -46.6333, published=False)
+
+    self.client = APIClient()
+
+  def create_project(self, name, latitude, longitude, published=True, hidden_address=False):
+    project = Project(name=name, details="details", owner=self.user, published=published, hidden_address=hidden_address)
+    project.save()
+    Project.objects.filter(pk=project.pk).update(latitude=latitude, longitude=longitude)
+    return project
+
+  def nearby(self, **params):
+    params.setdefault("lat", -23.5505)
+    params.setdefault("lng", -46.6333)
+    return self.client.get(reverse("project-nearby"), params, format="json")
+
+  def test_point_is_validated(self):
+    """Test nearby requires a valid point and radius"""
+    response = self.client.get(reverse("project-nearby"), {}, format="json")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(sorted(response.data.keys()) == ["lat", "lng"])
+
+    response = self.nearby(lat=91, radius=-1)
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(sorted(response.data.keys()) == ["lat", "radius"])
+
+  def test_returns_projects_within_radius(self):
+    """Test nearby returns published projects within radius ordered by distance"""
+    response = self.nearby(radius=10)
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue([p["name"] for p in response.data["results"]] == ["Center", "Near"])
+    self.assertTrue(response.data["results"][0]["distance"] == 0)
+    self.assertTrue(4 < response.data["results"][1]["distance"] < 6)
+    self.assertTrue(response.data["results"][1]["position"] == {"lat": -23.59, "lng": -46.66})
+
+    response = self.nearby(radius=100)
+    self.assertTrue([p["name"] for p in response.data["results"]] == ["Center", "Near", "Far"])
+
+  def test_hidden_address_exposes_coarse_position(self):
+    """Test projects with hidden address expose a coarse position, except to their owner"""
+    self.create_project("Hidden", -23.551234, -46.633456, hidden_address=True)
+
+    response = self.nearby(radius=1)
+    hidden = [p for p in response.data["results"] if p["name"] == "Hidden"][0]
+    self.assertTrue(hidden["position"] == {"lat": -23.55, "lng": -46.63})
+    self.assertTrue(hidden["address"] is None)
+
+    self.client.force_authenticate(user=self.user)
+    response = self.nearby(radius=1)
+    hidden = [p for p in response.data["results"] if p["name"] == "Hidden"][0]
+    self.assertTrue(hidden["position"] == {"lat": -23.551234, "lng": -46.633456})
+
+  def test_cursor_pagination(self):
+    """Test following next cursors returns every nearby project once"""
+    names = []
+    response = self.nearby(radius=100, page_size=1)
+    while True:
+      names += [p["name"] for p in response.data["results"]]
+      if response.data["next"] is None:
+        break
+      response = self.client.get(response.data["next"], format="json")
+
+    self.assertTrue(names == ["Center", "Near", "Far"])
+
+  def test_position_follows_address(self):
+    """Test project position is copied from its address when set and when the address is saved"""
+    address = GoogleAddress(typed_address="Rua. Teçaindá, 81")
+    address.save()
+    project = Project(name="With address", details="details", owner=self.user, address=address)
+    project.save()
+
+    stored = GoogleAddress.objects.values_list("lat", "lng").get(pk=address.pk)
+    self.assertTrue((project.latitude, project.longitude) == stored)
+
+    Project.objects.filter(pk=project.pk).update(latitude=None, longitude=None)
+    address.save()
+    project = Project.objects.get(pk=project.pk)
+    stored = GoogleAddress.objects.values_list("lat", "lng").get(pk=address.pk)
+    self.assertTrue((project.latitude, project.longitude) == stored)
+
+
 class ProjectResourceUpdateTestCase(TestCase):
   def setUp(self):
     self.user = User.objects.create_user(email="test_can_create_project@gmail.com", password="testcancreate")
@@ -375,7 +635,54 @@ class ProjectResourceUpdateTestCase(TestCase):
     response = self.client.patch(reverse("project-detail", ["test-project"]), updated_project, format="json")
 
     self.assertTrue(response.status_code == 200)
-    self.assertTrue(response.data["roles"] == updated_project["roles"])
+    self.assertTrue(without_ids(response.data["roles"]) == updated_project["roles"])
+
+  def test_update_roles_by_id(self):
+    """Test roles are diffed by id: changed roles keep their id, removed ones are deleted and new ones created"""
+    roles = [{"name": "keep", "vacancies": 1}, {"name": "change", "vacancies": 2}, {"name": "remove", "vacancies": 3}]
+    response = self.client.patch(reverse("project-detail", ["test-project"]), {"roles": roles}, format="json")
+    keep, change, remove = response.data["roles"]
+
+    project = Project.objects.get(pk=response.data["id"])
+    apply = Apply.objects.create(project=project, role_id=remove["id"], email="test@test.com")
+
+    roles = [{"id": keep["id"], "name": "keep", "vacancies": 1}, {"id": change["id"], "name": "changed", "vacancies": 5}, {"name": "new", "vacancies": 4}]
+    response = self.client.patch(reverse("project-detail", ["test-project"]), {"roles": roles}, format="json")
+    self.assertTrue(response.status_code == 200)
+
+    roles = VolunteerRole.objects.filter(project=project).order_by("pk")
+    self.assertTrue([role.name for role in roles] == ["keep", "changed", "new"])
+    self.assertTrue(roles[0].pk == keep["id"])
+    self.assertTrue(roles[1].pk == change["id"])
+    self.assertTrue(roles[1].vacancies == 5)
+    self.assertFalse(VolunteerRole.objects.filter(pk=remove["id"]).exists())
+    self.assertTrue(Apply.objects.get(pk=apply.pk).role is None)
+    self.assertTrue(Project.objects.get(pk=project.pk).max_applies_from_roles == 10)
+
+  def test_cant_update_role_from_another_project(self):
+    """Test role ids must belong to the updated project"""
+    role = VolunteerRole.objects.create(name="other", vacancies=1)
+    response = self.client.patch(reverse("project-detail", ["test-project"]), {"roles": [{"id": role.pk, "name": "test", "vacancies": 1}]}, format="json")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data["roles"][0]["id"] == ["Role with 'id' {} does not exist.".format(role.pk)])
+
+  def test_update_job_dates_by_id(self):
+    """Test job dates are diffed by id instead of recreating the job"""
+    dates = [{"name": "first", "start_date": "2013-01-29T12:34:56.123Z", "end_date": "2013-01-29T13:34:56.123Z"}, {"name": "second", "start_date": "2013-02-01T12:34:56.123Z", "end_date": "2013-02-01T13:34:56.123Z"}]
+    response = self.client.patch(reverse("project-detail", ["test-project"]), {"disponibility": {"type": "job", "job": {"dates": dates}}}, format="json")
+    first, second = response.data["disponibility"]["job"]["dates"]
+    job = Job.objects.get(project__slug="test-project")
+
+    dates = [{"id": first["id"], "name": "first", "start_date": "2013-01-30T12:34:56.123Z", "end_date": "2013-01-30T13:34:56.123Z"}, {"name": "third", "start_date": "2013-03-01T12:34:56.123Z", "end_date": "2013-03-01T13:34:56.123Z"}]
+    response = self.client.patch(reverse("project-detail", ["test-project"]), {"disponibility": {"type": "job", "job": {"dates": dates}}}, format="json")
+    self.assertTrue(response.status_code == 200)
+
+    job = Job.objects.get(pk=job.pk)
+    self.assertTrue([date.name for date in job.dates.order_by("pk")] == ["first", "third"])
+    self.assertTrue(job.dates.order_by("pk")[0].pk == first["id"])
+    self.assertFalse(JobDate.objects.filter(pk=second["id"]).exists())
+    self.assertTrue(response.data["disponibility"]["job"]["start_date"] == "2013-01-30T12:34:56.123000Z")
+    self.assertTrue(response.data["disponibility"]["job"]["end_date"] == "2013-03-01T13:34:56.123000Z")
 
 
 @override_settings(OVP_PROJECTS={"CAN_CREATE_PROJECTS_WITHOUT_ORGANIZATION": True})
@@ -501,8 +808,116 @@ class VolunteerRoleTestCase(TestCase):
     self.data["roles"] = [{"name": "test", "prerequisites": "test2", "details": "test3", "vacancies": 5, "applied_count": 0}]
     response = self.client.post(reverse("project-list"), self.data, format="json")
     self.assertTrue(response.status_code == 201)
-    self.assertTrue(response.data["roles"] == self.data["roles"])
+    self.assertTrue(without_ids(response.data["roles"]) == self.data["roles"])
 
     response = self.client.get(reverse("project-detail", ['test-project']), format="json")
     self.assertTrue(response.status_code == 200)
-    self.assertTrue(response.data["roles"] == self.data["roles"])
+    self.assertTrue(without_ids(response.data["roles"]) == self.data["roles"])
+
+  def test_roles_update_max_applies_from_roles(self):
+    """Test max_applies_from_roles is computed from created roles"""
+    self.data["roles"] = [{"name": "test", "vacancies": 5}, {"name": "test2", "vacancies": 3}]
+    response = self.client.post(reverse("project-list"), self.data, format="json")
+    self.assertTrue(response.status_code == 201)
+    self.assertTrue(Project.objects.get(pk=response.data["id"]).max_applies_from_roles == 8)
+
+  def test_create_query_count_is_flat(self):
+    """Test project creation query count does not grow with roles, causes and skills"""
+    def create(i, roles, causes, skills):
+      data = copy.copy(base_project)
+      data["name"] = "test project {}".format(i)
+      data["roles"] = [{"name": "role {}".format(r), "vacancies": 1} for r in range(roles)]
+      data["causes"] = [{"id": pk} for pk in Cause.objects.values_list("pk", flat=True)[:causes]]
+      data["skills"] = [{"id": pk} for pk in Skill.objects.values_list("pk", flat=True)[:skills]]
+
+      with CaptureQueriesContext(connection) as context:
+        response = self.client.post(reverse("project-list"), data, format="json")
+      self.assertTrue(response.status_code == 201)
+      return len(context.captured_queries)
+
+    # The first geocoded address creates address components later creates reuse
+    create(0, 0, 0, 0)
+    self.assertTrue(create(1, 1, 1, 1) == create(2, 10, 5, 8))
+
+  def test_cant_associate_inexistent_cause(self):
+    """Test associating inexistent causes returns an error for each missing id"""
+    self.data["causes"] = [{"id": 1}, {"id": 9999}]
+    response = self.client.post(reverse("project-list"), self.data, format="json")
+    self.assertTrue(response.status_code == 400)
+    self.assertTrue(response.data["causes"][0] == {})
+    self.assertTrue(response.data["causes"][1]["id"] == ["Cause with 'id' 9999 does not exist."])
+
+
+class ExportAppliedUsersTestCase(TestCase):
+  def setUp(self):
+    self.user = User.objects.create_user(email="test_export@gmail.com", password="testexport")
+    self.project = Project(name="test project", owner=self.user)
+    self.project.save()
+    Apply.objects.bulk_create([Apply(project=self.project, username="user {}".format(i), email="user{}@test.com".format(i), phone="123") for i in range(5)])
+
+    self.client = APIClient()
+    self.client.force_authenticate(user=self.user)
+
+  def _export(self, export_format=None):
+    params = {"format": export_format} if export_format else {}
+    return self.client.get(reverse("project-export-applied-users", [self.project.slug]), params)
+
+  def test_export_defaults_to_xlsx(self):
+    """Test exporting applied users defaults to streamed xlsx"""
+    response = self._export()
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response.streaming)
+    self.assertTrue(response["Content-Type"] == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    self.assertTrue(response["Content-Disposition"] == 'attachment; filename="test-project-applied-users.xlsx"')
+
+  def test_export_xls(self):
+    """Test exporting applied users as xls"""
+    response = self._export("xls")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response["Content-Type"] == "application/vnd.ms-excel")
+    self.assertTrue(response["Content-Disposition"] == 'attachment; filename="test-project-applied-users.xls"')
+
+  def test_export_csv(self):
+    """Test exporting applied users as streamed csv"""
+    response = self._export("csv")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response.streaming)
+    self.assertTrue(response["Content-Type"] == "text/csv")
+
+    rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode("utf-8"))))
+    self.assertTrue(len(rows) == 6)
+    self.assertTrue(rows[0] == ["User Name", "User Email", "User Phone", "Applied At", "Status"])
+    self.assertTrue(rows[1][:3] == ["user 0", "user0@test.com", "123"])
+    self.assertTrue(rows[5][4] == "applied")
+
+  def test_export_xlsx(self):
+    """Test exporting applied users as streamed xlsx"""
+    response = self._export("xlsx")
+    self.assertTrue(response.status_code == 200)
+    self.assertTrue(response.streaming)
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+    self.assertTrue(archive.testzip() is None)
+    sheet = archive.read("xl/worksheets/sheet1.xml").decode("utf-8")
+    self.assertTrue(sheet.count("<row>") == 6)
+    self.assertTrue("user4@test.com" in sheet)
+
+  def test_export_xlsx_strips_illegal_xml_characters(self):
+    """Test control characters XML can't hold are dropped from xlsx cells"""
+    Apply.objects.create(project=self.project, username="bad\x00 \x08name <&>", email="bad@test.com", phone="1\x1b23\t")
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(self._export("xlsx").streaming_content)))
+    sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+    cells = [cell.text for cell in sheet.iter("{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t")]
+    self.assertTrue(cells[-5:-2] == ["bad name <&>", "bad@test.com", "123\t"])
+
+  def test_rows_are_fetched_in_chunks(self):
+    """Test export rows are fetched with one query per chunk"""
+    with self.assertNumQueries(3):
+      rows = list(export.iter_rows(self.project.apply_set.all(), ["email"], chunk_size=2))
+    self.assertTrue(rows == [("user{}@test.com".format(i),) for i in range(5)])
+
+  def test_export_invalid_format(self):
+    """Test exporting with an unknown format returns 400"""
+    response = self._export("pdf")
+    self.assertTrue(response.status_code == 400)
@@ -0,0 +1,134 @@
+"""
+Bulk project transitions
+
+Projects are flipped in keyset ordered batches, each one inside a short
+transaction. Batch rows are locked with SELECT ... FOR UPDATE SKIP LOCKED
+where the database supports it, so several workers can process the same
+queryset in parallel without waiting on each other.
+"""
+
+from django.apps import apps
+from django.db import connections
+from django.db import transaction
+from django.utils import timezone
+
+from ovp_projects.cache import touch_projects
+from ovp_projects.emails import batch_outbox
+
+import time
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def bulk_transition(projects, name, now=None, values=None):
+  """ Flips flag name to True on loaded projects with a single UPDATE.
+
+  Project.run_transition side effects run on each instance in memory, so
+  no project is read or saved again, and owner emails are enqueued on
+  the outbox with a single insert. values are extra fields written along.
+  """
+  Project = apps.get_model('ovp_projects', 'Project')
+  now = now or timezone.now()
+  values = dict(values or {}, **{name: True, Project.TRANSITIONS[name][0]: now, 'modified_date': now})
+
+  with batch_outbox():
+    for project in projects:
+      setattr(project, name, True)
+      project.run_transition(name, now)
+      for field, value in values.items():
+        setattr(project, field, value)
+      project.snapshot_fields(list(values))
+
+  Project.objects.filter(pk__in=[project.pk for project in projects]).update(**values)
+  touch_projects([project.pk for project in projects])
+
+
+def lock_batch(queryset, batch_size):
+  """ Returns up to batch_size pks of queryset, ordered by pk and locked
+      for update. Rows locked by another transaction are skipped on
+      PostgreSQL. Django 1.10 has no skip_locked, so it's appended to the
+      compiled query. Backends without row locks just read the pks """
+  queryset = queryset.select_for_update().order_by('pk').values_list('pk', flat=True)[:batch_size]
+  connection = connections[queryset.db]
+
+  if connection.vendor != 'postgresql':
+    return list(queryset)
+
+  sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+  with connection.cursor() as cursor:
+    cursor.execute('{} SKIP LOCKED'.format(sql), params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run_in_batches(queryset, name, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, now=None, report=None, values=None):
+  """ Flips flag name to True on every project of queryset.
+
+  Each batch locks its rows, loads them with their owners and applies
+  bulk_transition(with values) in its own transaction. If dry_run is set, batches are
+  only selected. report(batch number, batch size, elapsed seconds) is
+  called after each batch. Returns the number of processed projects.
+  """
+  Project = apps.get_model('ovp_projects', 'Project')
+  now = now or timezone.now()
+  last_pk = None
+  total = 0
+  batch_number = 0
+
+  while True:
+    start = time.perf_counter()
+    batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+
+    with transaction.atomic():
+      pks = lock_batch(batch, batch_size)
+      if pks and not dry_run:
+        projects = list(Project.objects.filter(pk__in=pks).select_related('owner').order_by('pk'))
+        bulk_transition(projects, name, now, values)
+
+    if not pks:
+      break
+
+    last_pk = pks[-1]
+    total += len(pks)
+    batch_number += 1
+
+    if report:
+      report(batch_number, len(pks), time.perf_counter() - start)
+
+    if len(pks) < batch_size:
+      break
+
+  return total
+
+
+def close_finished_projects(batch_size=DEFAULT_BATCH_SIZE, since=None, dry_run=False, now=None, report=None):
+  """ Closes open projects whose job ended before now, optionally only
+      the ones which ended after since. Returns the number of projects """
+  Project = apps.get_model('ovp_projects', 'Project')
+  now = now or timezone.now()
+
+  projects = Project.objects.filter(closed=False, job__end_date__lt=now)
+  if since is not None:
+    projects = projects.filter(job__end_date__gte=since)
+
+  return run_in_batches(projects, 'closed', batch_size=batch_size, dry_run=dry_run, now=now, report=report)
+
+
+# Maps a flag to the date field scheduling it. Due projects are found
+# through the (flag, date) indexes and the schedule is cleared once
+# applied, so unpublishing or reopening a project later is not undone.
+SCHEDULED_TRANSITIONS = [('published', 'publish_at'), ('closed', 'close_at')]
+
+
+def run_scheduled_transitions(batch_size=DEFAULT_BATCH_SIZE, dry_run=False, now=None, report=None):
+  """ Publishes and closes projects whose publish_at and close_at are due.
+      Returns a {flag: number of projects} dict """
+  Project = apps.get_model('ovp_projects', 'Project')
+  now = now or timezone.now()
+
+  processed = {}
+  for name, schedule_field in SCHEDULED_TRANSITIONS:
+    projects = Project.objects.filter(**{name: False, '{}__lte'.format(schedule_field): now, 'deleted': False})
+    step_report = (lambda *args, name=name: report(name, *args)) if report else None
+    processed[name] = run_in_batches(projects, name, batch_size=batch_size, dry_run=dry_run, now=now, report=step_report, values={schedule_field: None})
+
+  return processed
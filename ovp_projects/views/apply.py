@@ -1,34 +1,54 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.db import IntegrityError
+from django.db import transaction
 
 from ovp_projects.serializers import apply as serializers
 from ovp_projects import models
 from ovp_projects import helpers
+from ovp_projects.applies import import_applies, transition_apply, update_applies_status
+from ovp_projects.parsers import CSVParser
+from ovp_projects.prefetch import apply_query_plan
+from ovp_projects.pagination import ApplyPagination
+from ovp_projects.identity import get_identity_map
 from ovp_projects.permissions import ProjectApplyPermission
 
 from rest_framework import decorators
+from rest_framework import exceptions
 from rest_framework import viewsets
+from rest_framework import parsers
 from rest_framework import permissions
 from rest_framework import response
 from rest_framework import status
 
+from collections import OrderedDict
+
+DEFAULT_IMPORT_MAX_ROWS = 10000
+DEFAULT_BULK_STATUS_MAX_IDS = 500
+
+
 class ApplyResourceViewSet(viewsets.GenericViewSet):
   """
   ApplyResourceViewSet resource endpoint
   """
+  pagination_class = ApplyPagination
 
   ##################
   # ViewSet routes #
   ##################
   def list(self, request, *arg, **kwargs):
-    applies = self.get_queryset(**kwargs)
-    serializer = self.get_serializer_class()(applies, many=True, context=self.get_serializer_context())
+    applies = self.filter_applies(self.get_queryset(**kwargs))
+    applies = apply_query_plan(applies, self.get_serializer_class())
 
-    return response.Response(serializer.data)
+    page = self.paginate_queryset(applies)
+    serializer = self.get_serializer_class()(page, many=True, context=self.get_serializer_context())
+
+    if request.accepted_renderer.format == 'csv':
+      # Tabular output holds only the rows, next page is linked on headers
+      return response.Response(serializer.data, headers=self.paginator.get_link_header())
+    return self.get_paginated_response(serializer.data)
 
   def partial_update(self, request, *args, **kwargs):
     instance = self.get_queryset(**kwargs).get(pk=kwargs['pk'])
+    instance.project = self.get_project_object(**kwargs) # Shared with permissions, avoids loading it again
     serializer = self.get_serializer(instance, data=request.data, partial=True, context=self.get_serializer_context())
     serializer.is_valid(raise_exception=True)
     serializer.save()
@@ -54,31 +74,72 @@ class ApplyResourceViewSet(viewsets.GenericViewSet):
       data['phone'] = user.phone
       data['user'] = user.id
 
-    try:
-      existing_apply = self.get_queryset(**kwargs).get(email=data['email'], canceled=True)
-      existing_apply.canceled = False
-      existing_apply.save()
-    except ObjectDoesNotExist:
+    # Applying is idempotent: canceled applies are reactivated, existing
+    # ones are kept and concurrent inserts are resolved by the unique
+    # (email, project) constraint
+    applies = self.get_queryset(**kwargs).filter(email=data.get('email', None))
+
+    if not data.get('email', None) or not self.reapply(applies):
       apply_sr = self.get_serializer_class()(data=data, context=self.get_serializer_context())
       apply_sr.is_valid(raise_exception=True)
-      apply_sr.save()
+
+      try:
+        with transaction.atomic():
+          apply_sr.save()
+      except IntegrityError:
+        # Another request inserted it first
+        if not self.reapply(applies): #pragma: no cover
+          raise
 
     return response.Response({'detail': 'Successfully applied.'}, status=status.HTTP_200_OK)
 
   @decorators.list_route(['POST'])
   def unapply(self, request, *args, **kwargs):
-    project = self.get_project_object(**kwargs)
-    user = request.user
+    applies = self.get_queryset(**kwargs).filter(email=request.user.email)
 
-    try:
-      existing_apply = self.get_queryset(**kwargs).get(email=user.email, canceled=False)
-      existing_apply.canceled = True
-      existing_apply.save()
-    except ObjectDoesNotExist:
+    # Unapplying twice is not an error, as long as the user applied once
+    if transition_apply(applies.filter(canceled=False), 'unapplied') is None and not applies.exists():
       return response.Response({'detail': 'This is user is not applied to this project.'}, status=status.HTTP_400_BAD_REQUEST)
 
     return response.Response({'detail': 'Successfully unapplied.'}, status=status.HTTP_200_OK)
 
+  @decorators.list_route(['POST'], url_path='import', parser_classes=(parsers.JSONParser, CSVParser))
+  def import_applies(self, request, *args, **kwargs):
+    """ Imports a list of applies, sent as JSON or CSV with username, email,
+        phone and role columns. The whole batch is validated before
+        anything is written """
+    project = self.get_project_object(**kwargs)
+    rows = request.data
+
+    max_rows = helpers.get_settings().get('APPLY_IMPORT_MAX_ROWS', DEFAULT_IMPORT_MAX_ROWS)
+    if isinstance(rows, list) and len(rows) > max_rows:
+      raise exceptions.ValidationError({'non_field_errors': ['Ensure this batch has no more than {} applies.'.format(max_rows)]})
+
+    context = self.get_serializer_context()
+    context['role_ids'] = set(project.roles.values_list('pk', flat=True))
+    serializer = self.get_serializer_class()(data=rows, many=True, context=context)
+    serializer.is_valid(raise_exception=True)
+
+    applies, skipped = import_applies(project, serializer.validated_data)
+
+    return response.Response({'detail': 'Successfully imported.', 'created': len(applies), 'skipped': skipped}, status=status.HTTP_200_OK)
+
+  @decorators.list_route(['POST'], url_path='status')
+  def bulk_status(self, request, *args, **kwargs):
+    """ Moves a list of applies to a status, reporting the result by id """
+    project = self.get_project_object(**kwargs)
+    serializer = self.get_serializer_class()(data=request.data, context=self.get_serializer_context())
+    serializer.is_valid(raise_exception=True)
+
+    ids = list(OrderedDict.fromkeys(serializer.validated_data['ids']))
+    max_ids = helpers.get_settings().get('APPLY_BULK_STATUS_MAX_IDS', DEFAULT_BULK_STATUS_MAX_IDS)
+    if len(ids) > max_ids:
+      raise exceptions.ValidationError({'ids': ['Ensure this field has no more than {} elements.'.format(max_ids)]})
+
+    results = update_applies_status(project, ids, serializer.validated_data['status'])
+
+    return response.Response({'results': [{'id': pk, 'result': results[pk]} for pk in ids]}, status=status.HTTP_200_OK)
+
 
   ###################
   # ViewSet methods #
@@ -87,6 +148,38 @@ class ApplyResourceViewSet(viewsets.GenericViewSet):
     project = self.get_project_object(**kwargs)
     return models.Apply.objects.filter(project=project)
 
+  def reapply(self, applies):
+    """ Reactivates the canceled apply on applies, if any. Returns whether
+        there's an apply, canceled or not, on applies """
+    return transition_apply(applies.filter(canceled=True), 'applied') is not None or applies.exists()
+
+  def filter_applies(self, applies):
+    """ Filters applies by status, role, canceled and search query params.
+        search matches username or email prefixes, case insensitively,
+        through the search indexes created by migration 0054 """
+    params = self.request.query_params
+
+    status = params.get('status', None)
+    if status:
+      applies = applies.filter(status__in=status.split(','))
+
+    role = params.get('role', None)
+    if role:
+      try:
+        applies = applies.filter(role=int(role))
+      except ValueError:
+        raise exceptions.ValidationError({'role': ['A valid integer is required.']})
+
+    canceled = params.get('canceled', None)
+    if canceled is not None:
+      applies = applies.filter(canceled=canceled.lower() in ['true', '1'])
+
+    search = params.get('search', None)
+    if search:
+      applies = helpers.filter_prefix(applies, ['username', 'email'], search)
+
+    return applies
+
   def get_serializer_class(self):
     if self.action == 'list':
       return serializers.ApplyRetrieveSerializer
@@ -97,10 +190,16 @@ class ApplyResourceViewSet(viewsets.GenericViewSet):
     if self.action in ['apply', 'unapply']:
       return serializers.ApplyCreateSerializer
 
+    if self.action == 'import_applies':
+      return serializers.ApplyImportSerializer
+
+    if self.action == 'bulk_status':
+      return serializers.ApplyBulkStatusSerializer
+
   def get_permissions(self):
     request = self.get_serializer_context()['request']
 
-    if self.action in ['list', 'partial_update']:
+    if self.action in ['list', 'partial_update', 'import_applies', 'bulk_status']:
       self.permission_classes = (permissions.IsAuthenticated, ProjectApplyPermission)
 
     if self.action == 'apply':
@@ -118,4 +217,4 @@ class ApplyResourceViewSet(viewsets.GenericViewSet):
   def get_project_object(self, *args, **kwargs):
     slug=kwargs.get('project_slug')
 
-    return get_object_or_404(models.Project, slug=slug)
+    return get_identity_map(self.request).get(models.Project.objects.select_related('organization'), slug=slug)
@@ -1,14 +1,31 @@
 from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 
 from ovp_projects.serializers import project as serializers
+from ovp_projects.serializers.apply import get_applied_project_ids
+from ovp_projects.serializers.address import can_see_hidden_address
 from ovp_projects import models
 from ovp_projects import helpers
+from ovp_projects import export
+from ovp_projects import cache
+from ovp_projects.prefetch import apply_query_plan
+from ovp_projects.pagination import ManageableProjectsPagination
+from ovp_projects.pagination import SearchPagination
+from ovp_projects.pagination import ProximityPagination
+from ovp_projects.serializers.address import ProximityQuerySerializer
+from ovp_projects.search import get_search_terms
+from ovp_projects.identity import get_identity_map
 from ovp_projects.permissions import ProjectCreateOwnsOrIsOrganizationMember
 from ovp_projects.permissions import ProjectRetrieveOwnsOrIsOrganizationMember
 
 from ovp_core.helpers.xls import Response as XLSResponse
 
+from ovp_organizations.models import Organization
+
 from rest_framework import decorators
+from rest_framework import exceptions
 from rest_framework import mixins
 from rest_framework import viewsets
 from rest_framework import permissions
@@ -17,11 +34,26 @@ from rest_framework import status
 
 from django.utils.translation import ugettext as _
 
+from collections import OrderedDict
+
+import itertools
+
 
 EXPORT_APPLIED_USERS_HEADERS = [
   _('User Name'), _('User Email'), _('User Phone'), _('Applied At'), _('Status')
   ]
 
+EXPORT_CONTENT_TYPES = {
+  'xls': 'application/vnd.ms-excel',
+  'csv': 'text/csv',
+  'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Serializers manageable can respond with, from the lightest to the heaviest
+MANAGEABLE_SERIALIZERS = [serializers.ProjectSearchSerializer, serializers.ProjectRetrieveSerializer]
+
+MANAGEABLE_FILTERS = ['published', 'closed', 'deleted']
+
 class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
   """
   ProjectResourceViewSet resource endpoint
@@ -29,6 +61,7 @@ class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
   queryset = models.Project.objects.all()
   lookup_field = 'slug'
   lookup_value_regex = '[^/]+' # default is [^/.]+ - here we're allowing dots in the url slug field
+  pagination_class = ManageableProjectsPagination
 
   ##################
   # ViewSet routes #
@@ -43,6 +76,43 @@ class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     headers = self.get_success_headers(serializer.data)
     return response.Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+  def retrieve(self, request, *args, **kwargs):
+    """ Serves the public payload from the retrieve cache when it's enabled,
+        layering fields which depend on request user on top of it.
+
+    With conditional retrieve enabled, responses carry ETag and
+    Last-Modified validators derived from the project content version and
+    matching requests get a 304 before anything is serialized.
+    """
+    if not (cache.is_retrieve_cache_enabled() or cache.is_conditional_retrieve_enabled()):
+      retrieved = super(ProjectResourceViewSet, self).retrieve(request, *args, **kwargs)
+      retrieved['Surrogate-Key'] = ' '.join(cache.get_surrogate_keys([self.get_object().pk]))
+      return retrieved
+
+    slug = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+    pk = cache.get_project_pk(slug, lambda: self.get_object().pk)
+    version = cache.get_project_version(pk)
+
+    headers = {'Surrogate-Key': ' '.join(cache.get_surrogate_keys([pk]))}
+    if cache.is_conditional_retrieve_enabled():
+      # Representations vary by user and by renderer
+      etag = cache.get_etag(pk, version, request.user.pk, request.accepted_renderer.format)
+      last_modified = version // 1000
+      headers.update({'ETag': quote_etag(etag), 'Last-Modified': http_date(last_modified)})
+
+      not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+      if not_modified is not None:
+        for name, value in headers.items():
+          not_modified[name] = value
+        return not_modified
+
+    if cache.is_retrieve_cache_enabled():
+      data = self.add_user_fields(cache.get_or_build(cache.get_retrieve_key(slug, version), self.build_retrieve_entry))
+    else:
+      data = self.get_serializer(self.get_object()).data
+
+    return response.Response(data, headers=headers)
+
   def partial_update(self, request, *args, **kwargs):
     """ We do not include the mixin as we want only PATCH and no PUT """
     instance = self.get_object()
@@ -51,7 +121,7 @@ class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     serializer.save()
 
     if getattr(instance, '_prefetched_objects_cache', None): #pragma: no cover
-      instance = self.get_object()
+      instance._prefetched_objects_cache = {}
       serializer = self.get_serializer(instance)
 
     return response.Response(serializer.data)
@@ -67,29 +137,167 @@ class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
   @decorators.detail_route(['GET'])
   def export_applied_users(self, request, *args, **kwargs):
     project = self.get_object()
+    export_format = request.query_params.get('format', 'xlsx')
 
-    applied_users = [EXPORT_APPLIED_USERS_HEADERS]
-    for apply in project.apply_set.all():
-      user = apply.user
-      applied_users.append([
-        apply.username, apply.email, apply.phone,
-        apply.date.strftime('%d/%m/%Y %T'), apply.status,
-        ])
+    if export_format not in EXPORT_CONTENT_TYPES:
+      raise exceptions.ValidationError({'format': ['Must be one of: {}.'.format(', '.join(sorted(EXPORT_CONTENT_TYPES)))]})
 
-    filename = '{}-applied-users.xls'.format(project.slug)
-    return XLSResponse(applied_users, filename, _('Applied Users'))
+    rows = itertools.chain([EXPORT_APPLIED_USERS_HEADERS], self.get_applied_users_rows(project))
+    filename = '{}-applied-users.{}'.format(project.slug, export_format)
+
+    # xls workbooks are built in memory, so they're only exported when asked for
+    if export_format == 'xls':
+      return XLSResponse(list(rows), filename, _('Applied Users'))
+
+    if export_format == 'csv':
+      content = export.iter_csv(rows)
+    if export_format == 'xlsx':
+      content = export.iter_xlsx(rows, _('Applied Users'))
+
+    response = StreamingHttpResponse(content, content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
 
   @decorators.list_route(['GET'])
   def manageable(self, request, *args, **kwargs):
-    projects = models.Project.objects.filter(Q(owner=request.user) | Q(organization__owner=request.user) | Q(organization__members=request.user))
+    # Organizations are matched through a subquery, joining members
+    # on the outer query would return a project once per member
+    organizations = Organization.objects.filter(Q(owner=request.user) | Q(members=request.user)).values('pk')
+    projects = self.get_queryset().filter(Q(owner=request.user) | Q(organization__in=organizations))
 
-    serializer = self.get_serializer_class()(projects, many=True, context=self.get_serializer_context())
-    return response.Response(serializer.data)
+    for name in MANAGEABLE_FILTERS:
+      value = request.query_params.get(name, None)
+      if value is not None:
+        projects = projects.filter(**{name: value.lower() in ['true', '1']})
+
+    page = self.paginate_queryset(projects)
+    fields = self.get_sparse_fields()
+
+    context = self.get_serializer_context()
+    if fields is None or 'current_user_is_applied' in fields:
+      context['applied_project_ids'] = get_applied_project_ids(request.user, [project.pk for project in page])
+
+    serializer = self.get_serializer_class()(page, many=True, context=context)
+    if fields is not None:
+      for name in list(serializer.child.fields):
+        if name not in fields:
+          serializer.child.fields.pop(name)
+
+    return self.get_paginated_response(serializer.data)
+
+  @decorators.list_route(['GET'], pagination_class=SearchPagination)
+  def search(self, request, *args, **kwargs):
+    self.get_search_query()
+    page = self.paginate_queryset(self.get_queryset().filter(published=True, deleted=False))
+    serializer = self.get_serializer_class()(page, many=True, context=self.get_serializer_context())
+    return self.get_paginated_response(serializer.data)
+
+  @decorators.list_route(['GET'], pagination_class=ProximityPagination)
+  def nearby(self, request, *args, **kwargs):
+    self.get_proximity_query()
+    page = self.paginate_queryset(self.get_queryset().filter(published=True, deleted=False))
+
+    context = self.get_serializer_context()
+    context['distances'] = self.paginator.ranks
+    serializer = self.get_serializer_class()(page, many=True, context=context)
+    return self.get_paginated_response(serializer.data)
 
 
   ###################
   # ViewSet methods #
   ###################
+  def build_retrieve_entry(self):
+    """ Returns the retrieve payload as seen by anonymous users, along with
+        the project data needed to layer user fields on it """
+    project = self.get_object()
+
+    context = self.get_serializer_context()
+    context['public_only'] = True
+    context['applied_project_ids'] = set()
+    data = self.get_serializer_class()(project, context=context).data
+
+    return {
+      'data': OrderedDict(data),
+      'project': {'pk': project.pk, 'hidden_address': project.hidden_address},
+    }
+
+  def add_user_fields(self, entry):
+    """ Returns a copy of a cached retrieve payload with request user fields """
+    data = OrderedDict(entry['data'])
+    user = self.request.user
+    if user.is_anonymous():
+      return data
+
+    pk = entry['project']['pk']
+    data['current_user_is_applied'] = pk in get_applied_project_ids(user, [pk])
+
+    if entry['project']['hidden_address']:
+      project = get_identity_map(self.request).get(models.Project.objects.select_related('organization', 'address'), pk=pk)
+      if can_see_hidden_address(self.request, project):
+        field = self.get_serializer_class()(project, context=self.get_serializer_context()).fields['address']
+        data['address'] = field.to_representation(project.address) if project.address else None
+
+    return data
+
+  def get_applied_users_rows(self, project):
+    """ Yields export rows for project applies, fetched in chunks """
+    fields = ['username', 'email', 'phone', 'date', 'status']
+    for username, email, phone, date, apply_status in export.iter_rows(project.apply_set.all(), fields):
+      yield [username, email, phone, date.strftime('%d/%m/%Y %T'), apply_status]
+
+  def perform_content_negotiation(self, request, force=False):
+    # export_applied_users reads ?format= as the export format, which is
+    # not a renderer format
+    if self.action == 'export_applied_users':
+      force = True
+    return super(ProjectResourceViewSet, self).perform_content_negotiation(request, force)
+
+  def get_queryset(self):
+    queryset = super(ProjectResourceViewSet, self).get_queryset()
+
+    if self.action == 'retrieve':
+      queryset = apply_query_plan(queryset, self.get_serializer_class())
+
+    if self.action == 'manageable':
+      queryset = apply_query_plan(queryset, self.get_serializer_class(), self.get_sparse_fields())
+
+    if self.action in ['search', 'nearby']:
+      queryset = apply_query_plan(queryset, self.get_serializer_class())
+
+    return queryset
+
+  def get_object(self):
+    """ Loads the project through the request identity map, so permissions
+        and routes share the same instance """
+    lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+    obj = get_identity_map(self.request).get(self.filter_queryset(self.get_queryset()), **lookup)
+    self.check_object_permissions(self.request, obj)
+    return obj
+
+  def get_proximity_query(self):
+    """ Returns the validated lat, lng and radius query params of nearby """
+    if not hasattr(self, '_proximity_query'):
+      serializer = ProximityQuerySerializer(data=self.request.query_params)
+      serializer.is_valid(raise_exception=True)
+      self._proximity_query = serializer.validated_data
+    return self._proximity_query
+
+  def get_search_query(self):
+    """ Returns the terms of the query param of search, which is required """
+    if not hasattr(self, '_search_query'):
+      terms = get_search_terms(self.request.query_params.get('query', ''))
+      if not terms:
+        raise exceptions.ValidationError({'query': [_('This field is required.')]})
+      self._search_query = terms
+    return self._search_query
+
+  def get_sparse_fields(self):
+    """ Returns the field names requested through ?fields= or None """
+    fields = self.request.query_params.get('fields', None)
+    if not fields:
+      return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
   def get_permissions(self):
     request = self.get_serializer_context()['request']
     if self.action == 'create':
@@ -107,6 +315,9 @@ class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     if self.action == 'manageable':
       self.permission_classes = (permissions.IsAuthenticated, )
 
+    if self.action in ['search', 'nearby']:
+      self.permission_classes = ()
+
     if self.action == 'close':
       self.permission_classes = (permissions.IsAuthenticated, ProjectRetrieveOwnsOrIsOrganizationMember)
 
@@ -116,10 +327,27 @@ class ProjectResourceViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
     if self.action in ['create', 'partial_update']:
       return serializers.ProjectCreateUpdateSerializer
     if self.action == 'manageable':
-      return serializers.ProjectRetrieveSerializer
+      return self.get_manageable_serializer_class()
     if self.action == 'close':
       return serializers.ProjectRetrieveSerializer
     if self.action == 'retrieve':
       return serializers.ProjectRetrieveSerializer
+    if self.action == 'search':
+      return serializers.ProjectSearchSerializer
+    if self.action == 'nearby':
+      return serializers.ProjectProximitySerializer
 
     return serializers.ProjectRetrieveSerializer
+
+  def get_manageable_serializer_class(self):
+    """ Returns the lightest serializer including every requested field """
+    fields = self.get_sparse_fields()
+    if fields is None:
+      return serializers.ProjectRetrieveSerializer
+
+    for serializer_class in MANAGEABLE_SERIALIZERS:
+      if set(fields) <= set(serializer_class.Meta.fields):
+        return serializer_class
+
+    invalid = sorted(set(fields) - set(MANAGEABLE_SERIALIZERS[-1].Meta.fields))
+    raise exceptions.ValidationError({'fields': ['Invalid field names: {}.'.format(', '.join(invalid))]})